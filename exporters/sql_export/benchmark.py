@@ -0,0 +1,161 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+"""Offline benchmark of the cache and the full export.
+
+Populates a `GQLLoraCache` from a synthetic organisation served by `FakeMOSession`,
+and exports the cache to SQLite with `SqlExport.perform_export`, reporting the
+wall time, the peak RSS and the rows per second of each step. No MO instance is
+needed:
+
+    python -m sql_export.benchmark --units 1000 --employees 20000
+
+The cache can also be populated from a recording of a real fetch, see replay.py:
+
+    python -m sql_export.benchmark --replay recording.jsonl.gz
+"""
+
+import asyncio
+import contextlib
+import resource
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+from typing import Callable
+
+import click
+
+from .config import GqlLoraCacheSettings
+from .fake_mo import FakeMOSession
+from .fake_mo import SyntheticOrganisation
+from .gql_lora_cache_async import GQLLoraCache
+from .replay import ReplaySession
+from .sql_export import SqlExport
+
+
+@dataclass
+class StepResult:
+    name: str
+    seconds: float
+    rows: int
+    # Of the process so far, as the peak cannot be reset
+    peak_rss_bytes: int
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _timed(name: str, step: Callable[[], int]) -> StepResult:
+    start = time.perf_counter()
+    rows = step()
+    return StepResult(
+        name=name,
+        seconds=time.perf_counter() - start,
+        rows=rows,
+        peak_rss_bytes=peak_rss_bytes(),
+    )
+
+
+def run_benchmark(
+    session: Any,
+    workdir: Path,
+    page_size: int = 300,
+    full_history: bool = False,
+) -> list[StepResult]:
+    """Time populating the cache from `session` and exporting it, in `workdir`.
+
+    The rows of populating the cache are the objects fetched, and the rows of the
+    export are the rows written to the work tables.
+    """
+    lc = GQLLoraCache(
+        resolve_dar=False,
+        full_history=full_history,
+        settings=GqlLoraCacheSettings(std_page_size=page_size),
+    )
+    lc._gql_client_session = session
+    sql_export = SqlExport(
+        historic=full_history,
+        settings={
+            "exporters.actual_state.type": "SQLite",
+            "exporters.actual_state.db_name": str(workdir / "benchmark"),
+            "exporters.actual_state_historic.type": "SQLite",
+            "exporters.actual_state_historic.db_name": str(workdir / "benchmark"),
+        },
+    )
+
+    def populate_cache() -> int:
+        asyncio.run(lc.populate_cache_async())
+        return sum(stats.objects for stats in lc.fetch_stats.values())
+
+    def perform_export() -> int:
+        sql_export.lc = lc
+        sql_export.perform_export(resolve_dar=False)
+        return sum(stats.rows for stats in sql_export.stats.tables.values())
+
+    # The cache writes its snapshot to tmp/ in the working directory
+    with contextlib.chdir(workdir):
+        return [
+            _timed("populate_cache_async", populate_cache),
+            _timed("perform_export", perform_export),
+        ]
+
+
+@click.command(help="Benchmark the SQL export against a synthetic organisation")
+@click.option("--units", default=1000, show_default=True)
+@click.option("--employees", default=10000, show_default=True)
+@click.option("--depth", default=6, show_default=True, help="Depth of the unit tree")
+@click.option("--history", default=2, show_default=True, help="Validities per object")
+@click.option("--page-size", default=300, show_default=True)
+@click.option("--latency", default=0.0, show_default=True, help="Seconds per query")
+@click.option("--full-history", is_flag=True)
+@click.option("--seed", default=0, show_default=True)
+@click.option(
+    "--replay",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="Replay a recording instead of a synthetic organisation",
+)
+@click.option("--replay-latency", is_flag=True, help="Replay the recorded latency")
+def cli(
+    units: int,
+    employees: int,
+    depth: int,
+    history: int,
+    page_size: int,
+    latency: float,
+    full_history: bool,
+    seed: int,
+    replay: Path | None,
+    replay_latency: bool,
+) -> None:
+    session: FakeMOSession | ReplaySession
+    if replay is not None:
+        session = ReplaySession(replay, latency=replay_latency)
+    else:
+        organisation = SyntheticOrganisation(
+            units=units, employees=employees, depth=depth, history=history, seed=seed
+        )
+        session = FakeMOSession(organisation, latency=latency)
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run_benchmark(
+            session, Path(workdir), page_size=page_size, full_history=full_history
+        )
+    click.echo(f"{'step':<24}{'seconds':>10}{'rows':>10}{'rows/s':>10}{'peak MiB':>10}")
+    for result in results:
+        click.echo(
+            f"{result.name:<24}{result.seconds:>10.2f}{result.rows:>10}"
+            f"{result.rows_per_second:>10.0f}{result.peak_rss_bytes / 2**20:>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,179 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+"""Bulk loading of the work tables of a full export.
+
+Adding ORM instances to a session one at a time makes the unit of work dominate
+the time spent loading the work tables. Instead, the `_generate_sql_*` methods of
+`SqlExport` are handed a `RowFactory` in place of the model class, so they build
+plain rows, which a `TableLoader` writes with the fastest method of the database:
+
+* PostgreSQL: `COPY ... FROM STDIN`
+* MS-SQL through pymssql: the bulk copy interface of the connection
+* Other databases: a Core `insert()` executed with many parameter sets, which uses
+  `fast_executemany` on pyodbc
+
+SQLite, and any unknown database, keeps using the ORM.
+"""
+
+import io
+import logging
+import time
+from enum import Enum
+from typing import Any
+
+from sqlalchemy import Column
+from sqlalchemy import Table
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from .export_stats import WriteStats
+
+logger = logging.getLogger(__name__)
+
+
+def copy_field(value: Any) -> str:
+    """Return `value` as a field of the CSV format of PostgreSQL's COPY.
+
+    NULL is the unquoted `\\N`, while every string is quoted, so neither an
+    empty string nor the string `\\N` is taken for NULL.
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+class LoadMethod(Enum):
+    ORM = "orm"
+    EXECUTEMANY = "executemany"
+    COPY = "copy"
+    BULK_COPY = "bulk_copy"
+
+
+def choose_load_method(session: Session, bulk_load: bool = True) -> LoadMethod:
+    """Return the fastest load method supported by the database of the session."""
+    if not bulk_load:
+        return LoadMethod.ORM
+    dialect = session.get_bind().dialect
+    if dialect.name == "postgresql" and dialect.driver == "psycopg2":
+        return LoadMethod.COPY
+    if dialect.name == "mssql" and dialect.driver == "pymssql":
+        return LoadMethod.BULK_COPY
+    if dialect.name in ("postgresql", "mssql", "mysql"):
+        return LoadMethod.EXECUTEMANY
+    return LoadMethod.ORM
+
+
+class RowFactory:
+    """Stand-in for a model class, building a dict of column values.
+
+    Exposes `__table__` like the model, as some `_generate_sql_*` methods use it to
+    find the columns of the model.
+    """
+
+    def __init__(self, model: Any) -> None:
+        self.model = model
+        self.__table__: Table = model.__table__
+
+    def __call__(self, **values: Any) -> dict[str, Any]:
+        return values
+
+
+class TableLoader:
+    """Loads rows into a single table in chunks.
+
+    Rows are added with `add` and written every `chunk_size` rows, each chunk in
+    its own transaction. `model` is what should be passed to the `_generate_sql_*`
+    methods: the model class itself for the ORM method, otherwise a `RowFactory`.
+    Call `flush` once all rows have been added.
+    """
+
+    def __init__(
+        self, session: Session, model: Any, method: LoadMethod, chunk_size: int
+    ) -> None:
+        self.session = session
+        self.method = method
+        self.chunk_size = chunk_size
+        self.model = model if method == LoadMethod.ORM else RowFactory(model)
+        self.table: Table = model.__table__
+        # Autoincrementing primary keys are generated by the database
+        self.columns: list[Column] = [
+            column
+            for column in self.table.columns
+            if column is not self.table.autoincrement_column
+        ]
+        self._rows: list[Any] = []
+        self.stats = WriteStats()
+
+    def add(self, row: Any) -> None:
+        if self.method == LoadMethod.ORM:
+            self.session.add(row)
+        self._rows.append(row)
+        if len(self._rows) >= self.chunk_size:
+            self.flush()
+
+    def add_all(self, rows: Any) -> None:
+        for row in rows:
+            self.add(row)
+
+    def flush(self) -> None:
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        start = time.monotonic()
+        if self.method == LoadMethod.ORM:
+            pass
+        elif self.method == LoadMethod.COPY:
+            self._copy(rows)
+        elif self.method == LoadMethod.BULK_COPY:
+            self._bulk_copy(rows)
+        else:
+            self._executemany(rows)
+        self.session.commit()
+        self.stats.observe(len(rows), time.monotonic() - start)
+
+    def _tuples(self, rows: list[dict[str, Any]]) -> list[tuple]:
+        keys = [column.key for column in self.columns]
+        return [tuple(row.get(key) for key in keys) for row in rows]
+
+    def _executemany(self, rows: list[dict[str, Any]]) -> None:
+        keys = [column.key for column in self.columns]
+        parameters = [{key: row.get(key) for key in keys} for row in rows]
+        self.session.execute(insert(self.table), parameters)
+
+    def _copy(self, rows: list[dict[str, Any]]) -> None:
+        preparer = self.session.get_bind().dialect.identifier_preparer
+        table = preparer.format_table(self.table)
+        columns = ", ".join(preparer.format_column(column) for column in self.columns)
+        buffer = io.StringIO()
+        buffer.writelines(
+            ",".join(map(copy_field, values)) + "\n" for values in self._tuples(rows)
+        )
+        buffer.seek(0)
+        cursor = self.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                buffer,
+            )
+        finally:
+            cursor.close()
+
+    def _bulk_copy(self, rows: list[dict[str, Any]]) -> None:
+        dbapi_connection = self.session.connection().connection.dbapi_connection
+        mssql_connection = getattr(dbapi_connection, "_conn", None)
+        if not hasattr(mssql_connection, "bulk_copy"):
+            # Bulk copy was added in pymssql 2.2.8
+            logger.warning("pymssql does not support bulk copy, using executemany")
+            self.method = LoadMethod.EXECUTEMANY
+            self._executemany(rows)
+            return
+        all_columns = list(self.table.columns)
+        column_ids = [all_columns.index(column) + 1 for column in self.columns]
+        mssql_connection.bulk_copy(  # type: ignore
+            self.table.name, self._tuples(rows), column_ids=column_ids
+        )
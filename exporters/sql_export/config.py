@@ -1,7 +1,9 @@
 # SPDX-FileCopyrightText: Magenta ApS
 #
 # SPDX-License-Identifier: MPL-2.0
+import datetime
 from functools import lru_cache
+from pathlib import Path
 from typing import Any
 
 from fastramqpi.ra_utils.job_settings import JobSettings
@@ -21,6 +23,69 @@ class GqlLoraCacheSettings(JobSettings):  # type: ignore
     prometheus_pushgateway: str = "pushgateway"
     mox_base: str = "http://mo:5000/lora"
     std_page_size: int = 300
+    # Adapt the page size of each collection to the observed latency and payload
+    # size, starting from std_page_size
+    adaptive_page_size: bool = True
+    min_page_size: int = 10
+    max_page_size: int = 2000
+    page_target_seconds: float = 10.0
+    # Also keep the pages below this many bytes. Measuring a page serialises it
+    # again, which costs about as much as decoding it, so pages are only
+    # measured when this is set.
+    page_max_bytes: int | None = None
+    # Number of pages fetched ahead of the page being processed, per query
+    prefetch_pages: int = 1
+    # Maximum number of GraphQL queries in flight at once, across all collections
+    max_concurrent_queries: int = 4
+    # Collections are served in this order when waiting for a free query slot.
+    # Collections not listed come last.
+    priority_collections: tuple[str, ...] = (
+        "facets",
+        "classes",
+        "itsystems",
+        "units",
+        "users",
+        "managers",
+        "leaves",
+        "kles",
+        "related",
+        "it_connections",
+        "associations",
+        "engagements",
+        "addresses",
+    )
+    # Record the GraphQL queries and responses to this gzipped file, see replay.py
+    graphql_record_path: Path | None = None
+    # Serve the GraphQL queries from such a recording instead of MO, taking as long
+    # as the recorded queries did if graphql_replay_latency is set
+    graphql_replay_path: Path | None = None
+    graphql_replay_latency: bool = False
+    # Compute the locations and inherited managers of the units from the unit tree,
+    # instead of fetching the ancestors and inherited managers of every unit
+    local_unit_tree: bool = False
+    # Fetch the full history of each collection in shards of this many objects,
+    # concurrently, checkpointing every shard so a failed fetch can be resumed.
+    # See history_shards.py.
+    history_shard_size: int | None = None
+    # Attempts at fetching a shard, on top of the retries of every query
+    history_shard_attempts: int = 3
+    # Checkpoints older than this are fetched again
+    history_shard_max_age: datetime.timedelta | None = datetime.timedelta(days=1)
+    # Keep the DAR addresses resolved in this SQLite file across runs, and only
+    # resolve those missing or older than dar_cache_ttl, rather than having MO
+    # resolve every DAR address. See dar_cache.py.
+    dar_cache_path: Path | None = None
+    dar_cache_ttl: datetime.timedelta = datetime.timedelta(days=30)
+    # Store cache objects as compact, read-only records instead of dicts
+    compact_records: bool = True
+    # Snapshots older than this are not used when reading from cache
+    snapshot_max_age: datetime.timedelta | None = None
+    # Refresh the cache from the last snapshot with the objects changed in MO since,
+    # instead of fetching everything
+    incremental_refresh: bool = False
+    # Do a full refresh when the last one is older than this, even when refreshing
+    # incrementally
+    full_refresh_interval: datetime.timedelta = datetime.timedelta(days=7)
 
     def to_old_settings(self) -> dict[str, Any]:
         """Convert our DatabaseSettings to a settings.json format.
@@ -79,6 +144,17 @@ class DatabaseSettings(JobSettings):
     log_overlapping_aak: bool = False
     use_new_cache: bool = False
     primary_manager_responsibility: str | None = None
+    # Load the work tables of a full export with the bulk load method of the
+    # database rather than through the ORM
+    bulk_load: bool = True
+    # Write the work tables of a full export while fetching from MO, instead of
+    # filling the whole cache first
+    streaming_export: bool = False
+    # Number of work tables of a full export loaded in parallel
+    export_workers: int = 1
+    # Write only the changed rows of a full export to the current tables, instead
+    # of loading the work tables and swapping them in
+    differential_export: bool = False
 
     def to_old_settings(self) -> dict[str, Any]:
         """Convert our DatabaseSettings to a settings.json format.
@@ -110,6 +186,10 @@ class DatabaseSettings(JobSettings):
             ),
             "primary_manager_responsibility": self.primary_manager_responsibility,
             "exporters.actual_state.manager_responsibility_class": self.primary_manager_responsibility,
+            "exporters.actual_state.bulk_load": self.bulk_load,
+            "exporters.actual_state.streaming": self.streaming_export,
+            "exporters.actual_state.export_workers": self.export_workers,
+            "exporters.actual_state.differential": self.differential_export,
             "use_new_cache": self.use_new_cache,
         }
         if self.historic_state is not None:
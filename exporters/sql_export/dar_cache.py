@@ -0,0 +1,149 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+"""Persistent cache of DAR addresses, shared across runs.
+
+DAR addresses almost never change, yet every export used to have MO resolve all
+of them again. `PersistentDARCache` keeps the DAR replies in an SQLite file keyed
+by the DAR uuid, along with when each was fetched. Only the addresses missing
+from the file, or fetched longer than the TTL ago, are resolved, in bulk. The
+file can be shared by several jobs, see `integrations/dawa_helper.py`.
+"""
+
+import contextlib
+import datetime
+import json
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from uuid import UUID
+
+from fastramqpi.os2mo_dar_client import AsyncDARClient
+from more_itertools import chunked
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of parameters of a statement
+_CHUNK_SIZE = 500
+
+
+class PersistentDARCache:
+    """DAR replies stored in the SQLite file at `path`, valid for `ttl`.
+
+    `table` separates the kinds of lookups sharing the file, such as addresses by
+    uuid and uuids by address text. Lookups are counted in `hits`, `misses` and
+    `expired`.
+    """
+
+    def __init__(
+        self, path: Path, ttl: datetime.timedelta, table: str = "adresser"
+    ) -> None:
+        if not table.isidentifier():
+            raise ValueError(f"Invalid table name: {table}")
+        self.path = path
+        self.ttl = ttl
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        with self._connect() as connection:
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "nøgle TEXT PRIMARY KEY, svar TEXT NOT NULL, hentet REAL NOT NULL)"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # A connection per operation, as the cache is used from several threads
+        with contextlib.closing(sqlite3.connect(self.path)) as connection:
+            with connection:
+                yield connection
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, Any]:
+        """Return the replies of `keys` which are cached and have not expired."""
+        keys = set(keys)
+        oldest = time.time() - self.ttl.total_seconds()
+        found: dict[str, Any] = {}
+        expired = 0
+        with self._connect() as connection:
+            for chunk in chunked(sorted(keys), _CHUNK_SIZE):
+                rows = connection.execute(
+                    f"SELECT nøgle, svar, hentet FROM {self.table} "
+                    f"WHERE nøgle IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for key, reply, fetched in rows:
+                    if fetched < oldest:
+                        expired += 1
+                        continue
+                    found[key] = json.loads(reply)
+        self.hits += len(found)
+        self.expired += expired
+        self.misses += len(keys) - len(found) - expired
+        return found
+
+    def get(self, key: str) -> Any | None:
+        return self.get_many([key]).get(key)
+
+    def put_many(self, replies: dict[str, Any]) -> None:
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (nøgle, svar, hentet) "
+                "VALUES (?, ?, ?)",
+                [(key, json.dumps(reply), now) for key, reply in replies.items()],
+            )
+
+    def put(self, key: str, reply: Any) -> None:
+        self.put_many({key: reply})
+
+    async def resolve(
+        self,
+        keys: Iterable[str],
+        fetch: Callable[[set[str]], Awaitable[dict[str, Any]]],
+    ) -> dict[str, Any]:
+        """Return the replies of `keys`, fetching those not cached with `fetch`.
+
+        Keys which `fetch` cannot resolve are left out, and are fetched again next
+        time.
+        """
+        keys = set(keys)
+        found = self.get_many(keys)
+        missing = keys - found.keys()
+        if missing:
+            fetched = await fetch(missing)
+            self.put_many(fetched)
+            found.update(fetched)
+        return found
+
+    def log_stats(self) -> None:
+        logger.info(
+            f"DAR cache: {self.hits} hits, {self.misses} misses, {self.expired} expired"
+        )
+
+
+async def fetch_dar_addresses(uuids: set[str]) -> dict[str, Any]:
+    """Fetch the addresses of `uuids` from DAR, in bulk.
+
+    Values which are not UUIDs cannot be DAR addresses, and are left out.
+    """
+    # The values as found in MO, by the UUIDs they are parsed as
+    parsed: dict[UUID, str] = {}
+    for value in uuids:
+        try:
+            parsed[UUID(value)] = value
+        except (TypeError, ValueError):
+            logger.warning(f"Not a DAR address: {value!r}")
+    if not parsed:
+        return {}
+    async with AsyncDARClient() as client:
+        found, missing = await client.fetch(set(parsed))
+    if missing:
+        logger.warning(f"{len(missing)} addresses not found in DAR")
+    return {parsed[uuid]: reply for uuid, reply in found.items()}
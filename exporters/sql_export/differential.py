@@ -0,0 +1,148 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+"""Differential loading of the actual state tables.
+
+Instead of loading a fresh copy of every table and swapping it in, a `TableDiffer`
+compares the rows of the export with the rows of the live table, and only writes
+the difference. Rows are compared by their fingerprint, see `Compare.fingerprint`.
+An exported row without an identical live row replaces a live row with the same
+uuid (or `leder_uuid` for manager responsibilities) which has no identical
+exported row, by updating it. Exported rows left over are inserted, and live rows
+left over are deleted.
+"""
+
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any
+
+from more_itertools import chunked
+from more_itertools import one
+from sqlalchemy import Table
+from sqlalchemy import bindparam
+from sqlalchemy import delete
+from sqlalchemy import insert
+from sqlalchemy import select
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from .bulk_load import RowFactory
+from .export_stats import WriteStats
+from .sql_table_defs import fingerprint_columns
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ChangeCounts:
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+
+    def __add__(self, other: "ChangeCounts") -> "ChangeCounts":
+        return ChangeCounts(
+            inserted=self.inserted + other.inserted,
+            updated=self.updated + other.updated,
+            deleted=self.deleted + other.deleted,
+        )
+
+
+class TableDiffer:
+    """Applies the difference between the added rows and a live table.
+
+    Has the interface of `TableLoader`: rows built with `model` are added with
+    `add`, and `flush` writes the changes once all rows have been added. The
+    changes are written in chunks of `chunk_size` rows, each chunk in its own
+    transaction.
+    """
+
+    def __init__(self, session: Session, model: Any, chunk_size: int) -> None:
+        self.session = session
+        self.chunk_size = chunk_size
+        self.model = RowFactory(model)
+        self.table: Table = model.__table__
+        self.primary_key = one(self.table.primary_key.columns)
+        self.columns = fingerprint_columns(self.table)
+        self.key = "uuid" if "uuid" in self.columns else "leder_uuid"
+        self.counts = ChangeCounts()
+        self.stats = WriteStats()
+        self._live = self._read_live()
+        self._new: list[dict[str, Any]] = []
+
+    def _read_live(self) -> dict[tuple, list[Any]]:
+        """Return the primary keys of the live rows, by fingerprint."""
+        columns = [self.table.c[key] for key in self.columns]
+        if self.primary_key.key in self.columns:
+            primary_key_index = self.columns.index(self.primary_key.key)
+        else:
+            columns.append(self.primary_key)
+            primary_key_index = len(self.columns)
+        live: dict[tuple, list[Any]] = defaultdict(list)
+        rows = self.session.execute(
+            select(*columns).execution_options(yield_per=self.chunk_size)
+        )
+        for row in rows:
+            live[tuple(row[: len(self.columns)])].append(row[primary_key_index])
+        return live
+
+    def add(self, row: dict[str, Any]) -> None:
+        primary_keys = self._live.get(tuple(row.get(key) for key in self.columns))
+        if primary_keys:
+            # Unchanged
+            primary_keys.pop()
+        else:
+            self._new.append(row)
+
+    def add_all(self, rows: Any) -> None:
+        for row in rows:
+            self.add(row)
+
+    def flush(self) -> None:
+        start = time.monotonic()
+        key_index = self.columns.index(self.key)
+        removed: dict[Any, list[Any]] = defaultdict(list)
+        for values, primary_keys in self._live.items():
+            removed[values[key_index]].extend(primary_keys)
+        self._live = {}
+
+        updates = []
+        inserts = []
+        for row in self._new:
+            values = {key: row.get(key) for key in self.columns}
+            primary_keys = removed.get(row.get(self.key))
+            if primary_keys:
+                updates.append({"_primary_key": primary_keys.pop(), **values})
+            else:
+                inserts.append(values)
+        self._new = []
+        deletes = [
+            primary_key
+            for primary_keys in removed.values()
+            for primary_key in primary_keys
+        ]
+
+        statement = update(self.table).where(
+            self.primary_key == bindparam("_primary_key")
+        )
+        for chunk in chunked(updates, self.chunk_size):
+            self.session.execute(statement, chunk)
+            self.session.commit()
+        # Keep well below the bind parameter limits of the supported databases
+        for chunk in chunked(deletes, 1000):
+            self.session.execute(delete(self.table).where(self.primary_key.in_(chunk)))
+            self.session.commit()
+        for chunk in chunked(inserts, self.chunk_size):
+            self.session.execute(insert(self.table), chunk)
+            self.session.commit()
+
+        counts = ChangeCounts(
+            inserted=len(inserts), updated=len(updates), deleted=len(deletes)
+        )
+        logger.info(f"{self.table.name}: {counts}")
+        self.counts = self.counts + counts
+        self.stats.observe(
+            counts.inserted + counts.updated + counts.deleted,
+            time.monotonic() - start,
+        )
@@ -0,0 +1,112 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+"""Micro-batching of AMQP events for the event-driven export."""
+
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Awaitable
+from typing import Callable
+from uuid import UUID
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    def __init__(self) -> None:
+        # The future of each UUID, in order. Duplicate UUIDs are coalesced, and
+        # share a future.
+        self.uuids: dict[UUID, asyncio.Future] = {}
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class EventBatcher:
+    """Collects events per object type and handles them in batches.
+
+    An event is added to the pending batch of its object type, which is flushed
+    `max_delay` seconds after its first event arrived, or as soon as it holds
+    `max_size` distinct UUIDs. `submit` returns once the batch containing the event
+    has been handled and raises if handling its UUID failed, so an AMQP message is
+    only acknowledged once its changes are committed. If handling a batch fails,
+    its halves are handled again, until the failing UUIDs are found, so a single
+    failing UUID does not fail the events of its neighbours.
+
+    Batches of the same object type are flushed one at a time, so a later batch
+    always reads MO after an earlier one has been written.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[str, list[UUID]], Awaitable[None]],
+        max_delay: float,
+        max_size: int,
+    ) -> None:
+        self._flush = flush
+        self.max_delay = max_delay
+        self.max_size = max_size
+        self._pending: dict[str, _Batch] = {}
+        self._locks: defaultdict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, key: str, uuid: UUID) -> None:
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _Batch()
+            batch.timer = asyncio.get_running_loop().call_later(
+                self.max_delay, self._dispatch, key, batch
+            )
+        done = batch.uuids.get(uuid)
+        if done is None:
+            done = batch.uuids[uuid] = asyncio.get_running_loop().create_future()
+        if len(batch.uuids) >= self.max_size:
+            self._dispatch(key, batch)
+        # Shield the future, so a cancelled event does not cancel its duplicates
+        await asyncio.shield(done)
+
+    def _dispatch(self, key: str, batch: _Batch) -> None:
+        if self._pending.get(key) is not batch:
+            return
+        del self._pending[key]
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = asyncio.create_task(self._run(key, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: str, batch: _Batch) -> None:
+        uuids = list(batch.uuids)
+        try:
+            async with self._locks[key]:
+                logger.info(f"Handling batch of {len(uuids)} {key} events")
+                failures = await self._flush_bisecting(key, uuids)
+        except asyncio.CancelledError:
+            for done in batch.uuids.values():
+                done.cancel()
+            raise
+        for uuid, done in batch.uuids.items():
+            if uuid in failures:
+                done.set_exception(failures[uuid])
+            else:
+                done.set_result(None)
+
+    async def _flush_bisecting(
+        self, key: str, uuids: list[UUID]
+    ) -> dict[UUID, Exception]:
+        """Handle `uuids`, and return the exception of each UUID which failed.
+
+        A failed batch is rolled back by `flush`, and each of its halves is
+        handled again on its own, keeping the order of the UUIDs.
+        """
+        try:
+            await self._flush(key, uuids)
+        except Exception as e:
+            if len(uuids) == 1:
+                logger.exception(f"Handling {key} event of {uuids[0]} failed")
+                return {uuids[0]: e}
+            logger.warning(f"Handling batch of {len(uuids)} {key} events failed: {e}")
+            middle = len(uuids) // 2
+            failures = await self._flush_bisecting(key, uuids[:middle])
+            failures.update(await self._flush_bisecting(key, uuids[middle:]))
+            return failures
+        return {}
@@ -0,0 +1,147 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+"""Statistics of a full export.
+
+The statistics are stored as JSON in the `statistik` column of the `kvittering`
+of the export, and exposed as Prometheus metrics along with
+`dipex_last_success_timestamp`.
+"""
+
+import json
+import time
+from contextlib import contextmanager
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Iterator
+
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+
+page_duration = Histogram(
+    name="sql_export_page_duration",
+    documentation="Duration of the GraphQL query of a single page.",
+    unit="seconds",
+    labelnames=["collection"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+phase_duration = Gauge(
+    name="sql_export_phase_duration",
+    documentation="Duration of each phase of the last full export.",
+    unit="seconds",
+    labelnames=["export", "phase"],
+)
+fetch_duration = Gauge(
+    name="sql_export_fetch_duration",
+    documentation="Time from the first to the last query of each collection.",
+    unit="seconds",
+    labelnames=["export", "collection"],
+)
+fetch_pages = Gauge(
+    name="sql_export_fetch_pages",
+    documentation="Pages fetched of each collection by the last full export.",
+    labelnames=["export", "collection"],
+)
+rows_written = Gauge(
+    name="sql_export_rows_written",
+    documentation="Rows written to each table by the last full export.",
+    labelnames=["export", "table"],
+)
+rows_per_second = Gauge(
+    name="sql_export_rows_per_second",
+    documentation="Rows written per second spent writing, for each table.",
+    labelnames=["export", "table"],
+)
+
+
+@dataclass
+class FetchStats:
+    """Fetching of one collection from MO."""
+
+    pages: int = 0
+    objects: int = 0
+    # Summed over the queries, which may overlap
+    query_seconds: float = 0.0
+    started: float | None = None
+    finished: float | None = None
+
+    def observe(self, objects: int, started: float, finished: float) -> None:
+        self.pages += 1
+        self.objects += objects
+        self.query_seconds += finished - started
+        self.started = started if self.started is None else min(self.started, started)
+        self.finished = (
+            finished if self.finished is None else max(self.finished, finished)
+        )
+
+    @property
+    def seconds(self) -> float:
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+
+@dataclass
+class WriteStats:
+    """Writing of one table."""
+
+    rows: int = 0
+    seconds: float = 0.0
+
+    def observe(self, rows: int, seconds: float) -> None:
+        self.rows += rows
+        self.seconds += seconds
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+@dataclass
+class ExportStats:
+    phases: dict[str, float] = field(default_factory=dict)
+    tasks: dict[str, float] = field(default_factory=dict)
+    fetch: dict[str, FetchStats] = field(default_factory=dict)
+    tables: dict[str, WriteStats] = field(default_factory=dict)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.monotonic() - start
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "phases": self.phases,
+                "tasks": self.tasks,
+                "fetch": {
+                    name: {
+                        "pages": stats.pages,
+                        "objects": stats.objects,
+                        "seconds": stats.seconds,
+                        "query_seconds": stats.query_seconds,
+                    }
+                    for name, stats in self.fetch.items()
+                },
+                "tables": {
+                    name: {**asdict(stats), "rows_per_second": stats.rows_per_second}
+                    for name, stats in self.tables.items()
+                },
+            },
+            sort_keys=True,
+        )
+
+    def update_metrics(self, export: str) -> None:
+        """Set the metrics of the last export of the `export` database."""
+        for name, seconds in self.phases.items():
+            phase_duration.labels(export=export, phase=name).set(seconds)
+        for name, fetch in self.fetch.items():
+            fetch_duration.labels(export=export, collection=name).set(fetch.seconds)
+            fetch_pages.labels(export=export, collection=name).set(fetch.pages)
+        for name, write in self.tables.items():
+            rows_written.labels(export=export, table=name).set(write.rows)
+            rows_per_second.labels(export=export, table=name).set(write.rows_per_second)
@@ -0,0 +1,451 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+"""A synthetic organisation, served like the GraphQL API of MO.
+
+`SyntheticOrganisation` generates a tree of units and a number of employees, with
+engagements, addresses, managers, associations, leaves, KLEs and IT users, each
+with `history` consecutive validities. `FakeMOSession` answers the queries of
+`GQLLoraCache` from it, so the cache can be populated without a MO instance:
+
+    lc._gql_client_session = FakeMOSession(SyntheticOrganisation(units=100))
+
+The session resolves the fields selected by a query against the generated
+objects, honouring aliases, the filter by UUIDs and the cursor pagination. Other
+filters, such as the dates of `skip_past`, are not applied.
+"""
+
+import asyncio
+import datetime
+import random
+from typing import Any
+from typing import Callable
+from uuid import UUID
+
+from graphql import DocumentNode
+from graphql import ExecutionResult
+from graphql import FieldNode
+from graphql import OperationDefinitionNode
+from graphql import SelectionSetNode
+from graphql import Undefined
+from graphql import value_from_ast_untyped
+from more_itertools import one
+
+# Facets and the (user key, scope) of their classes
+FACETS: dict[str, list[tuple[str, str | None]]] = {
+    "org_unit_type": [("afdeling", None), ("center", None), ("team", None)],
+    "org_unit_level": [("niveau1", None), ("niveau2", None), ("niveau3", None)],
+    "time_planning": [("arbejdstidsplaner", None), ("tjenestetid", None)],
+    "org_unit_hierarchy": [("linjeorganisation", None), ("sikkerhed", None)],
+    "engagement_type": [("ansat", None), ("timelønnet", None)],
+    "engagement_job_function": [("konsulent", None), ("chef", None), ("elev", None)],
+    "primary_type": [("primary", None), ("non-primary", None)],
+    "leave_type": [("barsel", None), ("orlov", None)],
+    "manager_type": [("direktør", None), ("leder", None)],
+    "manager_level": [("niveau1", None), ("niveau2", None)],
+    "responsibility": [("personale", None), ("budget", None), ("arbejdsmiljø", None)],
+    "association_type": [("medlem", None), ("formand", None)],
+    "employee_address_type": [("email", "EMAIL"), ("telefon", "PHONE")],
+    "org_unit_address_type": [("postadresse", "DAR"), ("ean", "EAN")],
+    "visibility": [("public", "PUBLIC"), ("secret", "SECRET")],
+    "kle_number": [(f"00.{i:02}", None) for i in range(20)],
+    "kle_aspect": [("udførende", "UDFOERENDE"), ("ansvarlig", "ANSVARLIG")],
+}
+ITSYSTEMS = ["AD", "Office365", "SAP"]
+
+
+def _validity(start: datetime.date, end: datetime.date | None) -> dict[str, Any]:
+    def timestamp(date: datetime.date | None) -> str | None:
+        return f"{date.isoformat()}T00:00:00+01:00" if date else None
+
+    return {"from": timestamp(start), "to": timestamp(end)}
+
+
+class SyntheticOrganisation:
+    """A randomly generated organisation, reproducible from `seed`.
+
+    Every employee has an engagement, an email address, a phone number and an IT
+    user. Every tenth employee also has an association, and every twentieth a
+    leave. Every unit has a postal address, a manager and a KLE, and every tenth
+    unit is related to another one. The units form a tree at most `depth` deep.
+    """
+
+    def __init__(
+        self,
+        units: int = 100,
+        employees: int = 1000,
+        depth: int = 6,
+        history: int = 2,
+        seed: int = 0,
+    ) -> None:
+        self.rng = random.Random(seed)
+        self.history = history
+        self.org_uuid = self._uuid()
+        self.collections: dict[str, list[dict[str, Any]]] = {}
+        self._classes: dict[str, list[dict[str, Any]]] = {}
+        self._generate_classes()
+        self._generate_units(units, depth)
+        self._generate_employees(employees)
+
+    def _uuid(self) -> str:
+        return str(UUID(int=self.rng.getrandbits(128), version=4))
+
+    def _class(self, facet: str, user_key: str | None = None) -> dict[str, Any]:
+        classes = self._classes[facet]
+        if user_key is None:
+            return self.rng.choice(classes)
+        return one(cls for cls in classes if cls["user_key"] == user_key)
+
+    def _add(self, collection: str, uuid: str, make: Callable[[int], dict]) -> None:
+        """Add an object to `collection`, with a validity made by `make` per period.
+
+        The periods are consecutive years, the last of which is current.
+        """
+        start = datetime.date.today() - datetime.timedelta(days=365 * self.history)
+        validities = []
+        for period in range(self.history):
+            end = start + datetime.timedelta(days=364)
+            last = period == self.history - 1
+            validity = _validity(start, None if last else end)
+            validities.append({"uuid": uuid, **make(period), "validity": validity})
+            start = end + datetime.timedelta(days=1)
+        self.collections.setdefault(collection, []).append(
+            {"uuid": uuid, "validities": validities, "current": validities[-1]}
+        )
+
+    def _add_current(self, collection: str, obj: dict[str, Any]) -> None:
+        self.collections.setdefault(collection, []).append(
+            {"uuid": obj["uuid"], "current": obj, "validities": [obj]}
+        )
+
+    def _generate_classes(self) -> None:
+        for facet, classes in FACETS.items():
+            facet_uuid = self._uuid()
+            self._add_current("facets", {"uuid": facet_uuid, "user_key": facet})
+            for user_key, scope in classes:
+                cls = {
+                    "uuid": self._uuid(),
+                    "user_key": user_key,
+                    "name": user_key.capitalize(),
+                    "scope": scope,
+                    "facet_uuid": facet_uuid,
+                }
+                self._classes.setdefault(facet, []).append(cls)
+                self._add_current("classes", cls)
+        self.itsystems = []
+        for name in ITSYSTEMS:
+            itsystem = {"uuid": self._uuid(), "user_key": name, "name": name}
+            self.itsystems.append(itsystem)
+            self._add_current("itsystems", itsystem)
+
+    def _generate_units(self, count: int, depth: int) -> None:
+        self.units: list[dict[str, Any]] = []
+        managers: dict[str, list[dict[str, Any]]] = {}
+
+        def unit_managers(unit: dict[str, Any], inherit: bool = False) -> list[dict]:
+            if unit["uuid"] in managers or not inherit:
+                return managers.get(unit["uuid"], [])
+            parent = unit["parent"]
+            return unit_managers(parent, inherit) if parent else []
+
+        for i in range(count):
+            candidates = [unit for unit in self.units if unit["depth"] < depth - 1]
+            parent = self.rng.choice(candidates) if candidates else None
+            name = f"Enhed {i}"
+            ancestors = []
+            ancestor = parent
+            while ancestor is not None:
+                ancestors.append({"uuid": ancestor["uuid"], "name": ancestor["name"]})
+                ancestor = ancestor["parent"]
+            unit = {
+                "uuid": self._uuid(),
+                "name": name,
+                "parent": parent,
+                "depth": parent["depth"] + 1 if parent else 0,
+            }
+            self.units.append(unit)
+            unit_type = self._class("org_unit_type")
+            level = self._class("org_unit_level")
+            time_planning = self._class("time_planning")
+            hierarchy = self._class("org_unit_hierarchy")
+
+            def make(period: int, unit=unit, ancestors=ancestors) -> dict[str, Any]:
+                return {
+                    "user_key": f"enhed{i}",
+                    "name": unit["name"]
+                    if period == self.history - 1
+                    else f"{name}/{period}",
+                    "unit_type_uuid": unit_type["uuid"],
+                    "org_unit_level_uuid": level["uuid"],
+                    "time_planning_uuid": time_planning["uuid"],
+                    "parent_uuid": unit["parent"]["uuid"]
+                    if unit["parent"]
+                    else self.org_uuid,
+                    "org_unit_hierarchy": hierarchy["uuid"],
+                    "managers": lambda inherit=False: unit_managers(unit, inherit),
+                    "ancestors": ancestors,
+                }
+
+            self._add("org_units", unit["uuid"], make)
+
+        for i, unit in enumerate(self.units):
+            postal = self._class("org_unit_address_type", "postadresse")
+            dar_uuid = self._uuid()
+            self._add(
+                "addresses",
+                self._uuid(),
+                lambda period: {
+                    "address_type_uuid": postal["uuid"],
+                    "employee_uuid": None,
+                    "org_unit_uuid": unit["uuid"],
+                    "visibility_uuid": None,
+                    "name": f"Vejen {i}, 8000 Aarhus C",
+                    "value": dar_uuid,
+                    "user_key": f"Vejen {i}",
+                    "address_type": {"scope": postal["scope"]},
+                },
+            )
+            kle_number = self._class("kle_number")
+            self._add(
+                "kles",
+                self._uuid(),
+                lambda period: {
+                    "org_unit_uuid": unit["uuid"],
+                    "kle_number_uuid": kle_number["uuid"],
+                    "kle_aspect_uuids": [
+                        c["uuid"] for c in self._classes["kle_aspect"]
+                    ],
+                    "user_key": kle_number["user_key"],
+                },
+            )
+            if i % 10 == 9:
+                other = self.rng.choice(self.units)
+                self._add(
+                    "related_units",
+                    self._uuid(),
+                    lambda period: {"org_unit_uuids": [unit["uuid"], other["uuid"]]},
+                )
+        self._managers = managers
+
+    def _generate_employees(self, count: int) -> None:
+        primary = self._class("primary_type", "primary")
+        for i in range(count):
+            employee_uuid = self._uuid()
+            givenname = self.rng.choice(["Anna", "Bent", "Carl", "Dorte", "Erik"])
+            surname = self.rng.choice(["Hansen", "Jensen", "Nielsen", "Pedersen"])
+            cpr = f"{self.rng.randrange(1, 29):02}{self.rng.randrange(1, 13):02}"
+            cpr += f"{self.rng.randrange(100):02}{self.rng.randrange(10000):04}"
+            self._add(
+                "employees",
+                employee_uuid,
+                lambda period: {
+                    "cpr_no": cpr,
+                    "user_key": f"bruger{i}",
+                    "name": f"{givenname} {surname}",
+                    "givenname": givenname,
+                    "surname": surname,
+                    "nickname": "",
+                    "nickname_givenname": "",
+                    "nickname_surname": "",
+                },
+            )
+            unit = self.rng.choice(self.units)
+            engagement_uuid = self._uuid()
+            engagement_type = self._class("engagement_type")
+            job_function = self._class("engagement_job_function")
+            self._add(
+                "engagements",
+                engagement_uuid,
+                lambda period: {
+                    "employee_uuid": employee_uuid,
+                    "org_unit_uuid": unit["uuid"],
+                    "fraction": None,
+                    "user_key": f"{i}-{period}",
+                    "engagement_type_uuid": engagement_type["uuid"],
+                    "primary_uuid": primary["uuid"],
+                    "is_primary": True,
+                    "job_function_uuid": job_function["uuid"],
+                    **{f"extension_{n}": None for n in range(1, 11)},
+                },
+            )
+            for user_key in ("email", "telefon"):
+                address_type = self._class("employee_address_type", user_key)
+                visibility = self._class("visibility")
+                value = (
+                    f"bruger{i}@example.org"
+                    if user_key == "email"
+                    else f"{self.rng.randrange(10**7, 10**8)}"
+                )
+                self._add(
+                    "addresses",
+                    self._uuid(),
+                    lambda period: {
+                        "address_type_uuid": address_type["uuid"],
+                        "employee_uuid": employee_uuid,
+                        "org_unit_uuid": None,
+                        "visibility_uuid": visibility["uuid"],
+                        "name": value,
+                        "value": value,
+                        "user_key": value,
+                        "address_type": {"scope": address_type["scope"]},
+                    },
+                )
+            itsystem = self.rng.choice(self.itsystems)
+            self._add(
+                "itusers",
+                self._uuid(),
+                lambda period: {
+                    "employee_uuid": employee_uuid,
+                    "org_unit_uuid": None,
+                    "user_key": f"bruger{i}",
+                    "itsystem_uuid": itsystem["uuid"],
+                    "primary_uuid": primary["uuid"],
+                },
+            )
+            if i % 10 == 9:
+                association_type = self._class("association_type")
+                self._add(
+                    "associations",
+                    self._uuid(),
+                    lambda period: {
+                        "employee_uuid": employee_uuid,
+                        "org_unit_uuid": unit["uuid"],
+                        "user_key": f"tilknytning{i}",
+                        "association_type_uuid": association_type["uuid"],
+                        "it_user_uuid": None,
+                        "job_function_uuid": None,
+                        "primary": {"user_key": primary["user_key"]},
+                        "dynamic_class": None,
+                    },
+                )
+            if i % 20 == 19:
+                leave_type = self._class("leave_type")
+                self._add(
+                    "leaves",
+                    self._uuid(),
+                    lambda period: {
+                        "employee_uuid": employee_uuid,
+                        "user_key": f"orlov{i}",
+                        "leave_type_uuid": leave_type["uuid"],
+                        "engagement_uuid": engagement_uuid,
+                    },
+                )
+
+        # Every unit is managed by one of the employees
+        employees = self.collections.get("employees", [])
+        for unit in self.units if employees else []:
+            manager_uuid = self._uuid()
+            responsibilities = self.rng.sample(self._classes["responsibility"], 2)
+            manager_type = self._class("manager_type")
+            manager_level = self._class("manager_level")
+            employee = self.rng.choice(employees)
+            self._add(
+                "managers",
+                manager_uuid,
+                lambda period: {
+                    "employee_uuid": employee["uuid"],
+                    "org_unit_uuid": unit["uuid"],
+                    "manager_type_uuid": manager_type["uuid"],
+                    "manager_level_uuid": manager_level["uuid"],
+                    "responsibility_uuids": [c["uuid"] for c in responsibilities],
+                },
+            )
+            self._managers[unit["uuid"]] = [
+                {
+                    "uuid": manager_uuid,
+                    "org_unit_uuid": unit["uuid"],
+                    "responsibility_uuids": [c["uuid"] for c in responsibilities],
+                }
+            ]
+
+
+class FakeMOSession:
+    """Answers GraphQL queries from a `SyntheticOrganisation`.
+
+    Has the `execute` method of the GraphQL client session. Each query waits
+    `latency` seconds, to mimic the round trip to MO.
+    """
+
+    def __init__(self, organisation: SyntheticOrganisation, latency: float = 0.0):
+        self.organisation = organisation
+        self.latency = latency
+        self.queries = 0
+
+    async def execute(
+        self,
+        document: DocumentNode,
+        variable_values: dict[str, Any] | None = None,
+        get_execution_result: bool = False,
+    ) -> Any:
+        self.queries += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        variables = variable_values or {}
+        operation = one(
+            definition
+            for definition in document.definitions
+            if isinstance(definition, OperationDefinitionNode)
+        )
+        data = {
+            _key(field): self._resolve_root(field, variables)
+            for field in _fields(operation.selection_set)
+        }
+        if get_execution_result:
+            return ExecutionResult(data=data)
+        return data
+
+    def _resolve_root(self, field: FieldNode, variables: dict[str, Any]) -> Any:
+        name = field.name.value
+        if name == "org":
+            return _resolve({"uuid": self.organisation.org_uuid}, field, variables)
+        arguments = _arguments(field, variables)
+        objects = self.organisation.collections.get(name, [])
+        uuids = (arguments.get("filter") or {}).get("uuids")
+        if uuids is not None:
+            wanted = set(uuids)
+            objects = [obj for obj in objects if obj["uuid"] in wanted]
+        # The cursor is the offset of the page
+        offset = int(arguments.get("cursor") or 0)
+        limit = arguments.get("limit")
+        end = len(objects) if limit is None else offset + limit
+        page = {
+            "objects": objects[offset:end],
+            "page_info": {"next_cursor": str(end) if end < len(objects) else None},
+        }
+        return _resolve(page, field, variables)
+
+
+def _fields(selection_set: SelectionSetNode) -> list[FieldNode]:
+    return [
+        selection
+        for selection in selection_set.selections
+        if isinstance(selection, FieldNode)
+    ]
+
+
+def _key(field: FieldNode) -> str:
+    return field.alias.value if field.alias else field.name.value
+
+
+def _arguments(field: FieldNode, variables: dict[str, Any]) -> dict[str, Any]:
+    """Return the arguments of `field`, leaving out unset variables."""
+    arguments = {
+        argument.name.value: value_from_ast_untyped(argument.value, variables)
+        for argument in field.arguments
+    }
+    return {name: value for name, value in arguments.items() if value is not Undefined}
+
+
+def _resolve(value: Any, field: FieldNode, variables: dict[str, Any]) -> Any:
+    """Return the fields of `value` selected by `field`."""
+    if value is None or field.selection_set is None:
+        return value
+    if isinstance(value, list):
+        return [_resolve(item, field, variables) for item in value]
+    result = {}
+    for selected in _fields(field.selection_set):
+        item = value.get(selected.name.value)
+        if callable(item):
+            item = item(**_arguments(selected, variables))
+        result[_key(selected)] = _resolve(item, selected, variables)
+    return result
@@ -1,41 +1,270 @@
 import asyncio
 import datetime
+import json
 import logging
 import os
-import pickle
+import sys
+import time
+from collections import defaultdict
+from functools import lru_cache
 from pathlib import Path
 from typing import Any
 from typing import AsyncIterator
+from typing import Callable
+from typing import Iterable
 from uuid import UUID
 
+import httpx
 from fastramqpi.ra_utils.async_to_sync import async_to_sync
 from fastramqpi.raclients.graph.client import GraphQLClient
 from gql import gql
 from gql.client import AsyncClientSession
+from graphql import DocumentNode
+from more_itertools import chunked
 from more_itertools import first
-from tenacity import Retrying
+from tenacity import AsyncRetrying
+from tenacity import retry_if_not_exception_type
+from tenacity import stop_after_attempt
 from tenacity import stop_after_delay
 from tenacity import wait_random_exponential
 
 from .config import GqlLoraCacheSettings
 from .config import get_gql_cache_settings
+from .dar_cache import PersistentDARCache
+from .dar_cache import fetch_dar_addresses
+from .export_stats import FetchStats
+from .export_stats import page_duration
+from .history_shards import checkpoint_path
+from .history_shards import read_checkpoint
+from .history_shards import remove_checkpoints
+from .history_shards import write_checkpoint
+from .page_size import AdaptivePageSize
+from .priority_semaphore import PrioritySemaphore
+from .projection import ProjectionProfile
+from .projection import omitted_fields
+from .projection import omitted_keys
+from .projection import project_objects
+from .projection import prune_query
+from .records import deep_sizeof
+from .records import to_record
+from .replay import RecordingSession
+from .replay import ReplayMismatch
+from .replay import ReplaySession
+from .snapshot import Snapshot
+from .snapshot import SnapshotMismatch
+from .snapshot import snapshot_path
+from .snapshot import write_snapshot
+from .transform import Transformer
 
 RETRY_MAX_TIME = 5 * 60
 
+# Attribute names of the collections held by the cache
+CACHE_COLLECTIONS = (
+    "facets",
+    "classes",
+    "users",
+    "units",
+    "addresses",
+    "engagements",
+    "managers",
+    "associations",
+    "leaves",
+    "itsystems",
+    "it_connections",
+    "kles",
+    "related",
+    "dar_cache",
+)
+
+
+# Maps the models of MO registrations to the collections holding them
+REGISTRATION_MODELS = {
+    "address": "addresses",
+    "association": "associations",
+    "class": "classes",
+    "employee": "users",
+    "engagement": "engagements",
+    "facet": "facets",
+    "itsystem": "itsystems",
+    "ituser": "it_connections",
+    "kle": "kles",
+    "leave": "leaves",
+    "manager": "managers",
+    "org_unit": "units",
+    "related_unit": "related",
+}
+
+# The root field and filter of the collections whose full history can be fetched
+# in shards, see history_shards.py
+HISTORY_SHARD_FIELDS = {
+    "users": ("employees", "EmployeeFilter"),
+    "units": ("org_units", "OrganisationUnitFilter"),
+    "addresses": ("addresses", "AddressFilter"),
+    "engagements": ("engagements", "EngagementFilter"),
+    "managers": ("managers", "ManagerFilter"),
+    "associations": ("associations", "AssociationFilter"),
+    "leaves": ("leaves", "LeaveFilter"),
+    "it_connections": ("itusers", "ITUserFilter"),
+    "kles": ("kles", "KLEFilter"),
+    "related": ("related_units", "RelatedUnitFilter"),
+}
+
+# The fields of the collections which `GQLLoraCache.lookup` can look up objects by
+INDEXED_FIELDS = {
+    "engagements": ("user", "unit"),
+    "addresses": ("user", "unit", "scope", "adresse_type"),
+    "it_connections": ("user", "unit"),
+    "associations": ("user", "unit"),
+    "leaves": ("user",),
+    "managers": ("user", "unit"),
+    "kles": ("unit",),
+}
+
+# The transformers of the query results of each collection, see transform.py
+TRANSFORMERS = {
+    "facets": Transformer(resolve_object=False, resolve_validity=False),
+    "classes": Transformer(
+        {"name": "title", "facet_uuid": "facet"},
+        resolve_object=False,
+        resolve_validity=False,
+    ),
+    "itsystems": Transformer(resolve_object=False, resolve_validity=False),
+    "users": Transformer(
+        {
+            "cpr_no": "cpr",
+            "givenname": "fornavn",
+            "surname": "efternavn",
+            "name": "navn",
+            "nickname": "kaldenavn",
+            "nickname_givenname": "kaldenavn_fornavn",
+            "nickname_surname": "kaldenavn_efternavn",
+        }
+    ),
+    "units": Transformer(
+        {
+            "org_unit_level_uuid": "level",
+            "org_unit_hierarchy_uuid": "org_unit_hierarchy",
+            "parent_uuid": "parent",
+            "unit_type_uuid": "unit_type",
+            "time_planning_uuid": "time_planning",
+        }
+    ),
+    "addresses": Transformer(
+        {
+            "employee_uuid": "user",
+            "org_unit_uuid": "unit",
+            "address_type_uuid": "adresse_type",
+            "visibility_uuid": "visibility",
+        }
+    ),
+    "engagements": Transformer(
+        {
+            "employee_uuid": "user",
+            "engagement_type_uuid": "engagement_type",
+            "job_function_uuid": "job_function",
+            "org_unit_uuid": "unit",
+            "primary_uuid": "primary_type",
+            "is_primary": "primary_boolean",
+        }
+    ),
+    "managers": Transformer(
+        {
+            "employee_uuid": "user",
+            "manager_level_uuid": "manager_level",
+            "manager_type_uuid": "manager_type",
+            "responsibility_uuids": "manager_responsibility",
+            "org_unit_uuid": "unit",
+        }
+    ),
+    "associations": Transformer(
+        {
+            "employee_uuid": "user",
+            "association_type_uuid": "association_type",
+            "it_user_uuid": "it_user",
+            "job_function_uuid": "job_function",
+            "org_unit_uuid": "unit",
+        }
+    ),
+    "leaves": Transformer(
+        {
+            "employee_uuid": "user",
+            "leave_type_uuid": "leave_type",
+            "engagement_uuid": "engagement",
+        }
+    ),
+    "it_connections": Transformer(
+        {
+            "employee_uuid": "user",
+            "itsystem_uuid": "itsystem",
+            "org_unit_uuid": "unit",
+            "user_key": "username",
+        }
+    ),
+    "kles": Transformer(
+        {
+            "kle_aspect_uuid": "kle_aspect",
+            "kle_number_uuid": "kle_number",
+            "org_unit_uuid": "unit",
+        }
+    ),
+    "related": Transformer(),
+}
 
 logger = logging.getLogger(__name__)
 
 
+# The queries are few and fixed, while their pages and retries are many
+@lru_cache(maxsize=None)
+def parse_query(query: str) -> DocumentNode:
+    """Return the GraphQL document of `query`, parsing each query only once."""
+    return gql(query)
+
+
+ROOT_ORG_QUERY = """
+    query {
+        org {
+            uuid
+        }
+    }
+"""
+
+# The number of addresses named together, so the DAR addresses among them are
+# looked up in the persistent DAR cache, and fetched from DAR, in bulk
+DAR_CHUNK_SIZE = 500
+
+
 # used to correctly insert the object into the cache
-def insert_obj(obj: dict, cache: dict) -> None:
+def insert_obj(obj: dict, cache: dict, compact: bool = False) -> None:
     if obj is None:
         return
     if len(obj["obj"]) == 0:
         return
-    if obj["uuid"] in cache:
-        cache[obj["uuid"]].extend(obj["obj"])
+    uuid = obj["uuid"]
+    objs = obj["obj"]
+    if compact:
+        uuid = sys.intern(uuid)
+        objs = [to_record(o) for o in objs]
+    if uuid in cache:
+        cache[uuid].extend(objs)
     else:
-        cache[obj["uuid"]] = obj["obj"]
+        cache[uuid] = objs
+
+
+# used to insert objects of the collections which are only fetched as current, and
+# thus are stored as a single object per uuid rather than a list
+def insert_current(obj: dict, cache: dict, compact: bool = False) -> None:
+    if compact:
+        obj = {sys.intern(uuid): to_record(value) for uuid, value in obj.items()}
+    cache.update(obj)
+
+
+# the uuids filter of a query, when fetching a single object or a batch of objects
+def uuid_filter(uuid: UUID | str | Iterable[UUID | str] | None) -> list[str] | None:
+    if uuid is None:
+        return None
+    if isinstance(uuid, (UUID, str)):
+        return [str(uuid)]
+    return [str(u) for u in uuid]
 
 
 # when getting a query using current, the object is a single dict. When getting a
@@ -46,6 +275,39 @@ def align_current(item: dict) -> dict:
     return item
 
 
+def resolve_unit_tree(units: list[dict]) -> None:
+    """Set the location and the inherited managers of the current `units`.
+
+    Computes what `ancestors` and `managers(inherit: true)` would have returned from
+    MO, from the `parent_uuid` and the direct managers, `manager_uuid`, of each
+    unit. The location is the path of unit names from the root of the tree, and the
+    inherited managers are those of the closest unit up the tree, including the
+    unit itself, which has managers. Each unit is resolved once, after its parent.
+    """
+    by_uuid = {unit["uuid"]: unit for unit in units if unit is not None}
+    locations: dict[str, str] = {}
+    inherited: dict[str, list[dict]] = {}
+    for uuid in by_uuid:
+        # Walk up to the first resolved unit, or the root
+        chain: list[str] = []
+        parent: str | None = uuid
+        while parent in by_uuid and parent not in locations and parent not in chain:
+            chain.append(parent)
+            parent = by_uuid[parent]["parent_uuid"]
+        for unit_uuid in reversed(chain):
+            unit = by_uuid[unit_uuid]
+            parent = unit["parent_uuid"]
+            if parent in locations:
+                locations[unit_uuid] = locations[parent] + "\\" + unit["name"]
+                inherited[unit_uuid] = unit["manager_uuid"] or inherited[parent]
+            else:
+                locations[unit_uuid] = unit["name"]
+                inherited[unit_uuid] = unit["manager_uuid"]
+    for uuid, unit in by_uuid.items():
+        unit["location"] = locations[uuid]
+        unit["acting_manager_uuid"] = inherited[uuid]
+
+
 # Does various transformations on a cache to align it with the old lora cache
 def convert_dict(
     query_res: dict,
@@ -55,7 +317,9 @@ def convert_dict(
 ) -> dict:
     def replace(d: dict, dictionary: dict):
         for replace_from, replace_to in dictionary.items():
-            d[replace_to] = d.pop(replace_from)
+            # Fields left out by the projection profile are not renamed
+            if replace_from in d:
+                d[replace_to] = d.pop(replace_from)
         return d
 
     def res_validity(d: dict):
@@ -103,6 +367,7 @@ class GQLLoraCache:
         full_history: bool = False,
         skip_past: bool = False,
         settings=None,
+        projection: ProjectionProfile | None = None,
     ):
         logger.info(
             f"Initialising LoRa cache, {resolve_dar=}, {full_history=}, {skip_past=}"
@@ -112,9 +377,21 @@ class GQLLoraCache:
         self.resolve_dar = resolve_dar
         self.settings: GqlLoraCacheSettings = settings or get_gql_cache_settings()
         self.page_size = self.settings.std_page_size
+        self.page_sizes = AdaptivePageSize(
+            initial=self.settings.std_page_size,
+            minimum=self.settings.min_page_size,
+            maximum=self.settings.max_page_size,
+            target_seconds=self.settings.page_target_seconds,
+            max_bytes=self.settings.page_max_bytes,
+            adaptive=self.settings.adaptive_page_size,
+        )
+        self.compact_records = self.settings.compact_records
 
         self.full_history = full_history
         self.skip_past = skip_past
+        # The keys of each collection left out by the projection profile, see
+        # projection.py
+        self.projection = omitted_keys(projection)
 
         self.facets: dict = {}
         self.classes: dict = {}
@@ -131,11 +408,28 @@ class GQLLoraCache:
         self.related: dict = {}
         self.dar_cache: dict = {}
 
+        self._snapshot: Snapshot | None = None
+        # The secondary indexes of `lookup`, with the collection each was built from
+        self._indexes: dict[tuple[str, str], tuple[dict, dict[str, list[str]]]] = {}
+        # Pages and query time of each collection fetched
+        self.fetch_stats: dict[str, FetchStats] = defaultdict(FetchStats)
+
         self._gql_client_session: AsyncClientSession | None = None
+        # The uuid of the root organisation, see `_get_org_uuid`
+        self._org_uuid: str | None = None
+        # Shared by all queries of the cache to limit the load on MO
+        self._query_slots = PrioritySemaphore(self.settings.max_concurrent_queries)
 
     async def gql_client_session(self) -> AsyncClientSession:
         if (session := self._gql_client_session) is not None:
             return session
+        if self.settings.graphql_replay_path is not None:
+            logger.info(f"Replaying GraphQL from {self.settings.graphql_replay_path}")
+            session = self._gql_client_session = ReplaySession(  # type: ignore
+                self.settings.graphql_replay_path,
+                latency=self.settings.graphql_replay_latency,
+            )
+            return session
         client = GraphQLClient(
             url=f"{self.settings.mora_base}/graphql/v22",
             client_id=self.settings.client_id,
@@ -146,68 +440,186 @@ class GQLLoraCache:
             execute_timeout=300,
         )
         # NOTE: The client is never closed 👍
-        session = self._gql_client_session = await client.__aenter__()
+        session = await client.__aenter__()
+        if self.settings.graphql_record_path is not None:
+            logger.info(f"Recording GraphQL to {self.settings.graphql_record_path}")
+            session = RecordingSession(session, self.settings.graphql_record_path)
+        self._gql_client_session = session
         return session
 
+    async def _fetch_page(
+        self,
+        query: str,
+        variable_values: dict | None,
+        cursor: Any,
+        do_paged: bool,
+        collection: str | None,
+    ) -> dict[str, Any]:
+        session = await self.gql_client_session()
+        priority = self._collection_priority(collection)
+        async for attempt in AsyncRetrying(
+            wait=wait_random_exponential(multiplier=2, max=30),
+            stop=stop_after_delay(RETRY_MAX_TIME),
+            # Replaying the same query again cannot help
+            retry=retry_if_not_exception_type(ReplayMismatch),
+            reraise=True,
+        ):
+            with attempt:
+                limit = self.page_sizes.get(collection) if do_paged else None
+                # Only hold a query slot while the query is in flight, not
+                # while waiting to retry
+                async with self._query_slots.slot(priority):
+                    start = time.monotonic()
+                    try:
+                        result = await session.execute(
+                            document=parse_query(query),
+                            variable_values=dict(
+                                limit=limit,
+                                cursor=cursor if do_paged else None,
+                                **(variable_values or {}),
+                            ),
+                            get_execution_result=True,
+                        )
+                    except (TimeoutError, httpx.TimeoutException):
+                        if limit is not None:
+                            self.page_sizes.timed_out(collection, limit)
+                        raise
+                    finish = time.monotonic()
+        duration = finish - start
+        page: dict[str, Any] = result.data["page"]  # type: ignore
+        name = collection or "other"
+        self.fetch_stats[name].observe(len(page["objects"]), start, finish)
+        page_duration.labels(collection=name).observe(duration)
+        if limit is not None and self.page_sizes.adaptive:
+            size_bytes = None
+            if self.page_sizes.max_bytes is not None:
+                size_bytes = len(json.dumps(page, default=str))
+            self.page_sizes.observe(
+                collection,
+                limit=limit,
+                count=len(page["objects"]),
+                seconds=duration,
+                size_bytes=size_bytes,
+            )
+        return page
+
     async def _execute_query(
         self,
         query: str,
         variable_values: dict | None = None,
         do_paged: bool = True,
+        collection: str | None = None,
     ) -> AsyncIterator[dict[str, Any]]:
-        next_cursor = None
-        session = await self.gql_client_session()
-        while True:
-            for attempt in Retrying(
-                wait=wait_random_exponential(multiplier=2, max=30),
-                stop=stop_after_delay(RETRY_MAX_TIME),
-                reraise=True,
-            ):
-                with attempt:
-                    if do_paged:
-                        limit = self.page_size
-                        cursor = next_cursor
-                    else:
-                        limit = None
-                        cursor = None
-                    result = await session.execute(
-                        document=gql(query),
-                        variable_values=dict(
-                            limit=limit,
-                            cursor=cursor,
-                            **(variable_values or {}),
-                        ),
-                        get_execution_result=True,
+        """Yield the objects of every page of the query.
+
+        While the objects of one page are being consumed, up to
+        `prefetch_pages` of the following pages are fetched in the background.
+        Queries are subject to the cache-wide query budget, in which
+        collections early in `priority_collections` are served first. The fields
+        left out by the projection profile of `collection` are removed from the
+        query.
+        """
+        omitted: frozenset[str] = frozenset()
+        if collection is not None and collection in self.projection:
+            omitted = self.projection[collection]
+            query = prune_query(query, omitted_fields(collection, omitted))
+        if not do_paged or self.settings.prefetch_pages < 1:
+            next_cursor = None
+            while True:
+                page = await self._fetch_page(
+                    query, variable_values, next_cursor, do_paged, collection
+                )
+                if omitted:
+                    project_objects(page["objects"], omitted)
+                for obj in page["objects"]:
+                    yield obj
+                next_cursor = page["page_info"]["next_cursor"]
+                if not do_paged or next_cursor is None:
+                    return
+
+        pages: asyncio.Queue = asyncio.Queue(maxsize=self.settings.prefetch_pages)
+
+        async def fetch_pages() -> None:
+            next_cursor = None
+            try:
+                while True:
+                    page = await self._fetch_page(
+                        query, variable_values, next_cursor, do_paged, collection
                     )
-            for obj in result.data["page"]["objects"]:  # type: ignore
-                yield obj
-            next_cursor = result.data["page"]["page_info"]["next_cursor"]  # type: ignore
-            if next_cursor is None:
-                break
+                    await pages.put(page)
+                    next_cursor = page["page_info"]["next_cursor"]
+                    if next_cursor is None:
+                        return
+            except Exception as e:
+                await pages.put(e)
+
+        fetcher = asyncio.create_task(fetch_pages())
+        try:
+            while True:
+                page = await pages.get()
+                if isinstance(page, Exception):
+                    raise page
+                if omitted:
+                    project_objects(page["objects"], omitted)
+                for obj in page["objects"]:
+                    yield obj
+                if page["page_info"]["next_cursor"] is None:
+                    return
+        finally:
+            fetcher.cancel()
+
+    def _collection_priority(self, collection: str | None) -> int:
+        priorities = self.settings.priority_collections
+        if collection in priorities:
+            return priorities.index(collection)
+        return len(priorities)
+
+    async def _collect(
+        self,
+        objs: AsyncIterator[dict],
+        insert: Callable[..., None],
+    ) -> dict:
+        res: dict = {}
+        async for obj in objs:
+            insert(obj, res, compact=self.compact_records)
+        return res
 
     async def _get_org_uuid(self) -> str:
-        root_org_query = gql(
-            """
-            query {
-                org {
-                    uuid
-                }
-            }
-            """
-        )
-        session = await self.gql_client_session()
-        res = await session.execute(root_org_query)
-        return res["org"]["uuid"]
+        """Return the uuid of the root organisation, fetched once per cache."""
+        if self._org_uuid is None:
+            session = await self.gql_client_session()
+            res = await session.execute(parse_query(ROOT_ORG_QUERY))
+            self._org_uuid = res["org"]["uuid"]
+        return self._org_uuid
+
+    def reset_org_uuid(self) -> None:
+        """Fetch the uuid of the root organisation again when next needed."""
+        self._org_uuid = None
 
     async def _cache_lora_facets(self):
         obj = await self._fetch_facets()
         self.facets.update(obj)
 
-    async def _fetch_facets(self, uuid: UUID | None = None) -> dict:
+    async def _fetch_facets(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> dict:
+        return await self._collect(self._iter_facets(uuid), insert_current)
+
+    async def _iter_facets(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> AsyncIterator[dict]:
         logger.info("Caching facets")
         query = """
-            query ($limit: int, $cursor: Cursor) {
-                page: facets(limit: $limit, cursor: $cursor) {
+            query (
+                $filter: FacetFilter
+                $limit: int
+                $cursor: Cursor
+            ) {
+                page: facets(
+                    filter: $filter
+                    limit: $limit
+                    cursor: $cursor
+                ) {
                     objects {
                         uuid
                         obj: current {
@@ -223,29 +635,45 @@ class GQLLoraCache:
         """
         variables = {
             "filter": {
-                "uuids": str(uuid) if uuid is not None else None,
+                "uuids": uuid_filter(uuid),
             },
         }
 
-        res: dict = {}
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query,
+            variable_values=variables,
+            do_paged=not isinstance(uuid, (UUID, str)),
+            collection="facets",
         ):
             if obj is None:
-                return {}
-            obj = convert_dict(obj, resolve_object=False, resolve_validity=False)
-            res.update(obj)
-        return res
+                return
+            obj = TRANSFORMERS["facets"](obj)
+            yield obj
 
     async def _cache_lora_classes(self):
         obj = await self._fetch_classes()
         self.classes.update(obj)
 
-    async def _fetch_classes(self, uuid: UUID | None = None) -> dict:
+    async def _fetch_classes(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> dict:
+        return await self._collect(self._iter_classes(uuid), insert_current)
+
+    async def _iter_classes(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> AsyncIterator[dict]:
         logger.info("Caching classes")
         query = """
-            query ($limit: int, $cursor: Cursor) {
-                page: classes(limit: $limit, cursor: $cursor) {
+            query (
+                $filter: ClassFilter
+                $limit: int
+                $cursor: Cursor
+            ) {
+                page: classes(
+                    filter: $filter
+                    limit: $limit
+                    cursor: $cursor
+                ) {
                     objects {
                         uuid
                         obj: current {
@@ -264,35 +692,45 @@ class GQLLoraCache:
         """
         variables = {
             "filter": {
-                "uuids": str(uuid) if uuid is not None else None,
+                "uuids": uuid_filter(uuid),
             },
         }
-        dictionary = {"name": "title", "facet_uuid": "facet"}
 
-        res: dict = {}
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query,
+            variable_values=variables,
+            do_paged=not isinstance(uuid, (UUID, str)),
+            collection="classes",
         ):
             if obj is None:
-                return {}
-            obj = convert_dict(
-                obj,
-                resolve_object=False,
-                resolve_validity=False,
-                replace_dict=dictionary,
-            )
-            res.update(obj)
-        return res
+                return
+            obj = TRANSFORMERS["classes"](obj)
+            yield obj
 
     async def _cache_lora_itsystems(self):
         obj = await self._fetch_itsystems()
         self.itsystems.update(obj)
 
-    async def _fetch_itsystems(self, uuid: UUID | None = None) -> dict:
+    async def _fetch_itsystems(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> dict:
+        return await self._collect(self._iter_itsystems(uuid), insert_current)
+
+    async def _iter_itsystems(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> AsyncIterator[dict]:
         logger.info("Caching it systems")
         query = """
-            query ($limit: int, $cursor: Cursor) {
-                page: itsystems(limit: $limit, cursor: $cursor) {
+            query (
+                $filter: ITSystemFilter
+                $limit: int
+                $cursor: Cursor
+            ) {
+                page: itsystems(
+                    filter: $filter
+                    limit: $limit
+                    cursor: $cursor
+                ) {
                     objects {
                         uuid
                         obj: current {
@@ -309,25 +747,33 @@ class GQLLoraCache:
         """
         variables = {
             "filter": {
-                "uuids": str(uuid) if uuid is not None else None,
+                "uuids": uuid_filter(uuid),
             },
         }
 
-        res: dict = {}
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query,
+            variable_values=variables,
+            do_paged=not isinstance(uuid, (UUID, str)),
+            collection="itsystems",
         ):
             if obj is None:
-                return {}
-            obj = convert_dict(obj, resolve_object=False, resolve_validity=False)
-            res.update(obj)
-        return res
+                return
+            obj = TRANSFORMERS["itsystems"](obj)
+            yield obj
 
     async def _cache_lora_users(self):
         obj = await self._fetch_users()
         self.users.update(obj)
 
-    async def _fetch_users(self, uuid: UUID | None = None) -> dict:
+    async def _fetch_users(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> dict:
+        return await self._collect(self._iter_users(uuid), insert_obj)
+
+    async def _iter_users(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> AsyncIterator[dict]:
         logger.info("Caching users")
         if self.full_history:
             query = """
@@ -367,7 +813,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -410,39 +856,36 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                 },
             }
 
-        dictionary = {
-            "cpr_no": "cpr",
-            "givenname": "fornavn",
-            "surname": "efternavn",
-            "name": "navn",
-            "nickname": "kaldenavn",
-            "nickname_givenname": "kaldenavn_fornavn",
-            "nickname_surname": "kaldenavn_efternavn",
-        }
-
-        res: dict = {}
-
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query,
+            variable_values=variables,
+            do_paged=not isinstance(uuid, (UUID, str)),
+            collection="users",
         ):
             if obj is None:
-                return {}
+                return
             if not self.full_history:
                 obj = align_current(obj)
 
-            obj = convert_dict(obj, replace_dict=dictionary)
-            insert_obj(obj, res)
-        return res
+            obj = TRANSFORMERS["users"](obj)
+            yield obj
 
     async def _cache_lora_units(self):
         obj = await self._fetch_units()
         self.units.update(obj)
 
-    async def _fetch_units(self, uuid: UUID | None = None) -> dict:
+    async def _fetch_units(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> dict:
+        return await self._collect(self._iter_units(uuid), insert_obj)
+
+    async def _iter_units(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> AsyncIterator[dict]:
         logger.info("Caching org units")
 
         org_uuid = await self._get_org_uuid()
@@ -483,6 +926,9 @@ class GQLLoraCache:
                     else:
                         man["acting_manager_uuid"] = None
 
+                    # Computed already by `resolve_unit_tree`
+                    if "location" in man:
+                        continue
                     ancestors = man.pop("ancestors")
                     location = man["name"]
                     for ancestor in ancestors:
@@ -491,6 +937,12 @@ class GQLLoraCache:
                     man["location"] = location
             return qr
 
+        # The whole tree is needed to resolve it locally, so not when fetching
+        # single units
+        local_tree = (
+            self.settings.local_unit_tree and not self.full_history and uuid is None
+        )
+
         if self.full_history:
             query = """
                 query (
@@ -528,11 +980,53 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
             }
+        elif local_tree:
+            # Ancestors and inherited managers are computed by `resolve_unit_tree`
+            query = """
+                query (
+                    $filter: OrganisationUnitFilter
+                    $limit: int
+                    $cursor: Cursor
+                ) {
+                    page: org_units(
+                        filter: $filter
+                        limit: $limit
+                        cursor: $cursor
+                    ) {
+                        objects {
+                            uuid
+                            obj: current {
+                                uuid
+                                user_key
+                                name
+                                unit_type_uuid
+                                org_unit_level_uuid
+                                time_planning_uuid
+                                parent_uuid
+                                org_unit_hierarchy_uuid: org_unit_hierarchy
+                                manager_uuid: managers(inherit: false) {
+                                    org_unit_uuid
+                                    responsibility_uuids
+                                    uuid
+                                }
+                                validity {
+                                    from
+                                    to
+                                }
+                            }
+                        }
+                        page_info {
+                            next_cursor
+                        }
+                    }
+                }
+            """
+            variables = {"filter": {"uuids": None}}
         else:
             query = """
                 query (
@@ -584,46 +1078,57 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                 },
             }
 
-        dictionary = {
-            "org_unit_level_uuid": "level",
-            "org_unit_hierarchy_uuid": "org_unit_hierarchy",
-            "parent_uuid": "parent",
-            "unit_type_uuid": "unit_type",
-            "time_planning_uuid": "time_planning",
-        }
-        res: dict = {}
-        async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
-        ):
-            if obj is None:
-                return {}
-            if not self.full_history:
-                obj = align_current(obj)
-
+        async def convert(obj: dict) -> dict:
             for item in obj["obj"]:
                 if item["parent_uuid"] == org_uuid:
                     item["parent_uuid"] = None
 
             obj = await format_managers_and_location(obj)
 
-            obj = convert_dict(obj, replace_dict=dictionary)
-            insert_obj(obj, res)
-        return res
+            return TRANSFORMERS["units"](obj)
+
+        tree: list[dict] = []
+        async for obj in self._execute_query(
+            query=query,
+            variable_values=variables,
+            do_paged=not isinstance(uuid, (UUID, str)),
+            collection="units",
+        ):
+            if obj is None:
+                break
+            if not self.full_history:
+                obj = align_current(obj)
+            if local_tree:
+                tree.append(obj)
+                continue
+            yield await convert(obj)
+
+        if local_tree:
+            resolve_unit_tree([obj["obj"][0] for obj in tree])
+            for obj in tree:
+                yield await convert(obj)
 
     async def _cache_lora_engagements(self):
         obj = await self._fetch_engagements()
         self.engagements.update(obj)
 
-    async def _fetch_engagements(self, uuid: UUID | None = None) -> dict:
+    async def _fetch_engagements(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> dict:
+        return await self._collect(self._iter_engagements(uuid), insert_obj)
+
+    async def _iter_engagements(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> AsyncIterator[dict]:
         logger.info("Caching engagements")
 
         def collect_extensions(d: dict):
             for ext_obj in d["obj"]:
-                if ext_obj is None:
+                if ext_obj is None or "extension_1" not in ext_obj:
                     continue
                 ed = {}
                 for i in range(1, 11):
@@ -681,7 +1186,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -734,38 +1239,37 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                 },
             }
 
-        dictionary = {
-            "employee_uuid": "user",
-            "engagement_type_uuid": "engagement_type",
-            "job_function_uuid": "job_function",
-            "org_unit_uuid": "unit",
-            "primary_uuid": "primary_type",
-            "is_primary": "primary_boolean",
-        }
-
-        res: dict = {}
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query,
+            variable_values=variables,
+            do_paged=not isinstance(uuid, (UUID, str)),
+            collection="engagements",
         ):
             if obj is None:
-                return {}
+                return
             if not self.full_history:
                 obj = align_current(obj)
 
             obj = collect_extensions(obj)
-            obj = convert_dict(obj, replace_dict=dictionary)
-            insert_obj(obj, res)
-        return res
+            obj = TRANSFORMERS["engagements"](obj)
+            yield obj
 
     async def _cache_lora_leaves(self):
         obj = await self._fetch_leaves()
         self.leaves.update(obj)
 
-    async def _fetch_leaves(self, uuid: UUID | None = None) -> dict:
+    async def _fetch_leaves(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> dict:
+        return await self._collect(self._iter_leaves(uuid), insert_obj)
+
+    async def _iter_leaves(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> AsyncIterator[dict]:
         logger.info("Caching leaves")
         if self.full_history:
             query = """
@@ -801,7 +1305,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -840,39 +1344,41 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                 },
             }
 
-        replace_dictionary = {
-            "employee_uuid": "user",
-            "leave_type_uuid": "leave_type",
-            "engagement_uuid": "engagement",
-        }
-
-        res: dict = {}
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query,
+            variable_values=variables,
+            do_paged=not isinstance(uuid, (UUID, str)),
+            collection="leaves",
         ):
             if obj is None:
-                return {}
+                return
             if not self.full_history:
                 obj = align_current(obj)
 
-            obj = convert_dict(obj, replace_dict=replace_dictionary)
-            insert_obj(obj, res)
-        return res
+            obj = TRANSFORMERS["leaves"](obj)
+            yield obj
 
     async def _cache_lora_it_connections(self):
         obj = await self._fetch_it_connections()
         self.it_connections.update(obj)
 
-    async def _fetch_it_connections(self, uuid: UUID | None = None) -> dict:
+    async def _fetch_it_connections(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> dict:
+        return await self._collect(self._iter_it_connections(uuid), insert_obj)
+
+    async def _iter_it_connections(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> AsyncIterator[dict]:
         logger.info("Caching it users")
 
         async def set_primary_boolean(res: dict) -> dict:
             for res_obj in res["obj"]:
-                if res_obj is None:
+                if res_obj is None or "primary_uuid" not in res_obj:
                     continue
                 prim = res_obj.pop("primary_uuid")
                 if prim:
@@ -917,7 +1423,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -957,36 +1463,37 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                 },
             }
 
-        dictionary = {
-            "employee_uuid": "user",
-            "itsystem_uuid": "itsystem",
-            "org_unit_uuid": "unit",
-            "user_key": "username",
-        }
-
-        res: dict = {}
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query,
+            variable_values=variables,
+            do_paged=not isinstance(uuid, (UUID, str)),
+            collection="it_connections",
         ):
             if obj is None:
-                return {}
+                return
             if not self.full_history:
                 obj = align_current(obj)
 
             obj = await set_primary_boolean(obj)
-            obj = convert_dict(obj, replace_dict=dictionary)
-            insert_obj(obj, res)
-        return res
+            obj = TRANSFORMERS["it_connections"](obj)
+            yield obj
 
     async def _cache_lora_kles(self):
         obj = await self._fetch_kles()
         self.kles.update(obj)
 
-    async def _fetch_kles(self, uuid: UUID | None = None) -> dict:
+    async def _fetch_kles(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> dict:
+        return await self._collect(self._iter_kles(uuid), insert_obj)
+
+    async def _iter_kles(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> AsyncIterator[dict]:
         logger.info("Caching KLEs")
 
         async def format_aspects(d: dict) -> dict:
@@ -1039,7 +1546,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -1078,35 +1585,37 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                 },
             }
 
-        dictionary = {
-            "kle_aspect_uuid": "kle_aspect",
-            "kle_number_uuid": "kle_number",
-            "org_unit_uuid": "unit",
-        }
-
-        res: dict = {}
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query,
+            variable_values=variables,
+            do_paged=not isinstance(uuid, (UUID, str)),
+            collection="kles",
         ):
             if obj is None:
-                return {}
+                return
             if not self.full_history:
                 obj = align_current(obj)
 
             obj = await format_aspects(obj)
-            obj = convert_dict(obj, replace_dict=dictionary)
-            insert_obj(obj, res)
-        return res
+            obj = TRANSFORMERS["kles"](obj)
+            yield obj
 
     async def _cache_lora_related(self):
         obj = await self._fetch_related()
         self.related.update(obj)
 
-    async def _fetch_related(self, uuid: UUID | None = None) -> dict:
+    async def _fetch_related(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> dict:
+        return await self._collect(self._iter_related(uuid), insert_obj)
+
+    async def _iter_related(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> AsyncIterator[dict]:
         logger.info("Caching related")
 
         def format_related(d: dict):
@@ -1150,7 +1659,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -1186,30 +1695,38 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                 },
             }
 
-        res: dict = {}
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query,
+            variable_values=variables,
+            do_paged=not isinstance(uuid, (UUID, str)),
+            collection="related",
         ):
             if obj is None:
-                return {}
+                return
             if not self.full_history:
                 obj = align_current(obj)
 
             obj = format_related(obj)
 
-            obj = convert_dict(obj)
-            insert_obj(obj, res)
-        return res
+            obj = TRANSFORMERS["related"](obj)
+            yield obj
 
     async def _cache_lora_managers(self):
         obj = await self._fetch_managers()
         self.managers.update(obj)
 
-    async def _fetch_managers(self, uuid: UUID | None = None) -> dict:
+    async def _fetch_managers(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> dict:
+        return await self._collect(self._iter_managers(uuid), insert_obj)
+
+    async def _iter_managers(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> AsyncIterator[dict]:
         logger.info("Caching managers")
         if self.full_history:
             query = """
@@ -1246,7 +1763,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -1286,36 +1803,36 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                 },
             }
 
-        dictionary = {
-            "employee_uuid": "user",
-            "manager_level_uuid": "manager_level",
-            "manager_type_uuid": "manager_type",
-            "responsibility_uuids": "manager_responsibility",
-            "org_unit_uuid": "unit",
-        }
-
-        res: dict = {}
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query,
+            variable_values=variables,
+            do_paged=not isinstance(uuid, (UUID, str)),
+            collection="managers",
         ):
             if obj is None:
-                return {}
+                return
             if not self.full_history:
                 obj = align_current(obj)
 
-            obj = convert_dict(obj, replace_dict=dictionary)
-            insert_obj(obj, res)
-        return res
+            obj = TRANSFORMERS["managers"](obj)
+            yield obj
 
     async def _cache_lora_associations(self):
         obj = await self._fetch_associations()
         self.associations.update(obj)
 
-    async def _fetch_associations(self, uuid: UUID | None = None) -> dict:
+    async def _fetch_associations(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> dict:
+        return await self._collect(self._iter_associations(uuid), insert_obj)
+
+    async def _iter_associations(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> AsyncIterator[dict]:
         logger.info("Caching associations")
 
         async def process_associations_helper(res: dict) -> dict:
@@ -1323,19 +1840,20 @@ class GQLLoraCache:
                 if res_obj is None:
                     continue
                 # check primary
-                prim = res_obj.pop("primary")
-                if prim:
-                    if prim["user_key"] == "primary":
-                        res_obj["primary_boolean"] = True
+                if "primary" in res_obj:
+                    prim = res_obj.pop("primary")
+                    if prim:
+                        if prim["user_key"] == "primary":
+                            res_obj["primary_boolean"] = True
+                        else:
+                            res_obj["primary_boolean"] = False
                     else:
-                        res_obj["primary_boolean"] = False
-                else:
-                    res_obj["primary_boolean"] = None
+                        res_obj["primary_boolean"] = None
 
                 if not res_obj["it_user_uuid"]:
                     res_obj["job_function_uuid"] = None
                 # Resolve dynamic class - including parent class if relevant
-                dynamic_class = res_obj.pop("dynamic_class")
+                dynamic_class = res_obj.pop("dynamic_class", None)
                 if dynamic_class:
                     res_obj["dynamic_class"] = (
                         f"{dynamic_class['parent']['name']} - {dynamic_class['name']}"
@@ -1392,7 +1910,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -1442,46 +1960,51 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                 },
             }
 
-        replace_dict = {
-            "employee_uuid": "user",
-            "association_type_uuid": "association_type",
-            "it_user_uuid": "it_user",
-            "job_function_uuid": "job_function",
-            "org_unit_uuid": "unit",
-        }
-
-        res: dict = {}
-
         async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
+            query=query,
+            variable_values=variables,
+            do_paged=not isinstance(uuid, (UUID, str)),
+            collection="associations",
         ):
             if obj is None:
-                return {}
+                return
             if not self.full_history:
                 obj = align_current(obj)
 
             obj = await process_associations_helper(obj)
-            obj = convert_dict(obj, replace_dict=replace_dict)
+            obj = TRANSFORMERS["associations"](obj)
 
-            insert_obj(obj, res)
-        return res
+            yield obj
 
     async def _cache_lora_address(self):
         obj = await self._fetch_address()
         self.addresses.update(obj)
 
-    async def _fetch_address(self, uuid: UUID | None = None) -> dict:
+    async def _fetch_address(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> dict:
+        return await self._collect(self._iter_address(uuid), insert_obj)
+
+    async def _iter_address(
+        self, uuid: UUID | list[UUID] | list[str] | None = None
+    ) -> AsyncIterator[dict]:
         logger.info("Caching addresses")
 
+        # With a persistent DAR cache, the addresses are named by
+        # `_name_addresses` rather than by MO, which resolves every DAR address
+        # in DAR to name it
+        dar_addresses = self._persistent_dar_cache() if self.resolve_dar else None
+
         async def prep_address(d: dict) -> dict:
             for add_obj in d["obj"]:
                 if add_obj is None:
                     continue
                 scope = add_obj.pop("address_type")["scope"]
+                add_obj.pop("value2")
 
                 add_obj["scope"] = scope_map[scope]
 
@@ -1492,7 +2015,11 @@ class GQLLoraCache:
                     # closest to betegnelse.
                     # We are willing to overwrite an address if it is already present, as it is the
                     # same address for each uuid
-                    self.dar_cache[add_obj["value"]] = {"betegnelse": add_obj["name"]}
+                    if dar_addresses is None:
+                        dar_address = {"betegnelse": add_obj["name"]}
+                        if self.compact_records:
+                            dar_address = to_record(dar_address)
+                        self.dar_cache[add_obj["value"]] = dar_address
                 else:
                     add_obj["dar_uuid"] = None
 
@@ -1524,6 +2051,7 @@ class GQLLoraCache:
                                 visibility_uuid
                                 name
                                 value
+                                value2
                                 uuid
                                 user_key
                                 address_type {
@@ -1543,7 +2071,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                     "from_date": str(datetime.date.today()) if self.skip_past else None,
                     "to_date": None,
                 },
@@ -1569,6 +2097,7 @@ class GQLLoraCache:
                                 visibility_uuid
                                 name
                                 value
+                                value2
                                 uuid
                                 user_key
                                 address_type {
@@ -1588,7 +2117,7 @@ class GQLLoraCache:
             """
             variables = {
                 "filter": {
-                    "uuids": str(uuid) if uuid is not None else None,
+                    "uuids": uuid_filter(uuid),
                 },
             }
 
@@ -1603,19 +2132,20 @@ class GQLLoraCache:
             "DAR": "DAR",
         }
 
-        replace_dict = {
-            "employee_uuid": "user",
-            "org_unit_uuid": "unit",
-            "address_type_uuid": "adresse_type",
-            "visibility_uuid": "visibility",
-        }
+        if dar_addresses is not None:
+            query = prune_query(query, frozenset({"name"}))
+        objects = self._execute_query(
+            query=query,
+            variable_values=variables,
+            do_paged=not isinstance(uuid, (UUID, str)),
+            collection="addresses",
+        )
+        if dar_addresses is not None:
+            objects = self._name_addresses(objects, dar_addresses)
 
-        res: dict = {}
-        async for obj in self._execute_query(
-            query=query, variable_values=variables, do_paged=uuid is None
-        ):
+        async for obj in objects:
             if obj is None:
-                return {}
+                return
             if not self.full_history:
                 obj = align_current(obj)
 
@@ -1633,157 +2163,563 @@ class GQLLoraCache:
                 continue
 
             obj = await prep_address(obj)
-            obj = convert_dict(obj, replace_dict=replace_dict)
+            obj = TRANSFORMERS["addresses"](obj)
 
-            insert_obj(obj, res)
-        return res
+            yield obj
+
+        if dar_addresses is not None:
+            dar_addresses.log_stats()
+
+    def _persistent_dar_cache(self) -> PersistentDARCache | None:
+        """Return the persistent DAR cache, if `dar_cache_path` is configured."""
+        if self.settings.dar_cache_path is None:
+            return None
+        return PersistentDARCache(
+            self.settings.dar_cache_path, self.settings.dar_cache_ttl
+        )
+
+    async def _name_addresses(
+        self, objects: AsyncIterator[dict], dar_addresses: PersistentDARCache
+    ) -> AsyncIterator[dict]:
+        """Name the addresses of `objects`, like MO names them.
+
+        DAR addresses are named by their `betegnelse` in DAR, read from the
+        persistent DAR cache, and only those missing or expired are fetched from
+        DAR. They fill `dar_cache` with the full addresses. DAR addresses which
+        cannot be resolved are named None.
+        """
+        chunk: list[dict] = []
+        async for obj in objects:
+            chunk.append(obj)
+            if len(chunk) >= DAR_CHUNK_SIZE:
+                await self._name_address_chunk(chunk, dar_addresses)
+                for named in chunk:
+                    yield named
+                chunk = []
+        await self._name_address_chunk(chunk, dar_addresses)
+        for named in chunk:
+            yield named
+
+    async def _name_address_chunk(
+        self, chunk: list[dict], dar_addresses: PersistentDARCache
+    ) -> None:
+        validities = []
+        for obj in chunk:
+            if obj is None:
+                continue
+            # A current object is not yet aligned to a list of validities
+            obj_list = obj["obj"] if isinstance(obj["obj"], list) else [obj["obj"]]
+            validities.extend(v for v in obj_list if v is not None)
+        resolved = await dar_addresses.resolve(
+            {
+                validity["value"]
+                for validity in validities
+                if validity["address_type"]["scope"] == "DAR"
+            },
+            fetch_dar_addresses,
+        )
+        for uuid, dar_address in resolved.items():
+            if self.compact_records:
+                dar_address = to_record(dar_address)
+            self.dar_cache[uuid] = dar_address
+        for validity in validities:
+            scope = validity["address_type"]["scope"]
+            if scope == "DAR":
+                dar_address = resolved.get(validity["value"])
+                validity["name"] = dar_address and dar_address["betegnelse"]
+            elif scope == "MULTIFIELD_TEXT":
+                values = (validity["value"], validity["value2"])
+                validity["name"] = " // ".join(filter(None, values))
+            else:
+                validity["name"] = validity["value"]
+
+    def snapshot_fingerprint(self) -> dict[str, Any]:
+        """Return the settings a snapshot of this cache depends on."""
+        fingerprint: dict[str, Any] = {
+            "full_history": self.full_history,
+            "skip_past": self.skip_past,
+            "resolve_dar": self.resolve_dar,
+            # Consumers of compact records get dicts, and the other way round, if
+            # a snapshot is read with a different setting than it was written with
+            "compact_records": self.compact_records,
+        }
+        if self.resolve_dar and self.settings.dar_cache_path is not None:
+            # The DAR addresses are then the full addresses from DAR, rather than
+            # only the names MO gives them
+            fingerprint["full_dar_addresses"] = True
+        if self.projection:
+            fingerprint["projection"] = {
+                collection: sorted(keys) for collection, keys in self.projection.items()
+            }
+        return fingerprint
+
+    def _load_snapshot(self, path: Path, skip_associations: bool) -> None:
+        """Use the snapshot at `path` as the source of the collections.
+
+        The collections are removed from the instance, so `__getattr__` loads
+        each of them from the snapshot on first access.
+        """
+        snapshot = Snapshot(
+            path, self.snapshot_fingerprint(), max_age=self.settings.snapshot_max_age
+        )
+        if not skip_associations and "associations" not in snapshot:
+            snapshot.close()
+            raise SnapshotMismatch("Snapshot does not contain associations")
+        logger.info(f"Using snapshot {path} from {snapshot.created}")
+        self._snapshot = snapshot
+        for name in CACHE_COLLECTIONS:
+            if name in snapshot:
+                self.__dict__.pop(name, None)
+        self.invalidate_indexes()
+
+    def __getattr__(self, name: str) -> Any:
+        snapshot = self.__dict__.get("_snapshot")
+        if snapshot is None or name not in CACHE_COLLECTIONS:
+            raise AttributeError(name)
+        collection = snapshot.load(name)
+        setattr(self, name, collection)
+        return collection
+
+    async def _changed_since(self, since: datetime.datetime) -> dict[str, set[str]]:
+        """Return the uuids of objects registered in MO since `since`.
+
+        The uuids are grouped by the name of the collection they belong to.
+        """
+        query = """
+            query (
+                $filter: RegistrationFilter
+                $limit: int
+                $cursor: Cursor
+            ) {
+                page: registrations(
+                    filter: $filter
+                    limit: $limit
+                    cursor: $cursor
+                ) {
+                    objects {
+                        model
+                        uuid
+                    }
+                    page_info {
+                        next_cursor
+                    }
+                }
+            }
+        """
+        variables = {"filter": {"start": since.isoformat()}}
+        changed: dict[str, set[str]] = defaultdict(set)
+        async for registration in self._execute_query(
+            query=query, variable_values=variables, collection="registrations"
+        ):
+            collection = REGISTRATION_MODELS.get(registration["model"])
+            if collection is not None:
+                changed[collection].add(str(registration["uuid"]))
+        return changed
+
+    def _unit_descendants(self, uuids: set[str]) -> set[str]:
+        """Return the given units and all units below them in the cached tree."""
+        children: dict[str, list[str]] = defaultdict(list)
+        for uuid, validities in self.units.items():
+            for unit in validities:
+                if unit["parent"] is not None:
+                    children[unit["parent"]].append(uuid)
+        result = set()
+        stack = list(uuids)
+        while stack:
+            uuid = stack.pop()
+            if uuid in result:
+                continue
+            result.add(uuid)
+            stack.extend(children.get(uuid, []))
+        return result
+
+    async def _apply_changes(
+        self, changed: dict[str, set[str]], skip_associations: bool
+    ) -> None:
+        """Refetch the changed objects and merge them into the collections.
 
-    async def populate_cache_async(self, dry_run=None, skip_associations=False):
+        Objects which no longer exist in MO are removed from the collections.
+        """
+        fetchers = {
+            "facets": self._fetch_facets,
+            "classes": self._fetch_classes,
+            "itsystems": self._fetch_itsystems,
+            "users": self._fetch_users,
+            "engagements": self._fetch_engagements,
+            "leaves": self._fetch_leaves,
+            "it_connections": self._fetch_it_connections,
+            "kles": self._fetch_kles,
+            "related": self._fetch_related,
+            "managers": self._fetch_managers,
+            "associations": self._fetch_associations,
+            "addresses": self._fetch_address,
+            # Units go last, as the units to refetch depend on the managers
+            "units": self._fetch_units,
+        }
+        if skip_associations:
+            del fetchers["associations"]
+
+        def manager_units() -> set[str]:
+            return {
+                manager["unit"]
+                for uuid in changed.get("managers", set())
+                for manager in self.managers.get(uuid, [])
+            }
+
+        # Units of the changed managers, both before and after the change
+        units_with_changed_managers = manager_units()
+        for name, fetch in fetchers.items():
+            uuids = set(changed.get(name, set()))
+            if name == "units" and not self.full_history:
+                # The location and inherited managers of a unit are derived from
+                # the units above it, and from the managers of those.
+                uuids |= units_with_changed_managers | manager_units()
+                uuids = self._unit_descendants(uuids)
+            if not uuids:
+                continue
+            logger.info(f"Refreshing {len(uuids)} {name}")
+            collection = getattr(self, name)
+            for chunk in chunked(sorted(uuids), self.page_size):
+                result = await fetch(chunk)
+                for uuid in chunk:
+                    collection.pop(uuid, None)
+                collection.update(result)
+            self.invalidate_indexes(name)
+
+    async def _refresh_from_snapshot(
+        self, path: Path, skip_associations: bool
+    ) -> dict[str, Any]:
+        """Load the snapshot at `path` and apply the changes made in MO since.
+
+        Returns the metadata for the new snapshot. Raises `SnapshotMismatch` if
+        the snapshot cannot be used for an incremental refresh, in which case a
+        full refresh is needed.
+        """
+        snapshot = Snapshot(path, self.snapshot_fingerprint())
+        try:
+            fetched_at = datetime.datetime.fromisoformat(
+                snapshot.metadata["fetched_at"]
+            )
+            full_fetched_at = datetime.datetime.fromisoformat(
+                snapshot.metadata["full_fetched_at"]
+            )
+            now = datetime.datetime.now(datetime.timezone.utc)
+            if now - full_fetched_at > self.settings.full_refresh_interval:
+                raise SnapshotMismatch(f"Last full refresh was at {full_fetched_at}")
+            # Actual state depends on the current date, as validities start and
+            # end without any registrations in MO.
+            if not self.full_history or self.skip_past:
+                if fetched_at.astimezone().date() != datetime.date.today():
+                    raise SnapshotMismatch(f"Snapshot is from {fetched_at.date()}")
+            if not skip_associations and "associations" not in snapshot:
+                raise SnapshotMismatch("Snapshot does not contain associations")
+            for name in CACHE_COLLECTIONS:
+                if name in snapshot:
+                    setattr(self, name, snapshot.load(name))
+        finally:
+            snapshot.close()
+
+        changed = await self._changed_since(fetched_at)
+        await self._apply_changes(changed, skip_associations)
+        return {
+            "fetched_at": now.isoformat(),
+            "full_fetched_at": full_fetched_at.isoformat(),
+        }
+
+    async def populate_cache_async(
+        self, dry_run=None, skip_associations=False, incremental=None
+    ):
         """
         Perform the actual data import.
         :param skip_associations: If associations are not needed, they can be
         skipped for increased performance.
         :param dry_run: For testing purposes it is possible to read from cache.
+        If no snapshot matching the settings of the cache exists, the data is
+        fetched from MO instead.
+        :param incremental: Start from the last snapshot and only fetch the
+        objects changed in MO since. Falls back to a full fetch if the snapshot
+        cannot be used, or if the last full fetch is older than
+        `full_refresh_interval`. Defaults to the `incremental_refresh` setting.
         """
         if dry_run is None:
             dry_run = os.environ.get("USE_CACHED_LORACACHE", False)
+        if incremental is None:
+            incremental = self.settings.incremental_refresh
 
         # Ensure that tmp/ exists
         Path("tmp/").mkdir(exist_ok=True)
-
-        if self.full_history:
-            if self.skip_past:
-                facets_file = "tmp/facets_historic_skip_past.p"
-                classes_file = "tmp/classes_historic_skip_past.p"
-                users_file = "tmp/users_historic_skip_past.p"
-                units_file = "tmp/units_historic_skip_past.p"
-                addresses_file = "tmp/addresses_historic_skip_past.p"
-                engagements_file = "tmp/engagements_historic_skip_past.p"
-                managers_file = "tmp/managers_historic_skip_past.p"
-                associations_file = "tmp/associations_historic_skip_past.p"
-                leaves_file = "tmp/leaves_historic_skip_past.p"
-                itsystems_file = "tmp/itsystems_historic_skip_past.p"
-                it_connections_file = "tmp/it_connections_historic_skip_past.p"
-                kles_file = "tmp/kles_historic_skip_past.p"
-                related_file = "tmp/related_historic_skip_past.p"
-                dar_file = "tmp/dar_historic_skip_past.p"
-            else:
-                facets_file = "tmp/facets_historic.p"
-                classes_file = "tmp/classes_historic.p"
-                users_file = "tmp/users_historic.p"
-                units_file = "tmp/units_historic.p"
-                addresses_file = "tmp/addresses_historic.p"
-                engagements_file = "tmp/engagements_historic.p"
-                managers_file = "tmp/managers_historic.p"
-                associations_file = "tmp/associations_historic.p"
-                leaves_file = "tmp/leaves_historic.p"
-                itsystems_file = "tmp/itsystems_historic.p"
-                it_connections_file = "tmp/it_connections_historic.p"
-                kles_file = "tmp/kles_historic.p"
-                related_file = "tmp/related_historic.p"
-                dar_file = "tmp/dar_historic.p"
-        else:
-            facets_file = "tmp/facets.p"
-            classes_file = "tmp/classes.p"
-            users_file = "tmp/users.p"
-            units_file = "tmp/units.p"
-            addresses_file = "tmp/addresses.p"
-            engagements_file = "tmp/engagements.p"
-            managers_file = "tmp/managers.p"
-            associations_file = "tmp/associations.p"
-            leaves_file = "tmp/leaves.p"
-            itsystems_file = "tmp/itsystems.p"
-            it_connections_file = "tmp/it_connections.p"
-            kles_file = "tmp/kles.p"
-            related_file = "tmp/related.p"
-            dar_file = "tmp/dar.p"
+        fingerprint = self.snapshot_fingerprint()
+        path = snapshot_path(Path("tmp/"), fingerprint)
 
         if dry_run:
-            with open(facets_file, "rb") as f:
-                self.facets = pickle.load(f)
-            with open(classes_file, "rb") as f:
-                self.classes = pickle.load(f)
-            with open(users_file, "rb") as f:
-                self.users = pickle.load(f)
-            with open(units_file, "rb") as f:
-                self.units = pickle.load(f)
-            with open(addresses_file, "rb") as f:
-                self.addresses = pickle.load(f)
-            with open(engagements_file, "rb") as f:
-                self.engagements = pickle.load(f)
-            with open(managers_file, "rb") as f:
-                self.managers = pickle.load(f)
+            try:
+                self._load_snapshot(path, skip_associations)
+                return
+            except SnapshotMismatch as e:
+                logger.warning(f"Not using snapshot: {e}")
+
+        if incremental:
+            try:
+                metadata = await self._refresh_from_snapshot(path, skip_associations)
+            except SnapshotMismatch as e:
+                logger.warning(f"Doing a full refresh: {e}")
+            else:
+                self._write_snapshot(path, skip_associations, metadata)
+                return
 
-            if not skip_associations:
-                with open(associations_file, "rb") as f:
-                    self.associations = pickle.load(f)
-
-            with open(leaves_file, "rb") as f:
-                self.leaves = pickle.load(f)
-            with open(itsystems_file, "rb") as f:
-                self.itsystems = pickle.load(f)
-            with open(it_connections_file, "rb") as f:
-                self.it_connections = pickle.load(f)
-            with open(kles_file, "rb") as f:
-                self.kles = pickle.load(f)
-            with open(related_file, "rb") as f:
-                self.related = pickle.load(f)
-            with open(dar_file, "rb") as f:
-                self.dar_cache = pickle.load(f)
-            return
+        fetched_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        self.reset_org_uuid()
 
         # `tasks` is used to keep strong references. Otherwise, it can be
         # cleared by the garbage collector mid-execution as the event loop
         # only keeps weak references.
+        shard_directory = path.with_suffix(".shards")
+
+        async def cache(name: str, cache_lora: Callable[[], Any]) -> None:
+            if not self._shard_history(name):
+                return await cache_lora()
+            collection = await self._fetch_history_sharded(name, shard_directory)
+            getattr(self, name).update(collection)
+
         tasks = []
         async with asyncio.TaskGroup() as tg:
-            tasks.append(tg.create_task(self._cache_lora_address()))
-            tasks.append(tg.create_task(self._cache_lora_units()))
-            tasks.append(tg.create_task(self._cache_lora_engagements()))
+            tasks.append(tg.create_task(cache("addresses", self._cache_lora_address)))
+            tasks.append(tg.create_task(cache("units", self._cache_lora_units)))
+            tasks.append(
+                tg.create_task(cache("engagements", self._cache_lora_engagements))
+            )
             tasks.append(tg.create_task(self._cache_lora_facets()))
             tasks.append(tg.create_task(self._cache_lora_classes()))
-            tasks.append(tg.create_task(self._cache_lora_users()))
-            tasks.append(tg.create_task(self._cache_lora_managers()))
+            tasks.append(tg.create_task(cache("users", self._cache_lora_users)))
+            tasks.append(tg.create_task(cache("managers", self._cache_lora_managers)))
             if not skip_associations:
-                tasks.append(tg.create_task(self._cache_lora_associations()))
-            tasks.append(tg.create_task(self._cache_lora_leaves()))
+                tasks.append(
+                    tg.create_task(cache("associations", self._cache_lora_associations))
+                )
+            tasks.append(tg.create_task(cache("leaves", self._cache_lora_leaves)))
             tasks.append(tg.create_task(self._cache_lora_itsystems()))
-            tasks.append(tg.create_task(self._cache_lora_it_connections()))
-            tasks.append(tg.create_task(self._cache_lora_kles()))
-            tasks.append(tg.create_task(self._cache_lora_related()))
+            tasks.append(
+                tg.create_task(cache("it_connections", self._cache_lora_it_connections))
+            )
+            tasks.append(tg.create_task(cache("kles", self._cache_lora_kles)))
+            tasks.append(tg.create_task(cache("related", self._cache_lora_related)))
         del tasks
+        self.invalidate_indexes()
+        if self.page_sizes.adaptive:
+            logger.info(f"Final page sizes: {self.page_sizes.sizes()}")
+
+        self._write_snapshot(
+            path,
+            skip_associations,
+            {"fetched_at": fetched_at, "full_fetched_at": fetched_at},
+        )
 
-        def write_caches(cache, filename, name):
-            logger.debug(f"writing {name}")
-            if filename:
-                with open(filename, "wb") as fw:
-                    pickle.dump(cache, fw, pickle.DEFAULT_PROTOCOL)
-            logger.debug(f"done with {name}")
-
-        write_caches(self.facets, facets_file, "facets")
-        write_caches(self.engagements, engagements_file, "engagements")
-        write_caches(self.classes, classes_file, "classes")
-        write_caches(self.users, users_file, "users")
-        write_caches(self.units, units_file, "units")
-        write_caches(self.managers, managers_file, "managers")
-        write_caches(self.leaves, leaves_file, "leaves")
-        write_caches(self.addresses, addresses_file, "addresses")
-        write_caches(self.dar_cache, dar_file, "dar_addresses")
-        write_caches(self.itsystems, itsystems_file, "itsystems")
-        write_caches(self.it_connections, it_connections_file, "it_connections")
-        write_caches(self.kles, kles_file, "kles")
-        write_caches(self.related, related_file, "related")
-
-        if not skip_associations:
-            write_caches(self.associations, associations_file, "associations")
+    def _iterators(
+        self,
+    ) -> dict[str, tuple[Callable[..., AsyncIterator[dict]], Callable[..., None]]]:
+        """Return the iterator of each collection, and how to insert its objects."""
+        return {
+            "facets": (self._iter_facets, insert_current),
+            "classes": (self._iter_classes, insert_current),
+            "itsystems": (self._iter_itsystems, insert_current),
+            "users": (self._iter_users, insert_obj),
+            "units": (self._iter_units, insert_obj),
+            "engagements": (self._iter_engagements, insert_obj),
+            "leaves": (self._iter_leaves, insert_obj),
+            "it_connections": (self._iter_it_connections, insert_obj),
+            "kles": (self._iter_kles, insert_obj),
+            "related": (self._iter_related, insert_obj),
+            "managers": (self._iter_managers, insert_obj),
+            "associations": (self._iter_associations, insert_obj),
+            "addresses": (self._iter_address, insert_obj),
+        }
+
+    def _shard_history(self, name: str) -> bool:
+        return (
+            self.full_history
+            and self.settings.history_shard_size is not None
+            and name in HISTORY_SHARD_FIELDS
+        )
+
+    async def _list_uuids(self, name: str) -> list[str]:
+        """Return the uuids of the objects of the collection `name` in MO."""
+        field, filter_type = HISTORY_SHARD_FIELDS[name]
+        query = f"""
+            query (
+                $filter: {filter_type}
+                $limit: int
+                $cursor: Cursor
+            ) {{
+                page: {field}(
+                    filter: $filter
+                    limit: $limit
+                    cursor: $cursor
+                ) {{
+                    objects {{
+                        uuid
+                    }}
+                    page_info {{
+                        next_cursor
+                    }}
+                }}
+            }}
+        """
+        # The same objects as the full history queries of the collection
+        variables = {
+            "filter": {
+                "from_date": str(datetime.date.today()) if self.skip_past else None,
+                "to_date": None,
+            },
+        }
+        return [
+            str(obj["uuid"])
+            async for obj in self._execute_query(
+                query=query, variable_values=variables, collection=f"{name}_uuids"
+            )
+        ]
+
+    async def _fetch_history_sharded(self, name: str, directory: Path) -> dict:
+        """Fetch the full history of the collection `name` in shards.
+
+        The shards are fetched concurrently, within the query budget of the cache,
+        and checkpointed to `directory`. Shards checkpointed by an earlier, failed
+        fetch are read from their checkpoints instead of fetched again. As every
+        object is in exactly one shard, with all of its validities, merging the
+        shards gives the same collection as fetching it in one go.
+        """
+        iterate, insert = self._iterators()[name]
+        uuids = sorted(await self._list_uuids(name))
+        shards = list(chunked(uuids, self.settings.history_shard_size))
+        logger.info(f"Fetching {len(uuids)} {name} in {len(shards)} shards")
+
+        async def fetch_shard(shard: list[str]) -> dict:
+            path = checkpoint_path(directory, name, shard)
+            checkpoint = read_checkpoint(path, self.settings.history_shard_max_age)
+            if checkpoint is not None:
+                objects, dar_cache = checkpoint
+                self.dar_cache.update(dar_cache)
+                return objects
+            async for attempt in AsyncRetrying(
+                wait=wait_random_exponential(multiplier=2, max=30),
+                stop=stop_after_attempt(self.settings.history_shard_attempts),
+                retry=retry_if_not_exception_type(ReplayMismatch),
+                reraise=True,
+            ):
+                with attempt:
+                    objects = await self._collect(iterate(shard), insert)
+            # Fetching addresses fills the DAR cache, which must be restored along
+            # with them
+            dar_cache = {
+                validity["dar_uuid"]: self.dar_cache[validity["dar_uuid"]]
+                for validities in objects.values()
+                for validity in validities
+                if name == "addresses"
+                and validity is not None
+                and validity["dar_uuid"] in self.dar_cache
+            }
+            write_checkpoint(path, (objects, dar_cache))
+            return objects
+
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(fetch_shard(shard)) for shard in shards]
+        result: dict = {}
+        for task in tasks:
+            result.update(task.result())
+        remove_checkpoints(directory, name)
+        return result
+
+    async def stream_collection(
+        self, name: str, batch_size: int
+    ) -> AsyncIterator[dict]:
+        """Yield the collection `name` in batches of about `batch_size` objects.
+
+        The batches have the same layout as the collection, but are not stored in
+        the cache, so only the batch being consumed and the pages being prefetched
+        are held in memory. Fetching addresses still fills `dar_cache`.
+        """
+        iterate, insert = self._iterators()[name]
+        batch: dict = {}
+        async for obj in iterate():
+            insert(obj, batch)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = {}
+        if batch:
+            yield batch
+
+    def _write_snapshot(
+        self, path: Path, skip_associations: bool, metadata: dict[str, Any]
+    ) -> None:
+        collections = [
+            name
+            for name in CACHE_COLLECTIONS
+            if not (skip_associations and name == "associations")
+        ]
+        write_snapshot(
+            path,
+            self.snapshot_fingerprint(),
+            ((name, getattr(self, name)) for name in collections),
+            metadata,
+        )
 
     @async_to_sync
-    async def populate_cache(self, dry_run=None, skip_associations=False):
-        logger.info(f"Populating cache {dry_run=} {skip_associations=}")
+    async def populate_cache(
+        self, dry_run=None, skip_associations=False, incremental=None
+    ):
+        logger.info(f"Populating cache {dry_run=} {skip_associations=} {incremental=}")
         await self.populate_cache_async(
-            dry_run=dry_run, skip_associations=skip_associations
+            dry_run=dry_run,
+            skip_associations=skip_associations,
+            incremental=incremental,
         )
 
+    def memory_usage(self) -> dict[str, int]:
+        """Approximate the memory used by each collection, in bytes.
+
+        Objects shared between collections, such as interned UUIDs, are counted
+        in the first collection referencing them.
+        """
+        seen: set[int] = set()
+        return {
+            name: deep_sizeof(getattr(self, name), seen) for name in CACHE_COLLECTIONS
+        }
+
+    def lookup(self, collection: str, field: str, value: str | None) -> dict:
+        """Return the objects of `collection` with `value` in `field`.
+
+        The objects are returned in the layout of the collection. An object matches
+        if any of its validities does. The lookup uses a secondary index of the
+        collection, which is built on first use and kept until the collection is
+        refreshed. See `INDEXED_FIELDS` for the fields which can be looked up.
+        """
+        objects = getattr(self, collection)
+        uuids = self._index(collection, field).get(value, [])
+        return {uuid: objects[uuid] for uuid in uuids}
+
+    def _index(self, collection: str, field: str) -> dict[str, list[str]]:
+        if field not in INDEXED_FIELDS.get(collection, ()):
+            raise ValueError(f"{collection} cannot be looked up by {field}")
+        objects = getattr(self, collection)
+        cached = self._indexes.get((collection, field))
+        # A collection replaced rather than refreshed gets a new index too
+        if cached is not None and cached[0] is objects:
+            return cached[1]
+        index: dict[str, list[str]] = defaultdict(list)
+        for uuid, validities in objects.items():
+            values = {
+                validity.get(field) for validity in validities if validity is not None
+            }
+            for value in values:
+                index[value].append(uuid)
+        self._indexes[(collection, field)] = (objects, index)
+        return index
+
+    def invalidate_indexes(self, *collections: str) -> None:
+        """Drop the secondary indexes of `collections`, or of every collection."""
+        for collection, field in list(self._indexes):
+            if not collections or collection in collections:
+                del self._indexes[(collection, field)]
+
     def calculate_primary_engagements(self):
         # Needed for compatibility reasons
         pass
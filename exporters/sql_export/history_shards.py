@@ -0,0 +1,61 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+"""Checkpoints of the shards of a full history fetch.
+
+With `history_shard_size` set, a full history fetch of a collection first lists the
+uuids of the collection, and then fetches the validities of the objects in shards
+of that many uuids, concurrently. Each shard is written to a checkpoint file when
+fetched, so a fetch which fails part way can be resumed by fetching only the
+shards missing. The checkpoints are removed when the whole collection is fetched.
+"""
+
+import datetime
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import zlib
+from pathlib import Path
+from typing import Any
+from typing import Iterable
+
+logger = logging.getLogger(__name__)
+
+
+def shard_key(uuids: Iterable[str]) -> str:
+    """Return a name identifying the shard of `uuids`."""
+    return hashlib.sha256("\n".join(sorted(uuids)).encode()).hexdigest()[:32]
+
+
+def checkpoint_path(directory: Path, collection: str, uuids: Iterable[str]) -> Path:
+    return directory / collection / f"{shard_key(uuids)}.checkpoint"
+
+
+def write_checkpoint(path: Path, shard: Any) -> None:
+    """Write the fetched shard to `path`, replacing it once complete."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(zlib.compress(pickle.dumps(shard, pickle.HIGHEST_PROTOCOL)))
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path: Path, max_age: datetime.timedelta | None) -> Any | None:
+    """Return the shard checkpointed at `path`, if there is a recent enough one."""
+    try:
+        modified = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    if max_age is not None:
+        age = datetime.datetime.now().timestamp() - modified
+        if age > max_age.total_seconds():
+            logger.info(f"Not using checkpoint {path}, as it is {age:.0f}s old")
+            return None
+    with open(path, "rb") as f:
+        return pickle.loads(zlib.decompress(f.read()))
+
+
+def remove_checkpoints(directory: Path, collection: str) -> None:
+    shutil.rmtree(directory / collection, ignore_errors=True)
@@ -9,14 +9,40 @@ import sys
 
 import click
 from fastramqpi.ra_utils.load_settings import load_settings
+from sqlalchemy import Index
+from sqlalchemy import MetaData
 from sqlalchemy import create_engine
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
 
 from .sql_export import SqlExport
+from .sql_table_defs import Base
+from .sql_table_defs import WAdresse
+from .sql_table_defs import WBruger
+from .sql_table_defs import WEngagement
+from .sql_table_defs import WEnhed
+from .sql_table_defs import WLeder
+from .sql_table_defs import WLederAnsvar
+from .sql_table_defs import index_name
 
 LOG_LEVEL = logging.DEBUG
 
 logger = logging.getLogger("lc-for-jobs")
 
+# The jobs only read the database, so larger pages mean fewer reads per lookup
+SQLITE_PAGE_SIZE = 8192
+
+# Indexes of the lookups of `JobsDatabase`, on top of the secondary indexes of the
+# export. The jobs read the work tables, which are not swapped in this database.
+JOBS_INDEXES = {
+    "wadresser": [
+        ("bruger_uuid", "adressetype_scope"),
+        ("enhed_uuid", "adressetype_scope"),
+    ],
+    "wenheder": [("forældreenhed_uuid",)],
+}
+
 
 def get_engine(dbpath=None):
     if dbpath is None:
@@ -30,6 +56,87 @@ def get_engine(dbpath=None):
     return create_engine(db_string)
 
 
+def optimise_database(engine: Engine, page_size: int = SQLITE_PAGE_SIZE) -> None:
+    """Prepare the exported database for being read by the jobs.
+
+    Creates the indexes of `JOBS_INDEXES`, rebuilds the file with `page_size`,
+    gathers the statistics of the query planner and switches to WAL, so the jobs
+    can read while the database is being exported again.
+    """
+    tables = Base.metadata.tables
+    with engine.begin() as connection:
+        for table_name, indexes in JOBS_INDEXES.items():
+            table = tables[table_name].to_metadata(MetaData())
+            for columns in indexes:
+                index = Index(
+                    index_name(table.name, "_".join(columns)),
+                    *(table.c[column] for column in columns),
+                )
+                index.create(connection, checkfirst=True)
+
+    # VACUUM cannot run in a transaction, and the page size cannot be changed in WAL
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql("PRAGMA journal_mode = DELETE")
+        connection.exec_driver_sql(f"PRAGMA page_size = {page_size}")
+        connection.exec_driver_sql("VACUUM")
+        connection.exec_driver_sql("ANALYZE")
+        connection.exec_driver_sql("PRAGMA journal_mode = WAL")
+
+
+class JobsDatabase:
+    """Typed lookups in the database of lc-for-jobs.
+
+    The lookups are served by the indexes of the database, so jobs need not load
+    whole tables to find the rows of a few users or units.
+    """
+
+    def __init__(self, engine: Engine | None = None) -> None:
+        self.session = Session(engine or get_engine())
+
+    def close(self) -> None:
+        self.session.close()
+
+    def user(self, uuid: str) -> WBruger | None:
+        return self.session.scalars(select(WBruger).filter_by(uuid=uuid)).first()
+
+    def unit(self, uuid: str) -> WEnhed | None:
+        return self.session.scalars(select(WEnhed).filter_by(uuid=uuid)).first()
+
+    def child_units(self, uuid: str) -> list[WEnhed]:
+        query = select(WEnhed).filter_by(forældreenhed_uuid=uuid).order_by(WEnhed.navn)
+        return list(self.session.scalars(query))
+
+    def engagements_by_user(self, bruger_uuid: str) -> list[WEngagement]:
+        query = select(WEngagement).filter_by(bruger_uuid=bruger_uuid)
+        return list(self.session.scalars(query))
+
+    def engagements_by_unit(self, enhed_uuid: str) -> list[WEngagement]:
+        query = select(WEngagement).filter_by(enhed_uuid=enhed_uuid)
+        return list(self.session.scalars(query))
+
+    def addresses_by_scope(
+        self,
+        scope: str,
+        bruger_uuid: str | None = None,
+        enhed_uuid: str | None = None,
+    ) -> list[WAdresse]:
+        """Return the addresses of `scope`, optionally of a single user or unit."""
+        query = select(WAdresse).filter_by(adressetype_scope=scope)
+        if bruger_uuid is not None:
+            query = query.filter_by(bruger_uuid=bruger_uuid)
+        if enhed_uuid is not None:
+            query = query.filter_by(enhed_uuid=enhed_uuid)
+        return list(self.session.scalars(query))
+
+    def managers_of_unit(self, enhed_uuid: str) -> list[WLeder]:
+        query = select(WLeder).filter_by(enhed_uuid=enhed_uuid)
+        return list(self.session.scalars(query))
+
+    def manager_responsibilities(self, leder_uuid: str) -> list[WLederAnsvar]:
+        query = select(WLederAnsvar).filter_by(leder_uuid=leder_uuid)
+        return list(self.session.scalars(query))
+
+
 @click.group()
 def cli():
     # Solely used for command grouping
@@ -57,6 +164,8 @@ def sql_export(resolve_dar):
 
     sql_export = SqlExport(force_sqlite=True, historic=False, settings=settings)
     sql_export.perform_export(resolve_dar=resolve_dar)
+    sql_export.session.close()
+    optimise_database(sql_export.engine)
 
 
 if __name__ == "__main__":
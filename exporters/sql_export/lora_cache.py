@@ -16,7 +16,13 @@ DEFAULT_TIMEZONE = tz.gettz("Europe/Copenhagen")
 PICKLE_PROTOCOL = pickle.DEFAULT_PROTOCOL
 
 
-def get_cache(resolve_dar=True, full_history=False, skip_past=False, settings=None):
+def get_cache(
+    resolve_dar=True,
+    full_history=False,
+    skip_past=False,
+    settings=None,
+    projection=None,
+):
     if get_gql_cache_settings().sentry_dsn:
         sentry_sdk.init(dsn=get_gql_cache_settings().sentry_dsn)
 
@@ -25,6 +31,7 @@ def get_cache(resolve_dar=True, full_history=False, skip_past=False, settings=No
         full_history=full_history,
         skip_past=skip_past,
         settings=settings,
+        projection=projection,
     )
 
 
@@ -60,19 +67,31 @@ def fetch_loracache() -> Tuple[GQLLoraCache, GQLLoraCache]:
     help="Resolve DAR addresses",
 )
 @click.option("--read-from-cache", is_flag=True)
-def cli(historic, skip_past, resolve_dar, read_from_cache):
+@click.option(
+    "--incremental/--full",
+    default=None,
+    help="Only fetch objects changed since the last run",
+)
+@click.option(
+    "--report-memory", is_flag=True, help="Log memory usage for each collection"
+)
+def cli(historic, skip_past, resolve_dar, read_from_cache, incremental, report_memory):
     get_gql_cache_settings().start_logging_based_on_settings()
     lc = get_cache(
         full_history=historic,
         skip_past=skip_past,
         resolve_dar=resolve_dar,
     )
-    lc.populate_cache(dry_run=read_from_cache)
+    lc.populate_cache(dry_run=read_from_cache, incremental=incremental)
 
     logger.info("Now calcualate derived data")
     lc.calculate_derived_unit_data()
     lc.calculate_primary_engagements()
 
+    if report_memory:
+        for name, size in lc.memory_usage().items():
+            logger.info(f"{name}: {size / 2**20:.1f} MiB")
+
 
 if __name__ == "__main__":
     cli()
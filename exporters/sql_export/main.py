@@ -6,8 +6,10 @@
 import logging
 import time
 from contextlib import asynccontextmanager
+from functools import partial
 from typing import Annotated
 from typing import AsyncGenerator
+from uuid import UUID
 
 import sentry_sdk
 from fastapi import APIRouter
@@ -24,6 +26,7 @@ from fastramqpi.ramqp.mo import PayloadUUID
 
 from .config import DatabaseSettings
 from .config import GqlLoraCacheSettings
+from .event_batcher import EventBatcher
 from .gql_lora_cache_async import GQLLoraCache
 from .sql_export import SqlExport as _SqlExport
 from .sql_table_defs import KLE
@@ -51,188 +54,249 @@ actualstate_router = MORouter()
 historic_router = MORouter()
 
 SqlExport = Annotated[_SqlExport, Depends(from_user_context("sql_exporter"))]
-SqlExportHistoric = Annotated[
-    _SqlExport, Depends(from_user_context("sql_exporter_historic"))
+Batcher = Annotated[EventBatcher, Depends(from_user_context("event_batcher"))]
+BatcherHistoric = Annotated[
+    EventBatcher, Depends(from_user_context("event_batcher_historic"))
 ]
 
 
-async def handle_address(uuid: PayloadUUID, sql_exporter: SqlExport):
-    result = await sql_exporter.lc._fetch_address(uuid)
-    address_objects = []
-    dar_address_objects = []
-    for res in result.get(str(uuid), []):
-        if res["scope"] == "DAR":
-            dar_address_objects.append(
-                sql_exporter._generate_sql_dar_addresses(uuid, res, DARAdresse)
-            )
+async def handle_address(uuids: list[UUID], sql_exporter: SqlExport):
+    result = await sql_exporter.lc._fetch_address(uuids)
+    address_objects: dict[UUID, list[Adresse]] = {}
+    dar_address_objects: dict[UUID, list[DARAdresse]] = {}
+    for uuid in uuids:
+        address_objects[uuid] = []
+        dar_address_objects[uuid] = []
+        for res in result.get(str(uuid), []):
+            if res["scope"] == "DAR":
+                dar_address_objects[uuid].append(
+                    sql_exporter._generate_sql_dar_addresses(uuid, res, DARAdresse)
+                )
 
-        address_objects.append(sql_exporter._generate_sql_addresses(uuid, res, Adresse))
+            address_objects[uuid].append(
+                sql_exporter._generate_sql_addresses(uuid, res, Adresse)
+            )
 
-    sql_exporter.update_sql(uuid, dar_address_objects, DARAdresse)
-    sql_exporter.update_sql(uuid, address_objects, Adresse)
+    sql_exporter.update_sql_many(dar_address_objects, DARAdresse, commit=False)
+    sql_exporter.update_sql_many(address_objects, Adresse, commit=False)
 
 
 async def handle_association(
-    uuid: PayloadUUID,
+    uuids: list[UUID],
     sql_exporter: SqlExport,
 ):
-    result = await sql_exporter.lc._fetch_associations(uuid)
+    result = await sql_exporter.lc._fetch_associations(uuids)
 
-    association_objects = [
-        sql_exporter._generate_sql_associations(uuid, res, Tilknytning)
-        for res in result.get(str(uuid), [])
-    ]
+    association_objects = {
+        uuid: [
+            sql_exporter._generate_sql_associations(uuid, res, Tilknytning)
+            for res in result.get(str(uuid), [])
+        ]
+        for uuid in uuids
+    }
 
-    sql_exporter.update_sql(uuid, association_objects, Tilknytning)
+    sql_exporter.update_sql_many(association_objects, Tilknytning, commit=False)
 
 
 async def handle_class(
-    uuid: PayloadUUID,
+    uuids: list[UUID],
     sql_exporter: SqlExport,
 ):
-    result = await sql_exporter.lc._fetch_classes(uuid)
-    res = result.get(str(uuid))
-    class_objects = (
-        [sql_exporter._generate_sql_classes(uuid, res, Klasse)] if res else []
-    )
-    sql_exporter.update_sql(uuid, class_objects, Klasse)
+    result = await sql_exporter.lc._fetch_classes(uuids)
+    class_objects = {}
+    for uuid in uuids:
+        res = result.get(str(uuid))
+        class_objects[uuid] = (
+            [sql_exporter._generate_sql_classes(uuid, res, Klasse)] if res else []
+        )
+        # The rows of later events are generated from the cached classes
+        if res:
+            sql_exporter.lc.classes[str(uuid)] = res
+        else:
+            sql_exporter.lc.classes.pop(str(uuid), None)
+    sql_exporter.update_sql_many(class_objects, Klasse, commit=False)
+    sql_exporter.refresh_class_fields(result)
 
 
 async def handle_engagement(
-    uuid: PayloadUUID,
+    uuids: list[UUID],
     sql_exporter: SqlExport,
 ):
-    result = await sql_exporter.lc._fetch_engagements(uuid)
-    engagements_objects = [
-        sql_exporter._generate_sql_engagements(uuid, res, Engagement)
-        for res in result.get(str(uuid), [])
-    ]
+    result = await sql_exporter.lc._fetch_engagements(uuids)
+    engagements_objects = {
+        uuid: [
+            sql_exporter._generate_sql_engagements(uuid, res, Engagement)
+            for res in result.get(str(uuid), [])
+        ]
+        for uuid in uuids
+    }
 
-    sql_exporter.update_sql(uuid, engagements_objects, Engagement)
+    sql_exporter.update_sql_many(engagements_objects, Engagement, commit=False)
 
 
 async def handle_facet(
-    uuid: PayloadUUID,
+    uuids: list[UUID],
     sql_exporter: SqlExport,
 ):
-    result = await sql_exporter.lc._fetch_facets(uuid)
-    res = result.get(str(uuid))
-    facets_objects = (
-        [sql_exporter._generate_sql_facets(uuid, res, Facet)] if res else []
-    )
+    result = await sql_exporter.lc._fetch_facets(uuids)
+    facets_objects = {}
+    for uuid in uuids:
+        res = result.get(str(uuid))
+        facets_objects[uuid] = (
+            [sql_exporter._generate_sql_facets(uuid, res, Facet)] if res else []
+        )
+        if res:
+            sql_exporter.lc.facets[str(uuid)] = res
+        else:
+            sql_exporter.lc.facets.pop(str(uuid), None)
 
-    sql_exporter.update_sql(uuid, facets_objects, Facet)
+    sql_exporter.update_sql_many(facets_objects, Facet, commit=False)
+    sql_exporter.refresh_facet_fields(result)
 
 
 async def handle_it_system(
-    uuid: PayloadUUID,
+    uuids: list[UUID],
     sql_exporter: SqlExport,
 ):
-    result = await sql_exporter.lc._fetch_itsystems(uuid)
-    res = result.get(str(uuid))
-    itsystems_objects = (
-        [sql_exporter._generate_sql_it_systems(uuid, res, ItSystem)] if res else []
-    )
+    result = await sql_exporter.lc._fetch_itsystems(uuids)
+    itsystems_objects = {}
+    for uuid in uuids:
+        res = result.get(str(uuid))
+        itsystems_objects[uuid] = (
+            [sql_exporter._generate_sql_it_systems(uuid, res, ItSystem)] if res else []
+        )
 
-    sql_exporter.update_sql(uuid, itsystems_objects, ItSystem)
+    sql_exporter.update_sql_many(itsystems_objects, ItSystem, commit=False)
 
 
 async def handle_it_user(
-    uuid: PayloadUUID,
+    uuids: list[UUID],
     sql_exporter: SqlExport,
 ):
-    result = await sql_exporter.lc._fetch_it_connections(uuid)
-    it_connections_objects = [
-        sql_exporter._generate_sql_it_user(uuid, res, ItForbindelse)
-        for res in result.get(str(uuid), [])
-    ]
+    result = await sql_exporter.lc._fetch_it_connections(uuids)
+    it_connections_objects = {
+        uuid: [
+            sql_exporter._generate_sql_it_user(uuid, res, ItForbindelse)
+            for res in result.get(str(uuid), [])
+        ]
+        for uuid in uuids
+    }
 
-    sql_exporter.update_sql(uuid, it_connections_objects, ItForbindelse)
+    sql_exporter.update_sql_many(it_connections_objects, ItForbindelse, commit=False)
 
 
 async def handle_kle(
-    uuid: PayloadUUID,
+    uuids: list[UUID],
     sql_exporter: SqlExport,
 ):
-    result = await sql_exporter.lc._fetch_kles(uuid)
-    kle_objects = [
-        sql_exporter._generate_sql_kle(uuid, res, KLE)
-        for res in result.get(str(uuid), [])
-    ]
+    result = await sql_exporter.lc._fetch_kles(uuids)
+    kle_objects = {
+        uuid: [
+            sql_exporter._generate_sql_kle(uuid, res, KLE)
+            for res in result.get(str(uuid), [])
+        ]
+        for uuid in uuids
+    }
 
-    sql_exporter.update_sql(uuid, kle_objects, KLE)
+    sql_exporter.update_sql_many(kle_objects, KLE, commit=False)
 
 
 async def handle_leave(
-    uuid: PayloadUUID,
+    uuids: list[UUID],
     sql_exporter: SqlExport,
 ):
-    result = await sql_exporter.lc._fetch_leaves(uuid)
-    leaves_objects = [
-        sql_exporter._generate_sql_leave(uuid, res, Orlov)
-        for res in result.get(str(uuid), [])
-    ]
+    result = await sql_exporter.lc._fetch_leaves(uuids)
+    leaves_objects = {
+        uuid: [
+            sql_exporter._generate_sql_leave(uuid, res, Orlov)
+            for res in result.get(str(uuid), [])
+        ]
+        for uuid in uuids
+    }
 
-    sql_exporter.update_sql(uuid, leaves_objects, Orlov)
+    sql_exporter.update_sql_many(leaves_objects, Orlov, commit=False)
 
 
 async def handle_manager(
-    uuid: PayloadUUID,
+    uuids: list[UUID],
     sql_exporter: SqlExport,
 ):
-    result = await sql_exporter.lc._fetch_managers(uuid)
-    managers_objects = []
-    for res in result.get(str(uuid), []):
-        managers_objects.append(sql_exporter._generate_sql_managers(uuid, res, Leder))
-
-        for responsibility_uuid in res["manager_responsibility"]:
-            manager_responsibility_objects = [
+    result = await sql_exporter.lc._fetch_managers(uuids)
+    managers_objects: dict[UUID, list[Leder]] = {}
+    manager_responsibility_objects: dict[UUID, list[LederAnsvar]] = {}
+    for uuid in uuids:
+        managers_objects[uuid] = []
+        manager_responsibility_objects[uuid] = []
+        for res in result.get(str(uuid), []):
+            managers_objects[uuid].append(
+                sql_exporter._generate_sql_managers(uuid, res, Leder)
+            )
+            manager_responsibility_objects[uuid].extend(
                 sql_exporter._generate_sql_manager_responsibility(
                     responsibility_uuid, uuid, res, LederAnsvar
                 )
-                for res in result.get(str(uuid), [])
-            ]
-            sql_exporter.update_sql(uuid, manager_responsibility_objects, LederAnsvar)
-    sql_exporter.update_sql(uuid, managers_objects, Leder)
+                for responsibility_uuid in res["manager_responsibility"]
+            )
+
+    sql_exporter.update_sql_many(
+        manager_responsibility_objects, LederAnsvar, commit=False
+    )
+    sql_exporter.update_sql_many(managers_objects, Leder, commit=False)
 
 
 async def handle_related(
-    uuid: PayloadUUID,
+    uuids: list[UUID],
     sql_exporter: SqlExport,
 ):
-    result = await sql_exporter.lc._fetch_related(uuid)
-    related_objects = [
-        sql_exporter._generate_sql_related(uuid, res, Enhedssammenkobling)
-        for res in result.get(str(uuid), [])
-    ]
+    result = await sql_exporter.lc._fetch_related(uuids)
+    related_objects = {
+        uuid: [
+            sql_exporter._generate_sql_related(uuid, res, Enhedssammenkobling)
+            for res in result.get(str(uuid), [])
+        ]
+        for uuid in uuids
+    }
 
-    sql_exporter.update_sql(uuid, related_objects, Enhedssammenkobling)
+    sql_exporter.update_sql_many(related_objects, Enhedssammenkobling, commit=False)
 
 
 async def handle_org_unit(
-    uuid: PayloadUUID,
+    uuids: list[UUID],
     sql_exporter: SqlExport,
 ):
-    result = await sql_exporter.lc._fetch_units(uuid)
-    units_objects = [
-        sql_exporter._generate_sql_units(uuid, res, Enhed)
-        for res in result.get(str(uuid), [])
-    ]
-
-    sql_exporter.update_sql(uuid, units_objects, Enhed)
+    result = await sql_exporter.lc._fetch_units(uuids)
+    units_objects = {
+        uuid: [
+            sql_exporter._generate_sql_units(uuid, res, Enhed)
+            for res in result.get(str(uuid), [])
+        ]
+        for uuid in uuids
+    }
+
+    # The locations of the units below a renamed or moved unit are derived from it.
+    # In the historic export they also depend on when the change took effect, so
+    # they are left to the next full export.
+    moved = set()
+    if not sql_exporter.historic:
+        moved = sql_exporter.renamed_or_moved_units(units_objects)
+    sql_exporter.update_sql_many(units_objects, Enhed, commit=False)
+    sql_exporter.update_descendant_locations(moved)
 
 
 async def handle_person(
-    uuid: PayloadUUID,
+    uuids: list[UUID],
     sql_exporter: SqlExport,
 ):
-    result = await sql_exporter.lc._fetch_users(uuid)
-    users_objects = [
-        sql_exporter._generate_sql_users(uuid, res, Bruger)
-        for res in result.get(str(uuid), [])
-    ]
+    result = await sql_exporter.lc._fetch_users(uuids)
+    users_objects = {
+        uuid: [
+            sql_exporter._generate_sql_users(uuid, res, Bruger)
+            for res in result.get(str(uuid), [])
+        ]
+        for uuid in uuids
+    }
 
-    sql_exporter.update_sql(uuid, users_objects, Bruger)
+    sql_exporter.update_sql_many(users_objects, Bruger, commit=False)
 
 
 handle_function_map = {
@@ -252,6 +316,21 @@ handle_function_map = {
 }
 
 
+async def handle_batch(key: str, uuids: list[UUID], sql_exporter: _SqlExport):
+    """Export a batch of objects of one type in a single transaction.
+
+    A failed batch is rolled back, so the batcher can handle parts of it again in
+    fresh transactions, see `EventBatcher`.
+    """
+    handle_function = handle_function_map[key]
+    try:
+        await handle_function(uuids=uuids, sql_exporter=sql_exporter)
+        sql_exporter.session.commit()
+    except Exception:
+        sql_exporter.session.rollback()
+        raise
+
+
 @actualstate_router.register("address")
 @actualstate_router.register("association")
 @actualstate_router.register("class")
@@ -267,12 +346,11 @@ handle_function_map = {
 @actualstate_router.register("person")
 async def trigger_actual_state_event(
     uuid: PayloadUUID,
-    sql_exporter: SqlExport,
+    event_batcher: Batcher,
     key: MORoutingKey,
     _: RateLimit,
 ):
-    handle_function = handle_function_map[key]
-    return await handle_function(uuid=uuid, sql_exporter=sql_exporter)
+    return await event_batcher.submit(key, uuid)
 
 
 @historic_router.register("address")
@@ -290,17 +368,20 @@ async def trigger_actual_state_event(
 @historic_router.register("person")
 async def trigger_historic_event(
     uuid: PayloadUUID,
-    sql_exporter: SqlExportHistoric,
+    event_batcher: BatcherHistoric,
     key: MORoutingKey,
     _: RateLimit,
 ):
-    handle_function = handle_function_map[key]
-    return await handle_function(uuid=uuid, sql_exporter=sql_exporter)
+    return await event_batcher.submit(key, uuid)
 
 
 class Settings(DatabaseSettings):
     fastramqpi: FastRAMQPISettings
     eventdriven: bool = False
+    # Events are collected per object type and exported in batches, flushed after
+    # this many seconds or once this many distinct objects have been collected
+    event_batch_max_delay: float = 0.5
+    event_batch_max_size: int = 500
 
     class Config:
         frozen = True
@@ -362,11 +443,30 @@ def create_app(**kwargs) -> FastAPI:
             ],
             checkfirst=True,
         )
+        sql_exporter._create_indexes(
+            [
+                table
+                for name, table in dict(Base.metadata.tables).items()
+                if name[0] != "w"
+            ],
+            checkfirst=True,
+        )
+
+        event_batcher = EventBatcher(
+            flush=partial(handle_batch, sql_exporter=sql_exporter),
+            max_delay=settings.event_batch_max_delay,
+            max_size=settings.event_batch_max_size,
+        )
 
         if full_history:
-            fastramqpi.add_context(sql_exporter_historic=sql_exporter)
+            fastramqpi.add_context(
+                sql_exporter_historic=sql_exporter,
+                event_batcher_historic=event_batcher,
+            )
         else:
-            fastramqpi.add_context(sql_exporter=sql_exporter)
+            fastramqpi.add_context(
+                sql_exporter=sql_exporter, event_batcher=event_batcher
+            )
         yield
 
     fastramqpi.add_lifespan_manager(sql_exporter(full_history=False), priority=2100)
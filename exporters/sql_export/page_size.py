@@ -0,0 +1,69 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptivePageSize:
+    """Page size per collection, adapted to the observed latency and payload.
+
+    Every collection starts at the standard page size. After each full page the
+    size is scaled towards what would have taken `target_seconds` and stayed
+    below `max_bytes`, if set, changing by at most a factor of two per page and staying
+    within `minimum` and `maximum`. A timed out page halves the size, so the
+    retry asks for less instead of repeating the same request.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int,
+        maximum: int,
+        target_seconds: float,
+        max_bytes: int | None,
+        adaptive: bool = True,
+    ) -> None:
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.adaptive = adaptive
+        self._sizes: dict[str | None, int] = {}
+
+    def _clamp(self, size: float) -> int:
+        return int(max(self.minimum, min(self.maximum, size)))
+
+    def get(self, collection: str | None) -> int:
+        return self._sizes.get(collection, self.initial)
+
+    def observe(
+        self,
+        collection: str | None,
+        limit: int,
+        count: int,
+        seconds: float,
+        size_bytes: int | None = None,
+    ) -> None:
+        """Adapt the page size of the collection after a successful page."""
+        # A partial page is the last one, and says little about larger pages
+        if not self.adaptive or count < limit:
+            return
+        factor = self.target_seconds / max(seconds, 1e-3)
+        if self.max_bytes is not None and size_bytes is not None:
+            factor = min(factor, self.max_bytes / max(size_bytes, 1))
+        factor = max(0.5, min(2.0, factor))
+        self._sizes[collection] = self._clamp(limit * factor)
+
+    def timed_out(self, collection: str | None, limit: int) -> None:
+        """Halve the page size of the collection after a timeout."""
+        if not self.adaptive:
+            return
+        size = self._clamp(limit // 2)
+        logger.warning(f"Page of {collection} timed out, page size {limit} -> {size}")
+        self._sizes[collection] = size
+
+    def sizes(self) -> dict[str | None, int]:
+        return dict(self._sizes)
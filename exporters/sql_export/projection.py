@@ -0,0 +1,197 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+"""Projection profiles, so a job only fetches the fields it uses.
+
+The queries of `GQLLoraCache` select every field of their collections, though
+most jobs only read a few of them. A projection profile maps the name of a
+collection to the keys of its objects which a job reads:
+
+    GQLLoraCache(projection={"engagements": {"user", "unit", "user_key"}})
+
+The fields of the queries which only feed the keys left out of the profile, see
+`PROJECTABLE_FIELDS`, are removed from the GraphQL documents, and the objects are
+stored without those keys. Reading a key left out raises `FieldNotProjected`,
+rather than passing for a missing value. Collections not in the profile, and the
+keys which the cache needs itself, are always fetched in full.
+"""
+
+from collections.abc import Iterable
+from collections.abc import Mapping
+from functools import lru_cache
+from typing import Any
+
+from graphql import REMOVE
+from graphql import FieldNode
+from graphql import Visitor
+from graphql import parse
+from graphql import print_ast
+from graphql import visit
+
+ProjectionProfile = Mapping[str, Iterable[str]]
+
+# The keys of the objects of each collection which can be left out, and the fields
+# of the `obj` selection of the queries which only feed them, by response key
+PROJECTABLE_FIELDS: dict[str, dict[str, tuple[str, ...]]] = {
+    "facets": {"user_key": ("user_key",)},
+    "classes": {
+        "user_key": ("user_key",),
+        "title": ("name",),
+        "scope": ("scope",),
+        "facet": ("facet_uuid",),
+    },
+    "itsystems": {"user_key": ("user_key",), "name": ("name",)},
+    "users": {
+        "cpr": ("cpr_no",),
+        "user_key": ("user_key",),
+        "navn": ("name",),
+        "fornavn": ("givenname",),
+        "efternavn": ("surname",),
+        "kaldenavn": ("nickname",),
+        "kaldenavn_fornavn": ("nickname_givenname",),
+        "kaldenavn_efternavn": ("nickname_surname",),
+    },
+    "units": {
+        "user_key": ("user_key",),
+        "unit_type": ("unit_type_uuid",),
+        "level": ("org_unit_level_uuid",),
+        "time_planning": ("time_planning_uuid",),
+        "org_unit_hierarchy": ("org_unit_hierarchy_uuid",),
+    },
+    "addresses": {"user_key": ("user_key",), "visibility": ("visibility_uuid",)},
+    "engagements": {
+        "user": ("employee_uuid",),
+        "unit": ("org_unit_uuid",),
+        "fraction": ("fraction",),
+        "user_key": ("user_key",),
+        "engagement_type": ("engagement_type_uuid",),
+        "primary_type": ("primary_uuid",),
+        "primary_boolean": ("is_primary",),
+        "job_function": ("job_function_uuid",),
+        "extensions": tuple(f"extension_{i}" for i in range(1, 11)),
+    },
+    "managers": {
+        "user": ("employee_uuid",),
+        "unit": ("org_unit_uuid",),
+        "manager_type": ("manager_type_uuid",),
+        "manager_level": ("manager_level_uuid",),
+        "manager_responsibility": ("responsibility_uuids",),
+    },
+    "associations": {
+        "user": ("employee_uuid",),
+        "unit": ("org_unit_uuid",),
+        "user_key": ("user_key",),
+        "association_type": ("association_type_uuid",),
+        "primary_boolean": ("primary",),
+        "dynamic_class": ("dynamic_class",),
+    },
+    "leaves": {
+        "user": ("employee_uuid",),
+        "user_key": ("user_key",),
+        "leave_type": ("leave_type_uuid",),
+        "engagement": ("engagement_uuid",),
+    },
+    "it_connections": {
+        "user": ("employee_uuid",),
+        "unit": ("org_unit_uuid",),
+        "username": ("user_key",),
+        "itsystem": ("itsystem_uuid",),
+        "primary_boolean": ("primary_uuid",),
+    },
+    "kles": {"user_key": ("user_key",), "kle_number": ("kle_number_uuid",)},
+    "related": {},
+}
+
+
+class FieldNotProjected(KeyError):
+    """Raised when reading a key left out by the projection profile of the cache."""
+
+    def __init__(self, key: str) -> None:
+        super().__init__(key)
+        self.key = key
+
+    def __str__(self) -> str:
+        return (
+            f"{self.key!r} is not in the projection profile of the cache, add it to "
+            "the profile to read it"
+        )
+
+
+def omitted_keys(profile: ProjectionProfile | None) -> dict[str, frozenset[str]]:
+    """Return the keys which `profile` leaves out, by collection."""
+    omitted: dict[str, frozenset[str]] = {}
+    for collection, keys in (profile or {}).items():
+        if collection not in PROJECTABLE_FIELDS:
+            raise ValueError(f"Unknown collection in projection profile: {collection}")
+        left_out = frozenset(PROJECTABLE_FIELDS[collection]) - set(keys)
+        if left_out:
+            omitted[collection] = left_out
+    return omitted
+
+
+def omitted_fields(collection: str, omitted: Iterable[str]) -> frozenset[str]:
+    """Return the fields of the queries of `collection` feeding only `omitted`."""
+    fields = PROJECTABLE_FIELDS[collection]
+    return frozenset(field for key in omitted for field in fields[key])
+
+
+class _PruneObjectFields(Visitor):
+    def __init__(self, fields: frozenset[str]) -> None:
+        super().__init__()
+        self.fields = fields
+
+    def enter_field(self, node: FieldNode, key, parent, path, ancestors) -> Any:
+        if _response_key(node) not in self.fields:
+            return None
+        parents = [a for a in ancestors if isinstance(a, FieldNode)]
+        if parents and _response_key(parents[-1]) == "obj":
+            return REMOVE
+        return None
+
+
+def _response_key(node: FieldNode) -> str:
+    return (node.alias or node.name).value
+
+
+@lru_cache(maxsize=None)
+def prune_query(query: str, fields: frozenset[str]) -> str:
+    """Remove `fields` from the `obj` selection of `query`."""
+    return print_ast(visit(parse(query), _PruneObjectFields(fields)))
+
+
+class ProjectedDict(dict):
+    """An object fetched with a projection, which knows the keys left out."""
+
+    __slots__ = ("omitted",)
+
+    def __init__(self, obj: dict, omitted: frozenset[str]) -> None:
+        super().__init__(obj)
+        self.omitted = omitted
+
+    def __missing__(self, key: str) -> Any:
+        if key in self.omitted:
+            raise FieldNotProjected(key)
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self.omitted and key not in self:
+            raise FieldNotProjected(key)
+        return super().get(key, default)
+
+    def copy(self) -> "ProjectedDict":
+        return ProjectedDict(self, self.omitted)
+
+    def __reduce__(self):
+        return ProjectedDict, (dict(self), self.omitted)
+
+
+def project_objects(objects: list[dict], omitted: frozenset[str]) -> None:
+    """Mark the validities of the objects of a query page as projected."""
+    for obj in objects:
+        validities = obj.get("obj")
+        if isinstance(validities, dict):
+            obj["obj"] = ProjectedDict(validities, omitted)
+        elif isinstance(validities, list):
+            obj["obj"] = [
+                v if v is None else ProjectedDict(v, omitted) for v in validities
+            ]
@@ -0,0 +1,187 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+"""Compact record storage for the LoRa cache.
+
+The cache used to keep every object validity as a plain dict. With full history
+that means millions of dicts, each carrying its own hash table and its own copy
+of the same class and unit UUID strings. Records are instances of small
+`__slots__` classes generated per set of keys, and the values of reference
+fields are interned, so repeated UUIDs and dates are only stored once.
+
+Records implement the read-only `Mapping` interface, so code indexing into the
+cache with `record["key"]`, `record.get("key")` or `**record` keeps working. Records
+of objects fetched with a projection profile raise `FieldNotProjected` for the keys
+left out, see projection.py.
+"""
+
+import sys
+from collections.abc import Mapping
+from functools import lru_cache
+from typing import Any
+from typing import Iterator
+
+from .projection import FieldNotProjected
+
+# Fields whose values reference other objects (or are dates), and thus repeat
+# across many records. Only these are interned, to avoid growing the intern
+# table with unique values such as names and CPR numbers.
+INTERNED_FIELDS = frozenset(
+    {
+        "acting_manager_uuid",
+        "adresse_type",
+        "association_type",
+        "engagement",
+        "engagement_type",
+        "facet",
+        "from_date",
+        "itsystem",
+        "job_function",
+        "kle_aspect",
+        "kle_number",
+        "leave_type",
+        "level",
+        "manager_level",
+        "manager_type",
+        "manager_uuid",
+        "org_unit_hierarchy",
+        "parent",
+        "primary_type",
+        "scope",
+        "time_planning",
+        "to_date",
+        "unit",
+        "unit1_uuid",
+        "unit2_uuid",
+        "unit_type",
+        "user",
+        "visibility",
+    }
+)
+
+
+class Record(Mapping):
+    """Read-only, dict-compatible record with a fixed set of keys."""
+
+    __slots__ = ()
+    _fields: tuple[str, ...] = ()
+    _field_set: frozenset[str] = frozenset()
+    _omitted: frozenset[str] = frozenset()
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._field_set:
+            if key in self._omitted:
+                raise FieldNotProjected(key)
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self._field_set:
+            return getattr(self, key)
+        if key in self._omitted:
+            raise FieldNotProjected(key)
+        return default
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._field_set
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._fields)
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def __repr__(self) -> str:
+        return repr(dict(self.items()))
+
+    def __reduce__(self):
+        return _make_record, (self._fields, tuple(self.values()), self._omitted)
+
+    # Records compare equal to dicts with the same content, but like dicts they
+    # are not hashable.
+    __hash__ = None  # type: ignore
+
+
+@lru_cache(maxsize=None)
+def record_type(
+    fields: tuple[str, ...], omitted: frozenset[str] = frozenset()
+) -> type[Record] | None:
+    """Return the record class for the given keys, and the keys left out.
+
+    Returns None if the keys cannot be used as slot names, in which case the
+    caller should keep the plain dict.
+    """
+    reserved = set(dir(Record))
+    if not all(f.isidentifier() and not f.startswith("_") for f in fields):
+        return None
+    if reserved.intersection(fields):
+        return None
+    return type(
+        "Record",
+        (Record,),
+        {
+            "__slots__": fields,
+            "_fields": fields,
+            "_field_set": frozenset(fields),
+            "_omitted": omitted,
+        },
+    )
+
+
+def _make_record(
+    fields: tuple[str, ...], values: tuple, omitted: frozenset[str] = frozenset()
+) -> Record:
+    cls = record_type(fields, omitted)
+    assert cls is not None
+    record = cls.__new__(cls)
+    for field, value in zip(fields, values):
+        object.__setattr__(record, field, value)
+    return record
+
+
+def to_record(obj: Any) -> Any:
+    """Convert a (possibly nested) dict to a compact record.
+
+    Values of reference fields are interned. Values which are not dicts, and
+    dicts with keys that cannot be slot names, are returned unchanged.
+    """
+    if not isinstance(obj, dict):
+        return obj
+    fields = tuple(obj.keys())
+    omitted = getattr(obj, "omitted", frozenset())
+    cls = record_type(fields, omitted)
+    if cls is None:
+        return obj
+    values = []
+    for field, value in obj.items():
+        if isinstance(value, dict):
+            value = to_record(value)
+        elif isinstance(value, str) and field in INTERNED_FIELDS:
+            value = sys.intern(value)
+        values.append(value)
+    return _make_record(fields, tuple(values), omitted)
+
+
+def deep_sizeof(obj: Any, seen: set[int]) -> int:
+    """Approximate the memory used by a cache collection.
+
+    Objects whose id is already in `seen` are not counted again, which makes it
+    possible to share `seen` between collections so interned strings are only
+    counted once.
+    """
+    size = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+        if isinstance(current, Record):
+            stack.extend(current.values())
+        elif isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            stack.extend(current)
+    return size
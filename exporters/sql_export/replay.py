@@ -0,0 +1,113 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+"""Recording and replaying of the GraphQL queries of `GQLLoraCache`.
+
+`RecordingSession` wraps the client session, and writes every query, its
+variables, its response and the time it took to a gzipped JSON lines archive.
+`ReplaySession` serves the responses of such an archive instead of MO, optionally
+taking as long as the recorded queries did. This way a fetch from a production MO
+can be reproduced exactly, for profiling the cache and the export offline.
+
+The page size is left out when matching a query with a recorded one, as the
+adaptive page size depends on timing. The recorded cursors lead the replay
+through the recorded pages.
+"""
+
+import asyncio
+import copy
+import gzip
+import json
+import time
+from collections import defaultdict
+from collections import deque
+from pathlib import Path
+from typing import Any
+
+from graphql import DocumentNode
+from graphql import ExecutionResult
+from graphql import print_ast
+
+
+class ReplayMismatch(Exception):
+    """Raised when replaying a query which was not recorded."""
+
+
+def _key(document: DocumentNode | str, variables: dict[str, Any] | None) -> str:
+    query = document if isinstance(document, str) else print_ast(document)
+    variables = {k: v for k, v in (variables or {}).items() if k != "limit"}
+    return json.dumps([query, variables], sort_keys=True, default=str)
+
+
+class RecordingSession:
+    """Records the queries executed through `session` to `path`."""
+
+    def __init__(self, session: Any, path: Path) -> None:
+        self.session = session
+        self.path = path
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+
+    async def execute(
+        self,
+        document: DocumentNode,
+        variable_values: dict[str, Any] | None = None,
+        get_execution_result: bool = False,
+    ) -> Any:
+        start = time.monotonic()
+        result = await self.session.execute(
+            document=document,
+            variable_values=variable_values,
+            get_execution_result=get_execution_result,
+        )
+        seconds = time.monotonic() - start
+        data = result.data if get_execution_result else result
+        entry = {
+            "query": print_ast(document),
+            "variables": variable_values,
+            "data": data,
+            "seconds": seconds,
+        }
+        self._file.write(json.dumps(entry, default=str) + "\n")
+        # Keep the archive readable, as the session is never closed
+        self._file.flush()
+        return result
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ReplaySession:
+    """Serves the queries recorded in `path`.
+
+    A query recorded more than once is answered with the recorded responses in
+    turn, the last of them repeating.
+    """
+
+    def __init__(self, path: Path, latency: bool = False) -> None:
+        self.latency = latency
+        self._responses: dict[str, deque[tuple[Any, float]]] = defaultdict(deque)
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            for line in file:
+                entry = json.loads(line)
+                key = _key(entry["query"], entry["variables"])
+                self._responses[key].append((entry["data"], entry["seconds"]))
+
+    async def execute(
+        self,
+        document: DocumentNode,
+        variable_values: dict[str, Any] | None = None,
+        get_execution_result: bool = False,
+    ) -> Any:
+        responses = self._responses.get(_key(document, variable_values))
+        if not responses:
+            raise ReplayMismatch(f"Query not recorded: {print_ast(document)}")
+        if len(responses) > 1:
+            data, seconds = responses.popleft()
+        else:
+            # The cache modifies the responses, so the one repeating is copied
+            data, seconds = copy.deepcopy(responses[0])
+        if self.latency:
+            await asyncio.sleep(seconds)
+        if get_execution_result:
+            return ExecutionResult(data=data)
+        return data
@@ -0,0 +1,169 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+"""Versioned on-disk snapshots of the LoRa cache.
+
+A snapshot is a single file holding every collection of a `GQLLoraCache`, each
+compressed separately. The file layout is:
+
+    MAGIC (8 bytes) | header offset (8 bytes) | collection blobs ... | header
+
+The header is JSON and records the snapshot format version, the fingerprint of
+the cache settings the snapshot was made with, the creation time, free-form
+metadata from the writer and the location of each collection blob. Snapshots
+are read through `mmap`, and a collection is only decompressed when it is first
+accessed, so a job needing only classes and units does not pay for
+deserialising engagements.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import mmap
+import os
+import pickle
+import struct
+import zlib
+from pathlib import Path
+from typing import Any
+from typing import Iterable
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"LCSNAP\x00\x00"
+# Bump whenever the layout of the file or of the cached objects changes
+SNAPSHOT_VERSION = 2
+_OFFSET = struct.Struct("<Q")
+
+
+class SnapshotMismatch(Exception):
+    """Raised when a snapshot cannot be used for the requested cache."""
+
+
+def snapshot_path(directory: Path, fingerprint: dict[str, Any]) -> Path:
+    """Return the path of the snapshot file matching the fingerprint."""
+    name = "loracache"
+    if fingerprint["full_history"]:
+        name += "_historic"
+        if fingerprint["skip_past"]:
+            name += "_skip_past"
+    if not fingerprint["resolve_dar"]:
+        name += "_no_dar"
+    # Caches with different projection profiles do not share a snapshot
+    if "projection" in fingerprint:
+        profile = json.dumps(fingerprint["projection"], sort_keys=True)
+        name += "_" + hashlib.sha256(profile.encode()).hexdigest()[:12]
+    return directory / f"{name}.snapshot"
+
+
+def write_snapshot(
+    path: Path,
+    fingerprint: dict[str, Any],
+    collections: Iterable[tuple[str, Any]],
+    metadata: dict[str, Any] | None = None,
+) -> None:
+    """Write the collections to a new snapshot at `path`.
+
+    The snapshot is written to a temporary file which replaces `path` once
+    complete, so readers never see a partially written snapshot.
+    """
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    index: dict[str, tuple[int, int]] = {}
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(_OFFSET.pack(0))
+        for name, collection in collections:
+            logger.debug(f"writing {name}")
+            blob = zlib.compress(pickle.dumps(collection, pickle.HIGHEST_PROTOCOL))
+            index[name] = (f.tell(), len(blob))
+            f.write(blob)
+        header_offset = f.tell()
+        header = {
+            "version": SNAPSHOT_VERSION,
+            "fingerprint": fingerprint,
+            "created": datetime.datetime.now().isoformat(),
+            "metadata": metadata or {},
+            "collections": index,
+        }
+        f.write(json.dumps(header).encode())
+        f.seek(len(MAGIC))
+        f.write(_OFFSET.pack(header_offset))
+    os.replace(tmp_path, path)
+
+
+class Snapshot:
+    """Read access to a snapshot file.
+
+    Opening a snapshot only reads and validates the header. Collections are
+    decompressed on demand by `load`.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        fingerprint: dict[str, Any],
+        max_age: datetime.timedelta | None = None,
+    ) -> None:
+        try:
+            self._file = open(path, "rb")
+        except FileNotFoundError as e:
+            raise SnapshotMismatch(f"No snapshot at {path}") from e
+        try:
+            if os.fstat(self._file.fileno()).st_size < len(MAGIC) + _OFFSET.size:
+                raise SnapshotMismatch("Snapshot is incomplete")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.header = self._read_header()
+            self._validate(fingerprint, max_age)
+        except BaseException:
+            self.close()
+            raise
+        self.path = path
+
+    def _read_header(self) -> dict[str, Any]:
+        if self._mmap[: len(MAGIC)] != MAGIC:
+            raise SnapshotMismatch("Not a LoRa cache snapshot")
+        (header_offset,) = _OFFSET.unpack_from(self._mmap, len(MAGIC))
+        if header_offset == 0:
+            raise SnapshotMismatch("Snapshot is incomplete")
+        return json.loads(self._mmap[header_offset:])
+
+    def _validate(
+        self, fingerprint: dict[str, Any], max_age: datetime.timedelta | None
+    ) -> None:
+        version = self.header["version"]
+        if version != SNAPSHOT_VERSION:
+            raise SnapshotMismatch(
+                f"Snapshot version {version} does not match {SNAPSHOT_VERSION}"
+            )
+        if self.header["fingerprint"] != fingerprint:
+            raise SnapshotMismatch(
+                f"Snapshot fingerprint {self.header['fingerprint']} does not "
+                f"match {fingerprint}"
+            )
+        if max_age is not None and datetime.datetime.now() - self.created > max_age:
+            raise SnapshotMismatch(f"Snapshot from {self.created} is too old")
+
+    @property
+    def created(self) -> datetime.datetime:
+        return datetime.datetime.fromisoformat(self.header["created"])
+
+    @property
+    def metadata(self) -> dict[str, Any]:
+        return self.header["metadata"]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.header["collections"]
+
+    def load(self, name: str) -> Any:
+        """Decompress and return a single collection."""
+        offset, length = self.header["collections"][name]
+        logger.debug(f"loading {name} from snapshot")
+        blob = self._mmap[offset : offset + length]
+        return pickle.loads(zlib.decompress(blob))
+
+    def close(self) -> None:
+        if getattr(self, "_mmap", None) is not None:
+            self._mmap.close()
+            self._mmap = None  # type: ignore
+        self._file.close()
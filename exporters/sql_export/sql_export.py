@@ -1,6 +1,16 @@
 import datetime
 import logging
+import threading
+import time
 import typing
+from collections import Counter
+from collections import defaultdict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from typing import Any
+from typing import Callable
+from typing import Iterable
 from typing import Tuple
 from typing import Type
 from typing import TypeVar
@@ -15,13 +25,27 @@ from fastramqpi.ra_utils.load_settings import load_settings
 from fastramqpi.ra_utils.tqdm_wrapper import tqdm
 from more_itertools import ichunked
 from more_itertools import one
+from sqlalchemy import Column
+from sqlalchemy import Table
+from sqlalchemy import bindparam
 from sqlalchemy import create_engine
+from sqlalchemy import inspect
+from sqlalchemy import literal_column
+from sqlalchemy import or_
 from sqlalchemy import select
+from sqlalchemy import update
 from sqlalchemy.engine import Engine
 from sqlalchemy.engine.reflection import Inspector
 from sqlalchemy.orm import Session
 from sqlalchemy.orm import sessionmaker
-
+from sqlalchemy.sql import Select
+
+from .bulk_load import TableLoader
+from .bulk_load import choose_load_method
+from .differential import ChangeCounts
+from .differential import TableDiffer
+from .export_stats import ExportStats
+from .export_stats import WriteStats
 from .gql_lora_cache_async import GQLLoraCache
 from .lora_cache import get_cache as LoraCache
 from .sql_table_defs import KLE
@@ -56,10 +80,16 @@ from .sql_table_defs import WLeder
 from .sql_table_defs import WLederAnsvar
 from .sql_table_defs import WOrlov
 from .sql_table_defs import WTilknytning
+from .sql_table_defs import class_field_columns
+from .sql_table_defs import current_model
+from .sql_table_defs import index_name
+from .sql_table_defs import indexed_columns
+from .sql_table_defs import secondary_indexes
 from .sql_table_defs import sql_type
 from .sql_url import DatabaseFunction
 from .sql_url import generate_connection_url
 from .sql_url import generate_engine_settings
+from .streaming import stream_collections
 
 _T_Facet = TypeVar("_T_Facet", Facet, WFacet)
 _T_Klasse = TypeVar("_T_Klasse", Klasse, WKlasse)
@@ -87,6 +117,11 @@ class SqlExportSettings(JobSettings):
 
 logger = logging.getLogger(__name__)
 
+# The number of levels below a renamed or moved unit whose locations are updated.
+# The recursive query must use UNION ALL, which does not end at a cycle in the
+# tree, so the depth bounds it instead. SQL Server allows 100 levels of recursion.
+MAX_UNIT_DEPTH = 99
+
 
 class SqlExport:
     def __init__(self, force_sqlite=False, historic=False, settings=None):
@@ -94,10 +129,22 @@ class SqlExport:
         self.force_sqlite = force_sqlite
         self.historic = historic
         self.settings = settings
+        self.export_workers = self._get_export_workers_setting()
         self.engine = self._get_engine()
         self.export_cpr = self._get_export_cpr_setting()
+        self.bulk_load = self._get_bulk_load_setting()
+        self.streaming = self._get_streaming_setting()
+        self.differential = self._get_differential_setting()
         self.chunk_size = 5000
+        # Batches fetched ahead of the one being written, when streaming
+        self.stream_max_pending = 4
         self.lc = None
+        # Holds the session of each export worker
+        self._local = threading.local()
+        # The loaders of the current export, for their statistics
+        self._loaders: list[TableLoader | TableDiffer] = []
+        self.stats = ExportStats()
+        self._kvittering: Kvittering | None = None
 
     def _get_engine(self) -> Engine:
         database_function = DatabaseFunction.ACTUAL_STATE
@@ -109,6 +156,9 @@ class SqlExport:
         engine_settings = generate_engine_settings(
             database_function, force_sqlite=self.force_sqlite, settings=self.settings
         )
+        if self.export_workers > 1 and not db_string.startswith("sqlite"):
+            # A connection for each export worker, and one for the main session
+            engine_settings["pool_size"] = self.export_workers + 1
         return create_engine(db_string, **engine_settings)
 
     def _get_export_cpr_setting(self) -> bool:
@@ -131,6 +181,39 @@ class SqlExport:
         Session = sessionmaker(bind=self.engine, autoflush=False)
         return Session()
 
+    def _get_bulk_load_setting(self) -> bool:
+        return self.settings.get("exporters.actual_state.bulk_load", True)
+
+    def _get_streaming_setting(self) -> bool:
+        return self.settings.get("exporters.actual_state.streaming", False)
+
+    def _get_differential_setting(self) -> bool:
+        return self.settings.get("exporters.actual_state.differential", False)
+
+    def _get_export_workers_setting(self) -> int:
+        return self.settings.get("exporters.actual_state.export_workers", 1)
+
+    def _worker_session(self) -> Session:
+        """Return the session of the current export worker, or the main session."""
+        return getattr(self._local, "session", self.session)
+
+    def _table_loader(self, model) -> TableLoader | TableDiffer:
+        session = self._worker_session()
+        loader: TableLoader | TableDiffer
+        if self.differential:
+            loader = TableDiffer(
+                session, current_model(model), chunk_size=self.chunk_size
+            )
+        else:
+            loader = TableLoader(
+                session,
+                model,
+                method=choose_load_method(session, self.bulk_load),
+                chunk_size=self.chunk_size,
+            )
+        self._loaders.append(loader)
+        return loader
+
     def _get_lora_class(self, uuid: str) -> Tuple[str, dict]:
         cls: dict = self.lc.classes.get(uuid) or {"title": uuid}
         return uuid, cls
@@ -141,51 +224,263 @@ class SqlExport:
 
         tables = dict(Base.metadata.tables)
 
-        logger.info("Dropping work tables")
-        Base.metadata.drop_all(
-            self.engine,
-            tables=[table for name, table in tables.items() if name[0] == "w"],
-        )
-        logger.info("Ensure work tables and 'kvittering' exists")
-        Base.metadata.create_all(
-            self.engine,
-            tables=[
-                table
-                for name, table in tables.items()
-                if name[0] == "w" or name == "kvittering"
-            ],
-        )
+        if self.differential:
+            # The current tables are written directly, see `TableDiffer`
+            logger.info("Ensure current tables and 'kvittering' exists")
+            Base.metadata.create_all(
+                self.engine,
+                tables=[table for name, table in tables.items() if name[0] != "w"],
+            )
+            self._create_indexes(
+                [table for name, table in tables.items() if name[0] != "w"],
+                checkfirst=True,
+            )
+        else:
+            logger.info("Dropping work tables")
+            Base.metadata.drop_all(
+                self.engine,
+                tables=[table for name, table in tables.items() if name[0] == "w"],
+            )
+            logger.info("Ensure work tables and 'kvittering' exists")
+            Base.metadata.create_all(
+                self.engine,
+                tables=[
+                    table
+                    for name, table in tables.items()
+                    if name[0] == "w" or name == "kvittering"
+                ],
+            )
+        self._ensure_receipt_columns()
 
         self.session = self._get_db_session()
+        self._loaders = []
+        self.stats = ExportStats()
 
         query_time = timestamp()
-        kvittering = self._add_receipt(query_time)
-        self.lc = self.lc or self._get_lora_cache(resolve_dar, use_pickle)
-
-        start_delivery_time = timestamp()
-        self._update_receipt(kvittering, start_delivery_time)
-
-        tasks = [
-            self._add_facets,
-            self._add_classes,
-            self._add_units,
-            self._add_users,
-            self._add_addresses,
-            self._add_dar_addresses,
-            self._add_engagements,
-            self._add_associations,
-            self._add_leaves,
-            self._add_managers,
-            self._add_it_systems,
-            self._add_it_users,
-            self._add_kles,
-            self._add_related,
-        ]
-        for task in tqdm(tasks, desc="SQLExport", unit="task"):
-            task()
+        kvittering = self._kvittering = self._add_receipt(query_time)
+        # A differential export needs the whole export to find the deleted rows
+        if (
+            self.lc is None
+            and self.streaming
+            and not self.differential
+            and not use_pickle
+        ):
+            # Delivery starts along with the fetching
+            start_delivery_time = timestamp()
+            self._update_receipt(kvittering, start_delivery_time)
+            with self.stats.phase("fetch_and_load"):
+                self._stream_export(resolve_dar)
+        else:
+            with self.stats.phase("fetch"):
+                self.lc = self.lc or self._get_lora_cache(resolve_dar, use_pickle)
+
+            start_delivery_time = timestamp()
+            self._update_receipt(kvittering, start_delivery_time)
+
+            tasks = [
+                self._add_facets,
+                self._add_classes,
+                self._add_units,
+                self._add_users,
+                self._add_addresses,
+                self._add_dar_addresses,
+                self._add_engagements,
+                self._add_associations,
+                self._add_leaves,
+                self._add_managers,
+                self._add_it_systems,
+                self._add_it_users,
+                self._add_kles,
+                self._add_related,
+            ]
+            with self.stats.phase("load"):
+                timings = self._run_tasks(tasks)
+            for name, seconds in sorted(timings.items(), key=lambda t: -t[1]):
+                logger.info(f"{name} took {seconds:.1f}s")
+            self.stats.tasks = timings
+
+        if not self.differential:
+            # Created only now, so the indexes are not maintained during the load
+            with self.stats.phase("indexes"):
+                self._create_indexes(
+                    [table for name, table in tables.items() if name[0] == "w"]
+                )
 
         end_delivery_time = timestamp()
         self._update_receipt(kvittering, start_delivery_time, end_delivery_time)
+        if self.differential:
+            changes = sum(
+                (
+                    loader.counts
+                    for loader in self._loaders
+                    if isinstance(loader, TableDiffer)
+                ),
+                ChangeCounts(),
+            )
+            logger.info(f"Differential export: {changes}")
+            self._record_changes(kvittering, changes)
+        self.stats.fetch = dict(getattr(self.lc, "fetch_stats", {}))
+        self.stats.tables = self._table_stats()
+        for name, stats in sorted(self.stats.tables.items()):
+            logger.info(
+                f"{name}: {stats.rows} rows in {stats.seconds:.1f}s, "
+                f"{stats.rows_per_second:.0f} rows/s"
+            )
+        self._record_stats()
+
+    def _table_stats(self) -> dict[str, WriteStats]:
+        tables: dict[str, WriteStats] = {}
+        for loader in self._loaders:
+            stats = tables.setdefault(loader.table.name, WriteStats())
+            stats.observe(loader.stats.rows, loader.stats.seconds)
+        return tables
+
+    def _record_stats(self) -> None:
+        """Store the statistics of the export in its receipt, and in the metrics."""
+        if self._kvittering is not None:
+            self._kvittering.statistik = self.stats.to_json()
+            self.session.commit()
+        self.stats.update_metrics(
+            "actual_state_historic" if self.historic else "actual_state"
+        )
+
+    def _run_tasks(self, tasks: list[Callable[[], None]]) -> dict[str, float]:
+        """Run the export tasks and return the seconds spent in each of them.
+
+        With more than one export worker, the tasks run in a thread pool, each in
+        a session of its own. This is safe, as each task loads its own work tables
+        and commits them separately. SQLite always runs the tasks one at a time.
+        """
+        timings: dict[str, float] = {}
+
+        def run(task: Callable[[], None]) -> None:
+            start = time.monotonic()
+            task()
+            timings[task.__name__] = time.monotonic() - start
+
+        if self.export_workers <= 1 or self.engine.dialect.name == "sqlite":
+            for task in tqdm(tasks, desc="SQLExport", unit="task"):
+                run(task)
+            return timings
+
+        def run_in_session(task: Callable[[], None]) -> None:
+            session = self._local.session = self._get_db_session()
+            try:
+                run(task)
+            finally:
+                del self._local.session
+                session.close()
+
+        # Load the lookup collections up front, rather than in several workers
+        for name in ("facets", "classes"):
+            getattr(self.lc, name)
+        logger.info(f"Running export tasks in {self.export_workers} workers")
+        with ThreadPoolExecutor(
+            max_workers=self.export_workers, thread_name_prefix="sql-export"
+        ) as pool:
+            futures = [pool.submit(run_in_session, task) for task in tasks]
+            try:
+                for future in tqdm(
+                    as_completed(futures),
+                    total=len(futures),
+                    desc="SQLExport",
+                    unit="task",
+                ):
+                    future.result()
+            except BaseException:
+                pool.shutdown(cancel_futures=True)
+                raise
+        return timings
+
+    def _stream_export(self, resolve_dar: bool) -> None:
+        """Write the work tables while fetching, without filling the cache.
+
+        Each batch of objects is written to its table as soon as it is fetched.
+        Only the lookup collections, and the DAR addresses found while fetching
+        addresses, are kept in the cache.
+        """
+        self.lc = LoraCache(
+            resolve_dar=resolve_dar, full_history=self.historic, settings=self.settings
+        )
+        loaders = {
+            "units": self._load_units,
+            "users": self._load_users,
+            "addresses": self._load_addresses,
+            "engagements": self._load_engagements,
+            "associations": self._load_associations,
+            "leaves": self._load_leaves,
+            "managers": self._load_managers,
+            "itsystems": self._load_it_systems,
+            "it_connections": self._load_it_users,
+            "kles": self._load_kles,
+            "related": self._load_related,
+        }
+        batches = stream_collections(
+            self.lc,
+            loaders,
+            batch_size=self.chunk_size,
+            max_pending=self.stream_max_pending,
+        )
+        for name, batch in tqdm(batches, desc="SQLExport", unit="batch"):
+            loaders[name](batch.items())
+
+        self._add_facets()
+        self._add_classes()
+        self._add_dar_addresses()
+
+    def _ensure_receipt_columns(self) -> None:
+        """Add the columns missing from a 'kvittering' made by an earlier version."""
+        with self.engine.begin() as connection:
+            existing = {
+                column["name"]
+                for column in inspect(connection).get_columns("kvittering")
+            }
+            op = Operations(MigrationContext.configure(connection))
+            for column in Kvittering.__table__.columns:
+                if column.name not in existing:
+                    logger.info(f"Adding column {column.name} to 'kvittering'")
+                    op.add_column("kvittering", Column(column.name, column.type))
+
+    def _create_indexes(self, tables: list[Table], checkfirst: bool = False) -> None:
+        logger.info("Creating indexes")
+        with self.engine.begin() as connection:
+            for table in tables:
+                for index in secondary_indexes(table):
+                    index.create(connection, checkfirst=checkfirst)
+
+    def _rename_indexes(
+        self, op: Operations, table: Table, old_name: str, new_name: str
+    ) -> None:
+        """Rename the secondary indexes of a table renamed from `old_name`.
+
+        Index names are unique per schema in PostgreSQL and SQLite, so they follow
+        the name of their table. Tables created before the indexes were introduced
+        have none to rename.
+        """
+        connection = op.get_bind()
+        dialect = connection.dialect
+        quote = dialect.identifier_preparer.quote
+        existing = {
+            index["name"] for index in inspect(connection).get_indexes(new_name)
+        }
+        for column in indexed_columns(table):
+            old = index_name(old_name, column)
+            new = index_name(new_name, column)
+            if old not in existing:
+                continue
+            if dialect.name == "postgresql":
+                op.execute(f"ALTER INDEX {quote(old)} RENAME TO {quote(new)}")
+            elif dialect.name == "mssql":
+                op.execute(f"EXEC sp_rename N'{new_name}.{old}', N'{new}', N'INDEX'")
+            elif dialect.name == "mysql":
+                op.execute(
+                    f"ALTER TABLE {quote(new_name)} "
+                    f"RENAME INDEX {quote(old)} TO {quote(new)}"
+                )
+            else:
+                # SQLite cannot rename an index
+                op.drop_index(old, table_name=new_name)
+                op.create_index(new, new_name, [column])
 
     def get_actual_tables(self):
         connection = self.engine.connect()
@@ -211,8 +506,8 @@ class SqlExport:
             old_table = current_table + "_old"
             return write_table, current_table, old_table
 
-        tables = dict(Base.metadata.tables)
-        tables = {t for t in tables if t[0] == "w"}
+        table_defs = dict(Base.metadata.tables)
+        tables = {t for t in table_defs if t[0] == "w"}
         tables = list(map(gen_table_names, tables))
 
         # Drop any left-over old tables that may exist
@@ -226,10 +521,13 @@ class SqlExport:
         with ctx.begin_transaction():
             actual_tables = self.get_actual_tables()
             for write_table, current_table, old_table in tables:
+                table = table_defs[write_table]
                 if current_table in actual_tables:
                     op.rename_table(current_table, old_table)
+                    self._rename_indexes(op, table, current_table, old_table)
                 # Rename write table to current table
                 op.rename_table(write_table, current_table)
+                self._rename_indexes(op, table, write_table, current_table)
 
         # Drop any old tables that may exist
         with ctx.begin_transaction():
@@ -247,11 +545,13 @@ class SqlExport:
     def _add_facets(self) -> None:
         logger.info("Add classification")
         facets = tqdm(self.lc.facets.items(), desc="Export facet", unit="facet")
-        for chunk in ichunked(facets, self.chunk_size):
-            for uuid, facet_info in chunk:
-                sql_facet = self._generate_sql_facets(uuid, facet_info, WFacet)
-                self.session.add(sql_facet)
-            self.session.commit()
+        self._load_facets(facets)
+
+    def _load_facets(self, facets: Iterable[tuple[str, Any]]) -> None:
+        loader = self._table_loader(WFacet)
+        for uuid, facet_info in facets:
+            loader.add(self._generate_sql_facets(uuid, facet_info, loader.model))
+        loader.flush()
 
     def _generate_sql_classes(
         self, uuid, klasse_info, model: Type[_T_Klasse]
@@ -266,11 +566,13 @@ class SqlExport:
 
     def _add_classes(self) -> None:
         classes = tqdm(self.lc.classes.items(), desc="Export class", unit="class")
-        for chunk in ichunked(classes, self.chunk_size):
-            for uuid, klasse_info in chunk:
-                sql_class = self._generate_sql_classes(uuid, klasse_info, WKlasse)
-                self.session.add(sql_class)
-            self.session.commit()
+        self._load_classes(classes)
+
+    def _load_classes(self, classes: Iterable[tuple[str, Any]]) -> None:
+        loader = self._table_loader(WKlasse)
+        for uuid, klasse_info in classes:
+            loader.add(self._generate_sql_classes(uuid, klasse_info, loader.model))
+        loader.flush()
 
     def _generate_sql_users(self, uuid, user_info, model: Type[_T_Bruger]) -> _T_Bruger:
         return model(
@@ -288,12 +590,14 @@ class SqlExport:
     def _add_users(self) -> None:
         logger.info("Add users")
         users = tqdm(self.lc.users.items(), desc="Export user", unit="user")
-        for chunk in ichunked(users, self.chunk_size):
-            for uuid, user_effects in chunk:
-                for user_info in user_effects:
-                    sql_user = self._generate_sql_users(uuid, user_info, WBruger)
-                    self.session.add(sql_user)
-            self.session.commit()
+        self._load_users(users)
+
+    def _load_users(self, users: Iterable[tuple[str, Any]]) -> None:
+        loader = self._table_loader(WBruger)
+        for uuid, user_effects in users:
+            for user_info in user_effects:
+                loader.add(self._generate_sql_users(uuid, user_info, loader.model))
+        loader.flush()
 
     def _generate_sql_units(self, uuid, unit_info, model: Type[_T_Enhed]) -> _T_Enhed:
         location = unit_info.get("location")
@@ -340,12 +644,14 @@ class SqlExport:
     def _add_units(self) -> None:
         logger.info("Add users")
         units = tqdm(self.lc.units.items(), desc="Export unit", unit="unit")
-        for chunk in ichunked(units, self.chunk_size):
-            for uuid, unit_validities in chunk:
-                for unit_info in unit_validities:
-                    sql_unit = self._generate_sql_units(uuid, unit_info, WEnhed)
-                    self.session.add(sql_unit)
-            self.session.commit()
+        self._load_units(units)
+
+    def _load_units(self, units: Iterable[tuple[str, Any]]) -> None:
+        loader = self._table_loader(WEnhed)
+        for uuid, unit_validities in units:
+            for unit_info in unit_validities:
+                loader.add(self._generate_sql_units(uuid, unit_info, loader.model))
+        loader.flush()
 
     def _generate_sql_engagements(
         self, uuid, engagement_info, model: Type[_T_Engagement]
@@ -385,14 +691,16 @@ class SqlExport:
         engagements = tqdm(
             self.lc.engagements.items(), desc="Export engagement", unit="engagement"
         )
-        for chunk in ichunked(engagements, self.chunk_size):
-            for uuid, engagement_validity in chunk:
-                for engagement_info in engagement_validity:
-                    sql_engagement = self._generate_sql_engagements(
-                        uuid, engagement_info, WEngagement
-                    )
-                    self.session.add(sql_engagement)
-            self.session.commit()
+        self._load_engagements(engagements)
+
+    def _load_engagements(self, engagements: Iterable[tuple[str, Any]]) -> None:
+        loader = self._table_loader(WEngagement)
+        for uuid, engagement_validity in engagements:
+            for engagement_info in engagement_validity:
+                loader.add(
+                    self._generate_sql_engagements(uuid, engagement_info, loader.model)
+                )
+        loader.flush()
 
     def _generate_sql_addresses(
         self, uuid, address_info, model: Type[_T_Adresse]
@@ -427,14 +735,16 @@ class SqlExport:
         addresses = tqdm(
             self.lc.addresses.items(), desc="Export address", unit="address"
         )
-        for chunk in ichunked(addresses, self.chunk_size):
-            for uuid, address_validities in chunk:
-                for address_info in address_validities:
-                    sql_address = self._generate_sql_addresses(
-                        uuid, address_info, WAdresse
-                    )
-                    self.session.add(sql_address)
-            self.session.commit()
+        self._load_addresses(addresses)
+
+    def _load_addresses(self, addresses: Iterable[tuple[str, Any]]) -> None:
+        loader = self._table_loader(WAdresse)
+        for uuid, address_validities in addresses:
+            for address_info in address_validities:
+                loader.add(
+                    self._generate_sql_addresses(uuid, address_info, loader.model)
+                )
+        loader.flush()
 
     def _generate_sql_dar_addresses(
         self, uuid, address_info, model: Type[_T_DARAdresse]
@@ -451,13 +761,15 @@ class SqlExport:
     def _add_dar_addresses(self) -> None:
         logger.info("Add DAR addresses")
         dar = tqdm(self.lc.dar_cache.items(), desc="Export DAR", unit="DAR")
-        for chunk in ichunked(dar, self.chunk_size):
-            for uuid, address_info in chunk:
-                sql_address = self._generate_sql_dar_addresses(
-                    uuid, address_info, WDARAdresse
-                )
-                self.session.add(sql_address)
-            self.session.commit()
+        self._load_dar_addresses(dar)
+
+    def _load_dar_addresses(self, dar: Iterable[tuple[str, Any]]) -> None:
+        loader = self._table_loader(WDARAdresse)
+        for uuid, address_info in dar:
+            loader.add(
+                self._generate_sql_dar_addresses(uuid, address_info, loader.model)
+            )
+        loader.flush()
 
     def _generate_sql_associations(
         self, uuid, association_info, model: Type[_T_Tilknytning]
@@ -490,14 +802,18 @@ class SqlExport:
         associations = tqdm(
             self.lc.associations.items(), desc="Export association", unit="association"
         )
-        for chunk in ichunked(associations, self.chunk_size):
-            for uuid, association_validity in chunk:
-                for association_info in association_validity:
-                    sql_association = self._generate_sql_associations(
-                        uuid, association_info, WTilknytning
+        self._load_associations(associations)
+
+    def _load_associations(self, associations: Iterable[tuple[str, Any]]) -> None:
+        loader = self._table_loader(WTilknytning)
+        for uuid, association_validity in associations:
+            for association_info in association_validity:
+                loader.add(
+                    self._generate_sql_associations(
+                        uuid, association_info, loader.model
                     )
-                    self.session.add(sql_association)
-            self.session.commit()
+                )
+        loader.flush()
 
     def _generate_sql_leave(self, uuid, leave_info, model: Type[_T_Orlov]) -> _T_Orlov:
         leave_type = leave_info["leave_type"]
@@ -515,12 +831,14 @@ class SqlExport:
     def _add_leaves(self) -> None:
         logger.info("Add leaves")
         leaves = tqdm(self.lc.leaves.items(), desc="Export leave", unit="leave")
-        for chunk in ichunked(leaves, self.chunk_size):
-            for uuid, leave_validity in chunk:
-                for leave_info in leave_validity:
-                    sql_leave = self._generate_sql_leave(uuid, leave_info, WOrlov)
-                    self.session.add(sql_leave)
-            self.session.commit()
+        self._load_leaves(leaves)
+
+    def _load_leaves(self, leaves: Iterable[tuple[str, Any]]) -> None:
+        loader = self._table_loader(WOrlov)
+        for uuid, leave_validity in leaves:
+            for leave_info in leave_validity:
+                loader.add(self._generate_sql_leave(uuid, leave_info, loader.model))
+        loader.flush()
 
     def _generate_sql_it_systems(
         self, uuid, itsystem_info, model: Type[_T_ItSystem]
@@ -532,13 +850,13 @@ class SqlExport:
         itsystems = tqdm(
             self.lc.itsystems.items(), desc="Export itsystem", unit="itsystem"
         )
-        for chunk in ichunked(itsystems, self.chunk_size):
-            for uuid, itsystem_info in chunk:
-                sql_itsystem = self._generate_sql_it_systems(
-                    uuid, itsystem_info, WItSystem
-                )
-                self.session.add(sql_itsystem)
-            self.session.commit()
+        self._load_it_systems(itsystems)
+
+    def _load_it_systems(self, itsystems: Iterable[tuple[str, Any]]) -> None:
+        loader = self._table_loader(WItSystem)
+        for uuid, itsystem_info in itsystems:
+            loader.add(self._generate_sql_it_systems(uuid, itsystem_info, loader.model))
+        loader.flush()
 
     def _generate_sql_it_user(
         self, uuid, it_connection_info, model: Type[_T_ItForbindelse]
@@ -554,21 +872,23 @@ class SqlExport:
             primær_boolean=it_connection_info.get("primary_boolean"),
         )
 
-    def _add_it_users(self):
+    def _add_it_users(self) -> None:
         logger.info("Add IT users")
         it_connections = tqdm(
             self.lc.it_connections.items(),
             desc="Export it connection",
             unit="it connection",
         )
-        for chunk in ichunked(it_connections, self.chunk_size):
-            for uuid, it_connection_validity in chunk:
-                for it_connection_info in it_connection_validity:
-                    sql_it_connection = self._generate_sql_it_user(
-                        uuid, it_connection_info, WItForbindelse
-                    )
-                    self.session.add(sql_it_connection)
-            self.session.commit()
+        self._load_it_users(it_connections)
+
+    def _load_it_users(self, it_connections: Iterable[tuple[str, Any]]) -> None:
+        loader = self._table_loader(WItForbindelse)
+        for uuid, it_connection_validity in it_connections:
+            for it_connection_info in it_connection_validity:
+                loader.add(
+                    self._generate_sql_it_user(uuid, it_connection_info, loader.model)
+                )
+        loader.flush()
 
     def _generate_sql_kle(self, uuid, kle_info, model: Type[_T_KLE]) -> _T_KLE:
         return model(
@@ -585,12 +905,14 @@ class SqlExport:
     def _add_kles(self) -> None:
         logger.info("Add KLES")
         kles = tqdm(self.lc.kles.items(), desc="Export KLE", unit="KLE")
-        for chunk in ichunked(kles, self.chunk_size):
-            for uuid, kle_validity in chunk:
-                for kle_info in kle_validity:
-                    sql_kle = self._generate_sql_kle(uuid, kle_info, WKLE)
-                    self.session.add(sql_kle)
-            self.session.commit()
+        self._load_kles(kles)
+
+    def _load_kles(self, kles: Iterable[tuple[str, Any]]) -> None:
+        loader = self._table_loader(WKLE)
+        for uuid, kle_validity in kles:
+            for kle_info in kle_validity:
+                loader.add(self._generate_sql_kle(uuid, kle_info, loader.model))
+        loader.flush()
 
     def _add_receipt(self, query_time, start_time=None, end_time=None):
         logger.info("Add Receipt")
@@ -609,6 +931,12 @@ class SqlExport:
         sql_kvittering.slut_levering_tid = end_time
         self.session.commit()
 
+    def _record_changes(self, sql_kvittering, changes: ChangeCounts) -> None:
+        sql_kvittering.antal_indsat = changes.inserted
+        sql_kvittering.antal_opdateret = changes.updated
+        sql_kvittering.antal_slettet = changes.deleted
+        self.session.commit()
+
     def _generate_sql_related(
         self, uuid, related_info, model: Type[_T_Enhedssammenkobling]
     ) -> _T_Enhedssammenkobling:
@@ -623,14 +951,14 @@ class SqlExport:
     def _add_related(self) -> None:
         logger.info("Add Enhedssammenkobling")
         relateds = tqdm(self.lc.related.items(), desc="Export related", unit="related")
-        for chunk in ichunked(relateds, self.chunk_size):
-            for uuid, related_validity in chunk:
-                for related_info in related_validity:
-                    sql_related = self._generate_sql_related(
-                        uuid, related_info, WEnhedssammenkobling
-                    )
-                    self.session.add(sql_related)
-            self.session.commit()
+        self._load_related(relateds)
+
+    def _load_related(self, relateds: Iterable[tuple[str, Any]]) -> None:
+        loader = self._table_loader(WEnhedssammenkobling)
+        for uuid, related_validity in relateds:
+            for related_info in related_validity:
+                loader.add(self._generate_sql_related(uuid, related_info, loader.model))
+        loader.flush()
 
     def _generate_sql_managers(
         self, uuid, manager_info, model: Type[_T_Leder]
@@ -661,23 +989,30 @@ class SqlExport:
     def _add_managers(self) -> None:
         logger.info("Add managers")
         managers = tqdm(self.lc.managers.items(), desc="Export manager", unit="manager")
-        for chunk in ichunked(managers, self.chunk_size):
-            for manager_uuid, manager_validity in chunk:
-                for manager_info in manager_validity:
-                    sql_manager = self._generate_sql_managers(
-                        manager_uuid, manager_info, WLeder
+        self._load_managers(managers)
+
+    def _load_managers(self, managers: Iterable[tuple[str, Any]]) -> None:
+        loader = self._table_loader(WLeder)
+        responsibility_loader = self._table_loader(WLederAnsvar)
+        for manager_uuid, manager_validity in managers:
+            for manager_info in manager_validity:
+                loader.add(
+                    self._generate_sql_managers(
+                        manager_uuid, manager_info, loader.model
                     )
-                    self.session.add(sql_manager)
+                )
 
-                    for responsibility_uuid in manager_info["manager_responsibility"]:
-                        sql_responsibility = self._generate_sql_manager_responsibility(
+                for responsibility_uuid in manager_info["manager_responsibility"]:
+                    responsibility_loader.add(
+                        self._generate_sql_manager_responsibility(
                             responsibility_uuid,
                             manager_uuid,
                             manager_info,
-                            WLederAnsvar,
+                            responsibility_loader.model,
                         )
-                        self.session.add(sql_responsibility)
-            self.session.commit()
+                    )
+        loader.flush()
+        responsibility_loader.flush()
 
     def log_overlapping_runs_aak(self):
         self.engine.execute(
@@ -693,7 +1028,11 @@ class SqlExport:
             use_pickle=use_pickle,
         )
 
-        self.swap_tables()
+        # A differential export has written the current tables already
+        if not self.differential:
+            with self.stats.phase("swap"):
+                self.swap_tables()
+            self._record_stats()
 
     def update_sql(self, uuid: UUID, objects: list[sql_type], table: Type[sql_type]):
         """Updates sql with the provided objects matching the objects UUID.
@@ -702,34 +1041,219 @@ class SqlExport:
         Then we add the objects that are not allready in sql - either new or changed in MO -  and remove any that
         do not match.
         """
+        self.update_sql_many({uuid: objects}, table)
+
+    def update_sql_many(
+        self,
+        objects_by_uuid: dict[UUID, list[sql_type]],
+        table: Type[sql_type],
+        commit: bool = True,
+    ):
+        """Updates sql with the provided objects for each UUID.
+
+        Works like `update_sql`, but looks up the current rows of all the UUIDs with
+        a single query per chunk. With `commit=False` the changes are left in the
+        session, so several tables can be updated in one transaction.
+        """
         search_key = table.leder_uuid if table == LederAnsvar else table.uuid
-        # Lookup engagement in sql
-        current_objects = self.session.execute(
-            select(table).where(search_key == str(uuid))
-        ).all()
-        if current_objects is not None:
-            current_objects = [one(c) for c in current_objects]
+        current_by_uuid: dict[str, list[sql_type]] = {
+            str(uuid): [] for uuid in objects_by_uuid
+        }
+        # Keep well below the bind parameter limits of the supported databases
+        for uuids in ichunked(current_by_uuid, 1000):
+            current_rows = self.session.execute(
+                select(table).where(search_key.in_(list(uuids)))
+            ).all()
+            for row in current_rows:
+                current = one(row)
+                current_by_uuid[getattr(current, search_key.key)].append(current)
+
+        for uuid, objects in objects_by_uuid.items():
+            current_objects = current_by_uuid[str(uuid)]
+
+            removed, new = diff_rows(current_objects, objects)
+
+            # Delete all rows from sql that do not match the found objects
+            logger.info(f"Delete {len(removed)} rows to {table} for {uuid=}")
+            for r in removed:
+                self.session.delete(r)
+
+            # Create all rows not currently in sql
+            logger.info(f"Add {len(new)} rows to {table} for {uuid=}")
+            for n in new:
+                self.session.add(n)
+
+            # Check that the result is the expected amount of rows in sql.
+            unchanged = len(current_objects) - len(removed)
+            assert len(objects) == unchanged + len(new), (
+                f"expected {len(objects)=} to be equal to {unchanged=} + {len(new)=}"
+            )
 
-        unchanged = [n for n in current_objects if n in objects]
+        if commit:
+            self.session.commit()
 
-        # Delete all rows from sql that do not match the found objects
-        removed = [r for r in current_objects if r not in objects]
-        logger.info(f"Delete {len(removed)} rows to {table} for {uuid=}")
-        for r in removed:
-            self.session.delete(r)
+    def refresh_class_fields(self, classes: dict[str, Any]) -> None:
+        """Copy the fields of `classes` into the current rows referring to them.
 
-        # Create all rows not currently in sql
-        new = [n for n in objects if n not in current_objects]
-        logger.info(f"Add {len(new)} rows to {table} for {uuid=}")
-        for n in new:
-            self.session.add(n)
+        The titles and other fields of a class are copied into every row using the
+        class, so a renamed class is written to all of those rows, with a single
+        statement per column.
+        """
+        if not classes:
+            return
+        for table in Base.metadata.sorted_tables:
+            if table.name[0] == "w":
+                continue
+            for uuid_column, column, field in class_field_columns(table):
+                statement = (
+                    update(table)
+                    .where(table.c[uuid_column] == bindparam("_class_uuid"))
+                    .values({column: bindparam("_value")})
+                )
+                self.session.execute(
+                    statement,
+                    [
+                        {"_class_uuid": uuid, "_value": klasse[field]}
+                        for uuid, klasse in classes.items()
+                    ],
+                )
 
-        # Check that the result is the expected amount of rows in sql.
-        assert len(objects) == len(unchanged) + len(new), (
-            f"expected {len(objects)=} to be equal to {len(unchanged)=} + {len(new)=}"
+    def refresh_facet_fields(self, facets: dict[str, Any]) -> None:
+        """Copy the user keys of `facets` into the current classes of them."""
+        if not facets:
+            return
+        table = Klasse.__table__
+        statement = (
+            update(table)
+            .where(table.c.facet_uuid == bindparam("_facet_uuid"))
+            .values(facet_bvn=bindparam("_user_key"))
+        )
+        self.session.execute(
+            statement,
+            [
+                {"_facet_uuid": uuid, "_user_key": facet["user_key"]}
+                for uuid, facet in facets.items()
+            ],
         )
 
-        self.session.commit()
+    def renamed_or_moved_units(
+        self, units_by_uuid: dict[UUID, list[Enhed]]
+    ) -> set[str]:
+        """Return the units whose name or parent differs from their current rows.
+
+        Units without current rows are left out, as there are no rows below them.
+        """
+        new = {
+            str(uuid): {(unit.navn, unit.forældreenhed_uuid) for unit in units}
+            for uuid, units in units_by_uuid.items()
+        }
+        current: dict[str, set[tuple[str, str | None]]] = defaultdict(set)
+        for uuids in ichunked(new, 1000):
+            rows = self.session.execute(
+                select(Enhed.uuid, Enhed.navn, Enhed.forældreenhed_uuid).where(
+                    Enhed.uuid.in_(list(uuids))
+                )
+            )
+            for uuid, name, parent in rows:
+                current[uuid].add((name, parent))
+        return {uuid for uuid, rows in current.items() if rows != new[uuid]}
+
+    def update_descendant_locations(self, uuids: Iterable[str]) -> int:
+        """Recompute `organisatorisk_sti` of every unit below the units `uuids`.
+
+        The location of a unit is the location of its parent followed by its own
+        name, so renaming or moving a unit changes the location of all the units
+        below it. The units below are found with a single recursive query, and
+        their changed locations are written with a single batched update. The rows
+        of `uuids` themselves must be up to date. Returns the number of rows
+        updated.
+        """
+        roots = set(uuids)
+        if not roots:
+            return 0
+        # The session does not autoflush, and the rows of `uuids` may be pending
+        self.session.flush()
+        rows = self.session.execute(self.descendants_query(roots)).all()
+
+        locations: dict[str, str | None] = {}
+        children = defaultdict(list)
+        for row in rows:
+            if row.uuid in roots:
+                locations[row.uuid] = row.organisatorisk_sti
+            else:
+                children[row.forældreenhed_uuid].append(row)
+
+        updates = []
+        queue = deque(locations)
+        while queue:
+            parent = queue.popleft()
+            for row in children.pop(parent, []):
+                location = "\\".join(filter(None, (locations[parent], row.navn)))
+                if location != row.organisatorisk_sti:
+                    updates.append({"id": row.id, "organisatorisk_sti": location})
+                if row.uuid not in locations:
+                    locations[row.uuid] = location
+                    queue.append(row.uuid)
+
+        if updates:
+            self.session.execute(update(Enhed), updates)
+        logger.info(f"Updated the location of {len(updates)} units below {roots}")
+        return len(updates)
+
+    @staticmethod
+    def descendants_query(roots: set[str]) -> Select:
+        """Return the query of the units `roots` and the units below them.
+
+        SQL Server only accepts UNION ALL in recursive queries, so the recursion is
+        bounded by `MAX_UNIT_DEPTH` rather than by a cycle in the tree ending it.
+        The depth is counted in literals, as SQL Server also requires the types of
+        both parts of the union to match exactly.
+        """
+        subtree = (
+            select(Enhed.uuid, literal_column("1").label("depth"))
+            .where(Enhed.forældreenhed_uuid.in_(roots))
+            .cte("subtree", recursive=True)
+        )
+        subtree = subtree.union_all(
+            select(
+                Enhed.uuid, (subtree.c.depth + literal_column("1")).label("depth")
+            ).where(
+                Enhed.forældreenhed_uuid == subtree.c.uuid,
+                subtree.c.depth < MAX_UNIT_DEPTH,
+            )
+        )
+        return select(
+            Enhed.id,
+            Enhed.uuid,
+            Enhed.navn,
+            Enhed.forældreenhed_uuid,
+            Enhed.organisatorisk_sti,
+        ).where(or_(Enhed.uuid.in_(roots), Enhed.uuid.in_(select(subtree.c.uuid))))
+
+
+def diff_rows(
+    current: list[sql_type], wanted: list[sql_type]
+) -> tuple[list[sql_type], list[sql_type]]:
+    """Return the rows to remove from `current` and to add, to arrive at `wanted`.
+
+    Rows are matched by fingerprint. Duplicates are matched one to one, so
+    surplus copies of a row are removed.
+    """
+    missing = Counter(row.fingerprint() for row in wanted)
+    removed = []
+    for row in current:
+        fingerprint = row.fingerprint()
+        if missing[fingerprint] > 0:
+            missing[fingerprint] -= 1
+        else:
+            removed.append(row)
+    new = []
+    for row in wanted:
+        fingerprint = row.fingerprint()
+        if missing[fingerprint] > 0:
+            missing[fingerprint] -= 1
+            new.append(row)
+    return removed, new
 
 
 def wrap_export(args: dict, settings: dict) -> None:
@@ -1,29 +1,45 @@
+from functools import cache
+
 from sqlalchemy import Boolean
 from sqlalchemy import Column
 from sqlalchemy import DateTime
+from sqlalchemy import Index
 from sqlalchemy import Integer
+from sqlalchemy import MetaData
 from sqlalchemy import String
+from sqlalchemy import Table
+from sqlalchemy import Text
 from sqlalchemy.ext.declarative import DeclarativeMeta
 from sqlalchemy.ext.declarative import declarative_base
 
 Base: DeclarativeMeta = declarative_base()  # type: ignore
 
 
+@cache
+def fingerprint_columns(table: Table) -> tuple[str, ...]:
+    """Return the keys of the exported columns of `table`.
+
+    The ID is left out, as it is auto generated by the database.
+    """
+    return tuple(column.key for column in table.columns if column.key != "id")
+
+
 class Compare:
-    def __eq__(self, __value: object) -> bool:
-        """When comparing objects we need to disregard the fields:
+    __table__: Table
+
+    def fingerprint(self) -> tuple:
+        """Return the exported values of the row, in column order.
 
-        * ID (as it is auto generated by sql-alchemy)
-        * _sa_instance_state
+        Rows with equal fingerprints are exported identically, so rows can be
+        compared, hashed and diffed by their fingerprints.
         """
+        return tuple(getattr(self, key) for key in fingerprint_columns(self.__table__))
 
-        left = dict(self.__dict__)
-        left.pop("id", None)
-        left.pop("_sa_instance_state", None)
-        right = dict(__value.__dict__)
-        right.pop("id", None)
-        right.pop("_sa_instance_state", None)
-        return left == right
+    def __eq__(self, __value: object) -> bool:
+        """When comparing objects we disregard the ID, see `fingerprint`."""
+        if not isinstance(__value, Compare):
+            return NotImplemented
+        return self.fingerprint() == __value.fingerprint()
 
 
 class BaseFacet(Compare):
@@ -311,6 +327,12 @@ class Kvittering(Base):  # type: ignore
     query_tid = Column(DateTime)
     start_levering_tid = Column(DateTime)
     slut_levering_tid = Column(DateTime)
+    # Rows changed by a differential export
+    antal_indsat = Column(Integer)
+    antal_opdateret = Column(Integer)
+    antal_slettet = Column(Integer)
+    # Timings and row counts of the export, see `ExportStats`
+    statistik = Column(Text)
 
 
 class BaseEnhedssammenkobling(Compare):
@@ -370,3 +392,73 @@ sql_type = (
     | Enhedssammenkobling
     | DARAdresse
 )
+
+
+# Columns which the consumers of the tables filter on. Each table gets a secondary
+# index on those of the columns it has, unless the column is its primary key.
+INDEXED_COLUMNS = (
+    "uuid",
+    "bruger_uuid",
+    "enhed_uuid",
+    "adressetype_scope",
+    "leder_uuid",
+)
+
+
+def index_name(table_name: str, column: str) -> str:
+    return f"ix_{table_name}_{column}"
+
+
+def indexed_columns(table: Table) -> list[str]:
+    return [
+        column
+        for column in INDEXED_COLUMNS
+        if column in table.c and not table.c[column].primary_key
+    ]
+
+
+def secondary_indexes(table: Table) -> list[Index]:
+    """Return the secondary indexes of `table`.
+
+    The indexes are not part of the table definition, so that they can be created
+    after the table has been loaded. They are bound to a copy of the table instead.
+    """
+    copy = table.to_metadata(MetaData())
+    return [
+        Index(index_name(table.name, column), copy.c[column])
+        for column in indexed_columns(table)
+    ]
+
+
+# Columns copied from a class into the rows referring to it, besides the "_titel"
+# columns, with the field of the class they are copied from
+CLASS_FIELD_COLUMNS = {
+    "adressetype_bvn": "user_key",
+    "synlighed_scope": "scope",
+}
+
+
+def class_field_columns(table: Table) -> list[tuple[str, str, str]]:
+    """Return the columns of `table` which are copied from a class.
+
+    Each is given as the column holding the uuid of the class, the copied column
+    and the field of the class it is copied from.
+    """
+    columns = []
+    for column in table.c.keys():
+        prefix, _, suffix = column.rpartition("_")
+        field = "title" if suffix == "titel" else CLASS_FIELD_COLUMNS.get(column)
+        if field is not None and f"{prefix}_uuid" in table.c:
+            columns.append((f"{prefix}_uuid", column, field))
+    return columns
+
+
+def current_model(work_model: type) -> type:
+    """Return the model of the current table which `work_model` is swapped into."""
+    name = work_model.__tablename__[1:]  # type: ignore[attr-defined]
+    (model,) = (
+        mapper.class_
+        for mapper in Base.registry.mappers
+        if mapper.class_.__tablename__ == name
+    )
+    return model
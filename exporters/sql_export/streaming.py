@@ -0,0 +1,103 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+"""Streaming of the LoRa cache into the work tables of a full export.
+
+Rather than filling the whole cache before writing anything, the collections are
+fetched in an event loop on a background thread, which hands batches of objects to
+the calling thread through a bounded queue. The calling thread writes each batch
+to its table and drops it. When the queue is full, the fetching waits for the
+writing to catch up, so at most `max_pending` batches are held in memory besides
+the ones being fetched and written.
+
+The database session is only used from the calling thread.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+from typing import Any
+from typing import Iterable
+from typing import Iterator
+
+from .gql_lora_cache_async import GQLLoraCache
+
+logger = logging.getLogger(__name__)
+
+# Collections kept in memory, as the other collections look up titles in them
+LOOKUP_COLLECTIONS = ("facets", "classes")
+
+_DONE = object()
+
+
+class _Stopped(Exception):
+    """Raised in the fetching thread when the consumer has stopped."""
+
+
+def stream_collections(
+    lc: GQLLoraCache,
+    collections: Iterable[str],
+    batch_size: int,
+    max_pending: int,
+) -> Iterator[tuple[str, dict]]:
+    """Yield `(collection, batch)` pairs as they are fetched by `lc`.
+
+    The lookup collections are cached in `lc` before any batch is yielded. The
+    other collections are fetched concurrently, subject to the query budget of
+    the cache. An error while fetching is raised from this iterator.
+    """
+    batches: queue.Queue = queue.Queue(maxsize=max_pending)
+    stopped = threading.Event()
+
+    def put(item: Any) -> None:
+        while not stopped.is_set():
+            try:
+                batches.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+        raise _Stopped()
+
+    async def fetch(name: str) -> None:
+        async for batch in lc.stream_collection(name, batch_size):
+            # Wait for room in the queue without blocking the event loop
+            await asyncio.to_thread(put, (name, batch))
+
+    async def fetch_all() -> None:
+        await lc._cache_lora_facets()
+        await lc._cache_lora_classes()
+        # `tasks` keeps strong references, see `populate_cache_async`
+        tasks = []
+        async with asyncio.TaskGroup() as tg:
+            for name in collections:
+                tasks.append(tg.create_task(fetch(name)))
+        del tasks
+
+    def run() -> None:
+        try:
+            asyncio.run(fetch_all())
+        except BaseException as e:
+            try:
+                put(e)
+            except _Stopped:
+                pass
+        else:
+            try:
+                put(_DONE)
+            except _Stopped:
+                pass
+
+    thread = threading.Thread(target=run, name="sql-export-fetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = batches.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
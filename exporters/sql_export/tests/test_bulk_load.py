@@ -0,0 +1,102 @@
+from unittest.mock import MagicMock
+from uuid import uuid4
+
+from sqlalchemy import create_engine
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+from ..bulk_load import LoadMethod
+from ..bulk_load import RowFactory
+from ..bulk_load import TableLoader
+from ..bulk_load import choose_load_method
+from ..sql_table_defs import Base
+from ..sql_table_defs import WBruger
+from ..sql_table_defs import WDARAdresse
+from ..sql_table_defs import WEngagement
+
+
+def make_session() -> Session:
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine, tables=[WBruger.__table__])
+    return Session(engine)
+
+
+def test_sqlite_uses_the_orm():
+    assert choose_load_method(make_session()) == LoadMethod.ORM
+
+
+def test_row_factory_exposes_the_table():
+    factory = RowFactory(WDARAdresse)
+    assert factory.__table__ is WDARAdresse.__table__
+    assert factory(uuid="a", vejnavn="b") == {"uuid": "a", "vejnavn": "b"}
+
+
+def test_executemany_loads_the_same_rows_as_the_orm():
+    users = [
+        {
+            "uuid": str(uuid4()),
+            "bvn": f"user{i}",
+            "fornavn": "Fornavn",
+            "efternavn": "" if i % 2 else None,
+            "startdato": "2020-01-01",
+        }
+        for i in range(7)
+    ]
+    loaded = {}
+    for method in (LoadMethod.ORM, LoadMethod.EXECUTEMANY):
+        session = make_session()
+        loader = TableLoader(session, WBruger, method=method, chunk_size=3)
+        loader.add_all(loader.model(**user) for user in users)
+        loader.flush()
+        loaded[method] = session.execute(select(WBruger.__table__)).all()
+
+    assert len(loaded[LoadMethod.EXECUTEMANY]) == len(users)
+    assert loaded[LoadMethod.EXECUTEMANY] == loaded[LoadMethod.ORM]
+
+
+def test_copy_payload_tells_null_from_empty_strings():
+    session = MagicMock()
+    session.get_bind().dialect = postgresql.dialect()
+    copied = {}
+
+    def copy_expert(sql, buffer):
+        copied["sql"] = sql
+        copied["payload"] = buffer.read()
+
+    session.connection().connection.cursor().copy_expert = copy_expert
+    loader = TableLoader(session, WEngagement, method=LoadMethod.COPY, chunk_size=10)
+    engagement = {
+        "uuid": "e",
+        "bruger_uuid": None,
+        "enhed_uuid": "",
+        "bvn": 'say "hi", \\N',
+        "arbejdstidsfraktion": 37,
+        "engagementstype_titel": "Ansat",
+        "primær_boolean": True,
+        "startdato": "2020-01-01",
+    }
+    loader.add(loader.model(**engagement))
+    loader.add(
+        loader.model(
+            **{**engagement, "arbejdstidsfraktion": None, "primær_boolean": False}
+        )
+    )
+    loader.flush()
+
+    assert copied["sql"].endswith("FROM STDIN WITH (FORMAT csv, NULL '\\N')")
+    columns = copied["sql"].split("(", 1)[1].split(")", 1)[0].split(", ")
+    assert columns[:5] == [
+        "uuid",
+        "bruger_uuid",
+        "enhed_uuid",
+        "bvn",
+        "arbejdstidsfraktion",
+    ]
+    nulls = ",".join(["\\N"] * 10)
+    assert copied["payload"] == (
+        '"e",\\N,"","say ""hi"", \\N",37,\\N,"Ansat",\\N,\\N,\\N,\\N,true,'
+        f'{nulls},"2020-01-01",\\N\n'
+        '"e",\\N,"","say ""hi"", \\N",\\N,\\N,"Ansat",\\N,\\N,\\N,\\N,false,'
+        f'{nulls},"2020-01-01",\\N\n'
+    )
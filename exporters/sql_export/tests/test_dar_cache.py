@@ -0,0 +1,138 @@
+import datetime
+from uuid import uuid4
+
+import pytest
+from graphql import print_ast
+
+from .. import dar_cache
+from .. import gql_lora_cache_async
+from ..config import GqlLoraCacheSettings
+from ..dar_cache import PersistentDARCache
+from ..fake_mo import FakeMOSession
+from ..fake_mo import SyntheticOrganisation
+from ..gql_lora_cache_async import GQLLoraCache
+
+DAY = datetime.timedelta(days=1)
+
+
+@pytest.mark.asyncio
+async def test_resolve_only_fetches_misses(tmp_path):
+    fetched: list[set[str]] = []
+
+    async def fetch(uuids):
+        fetched.append(uuids)
+        return {uuid: {"betegnelse": f"Vej {uuid}"} for uuid in uuids if uuid != "x"}
+
+    cache = PersistentDARCache(tmp_path / "dar.db", ttl=DAY)
+    assert await cache.resolve({"a", "b", "x"}, fetch) == {
+        "a": {"betegnelse": "Vej a"},
+        "b": {"betegnelse": "Vej b"},
+    }
+
+    # Another run, sharing the file
+    cache = PersistentDARCache(tmp_path / "dar.db", ttl=DAY)
+    result = await cache.resolve({"a", "c", "x"}, fetch)
+
+    assert set(result) == {"a", "c"}
+    assert fetched == [{"a", "b", "x"}, {"c", "x"}]
+    assert (cache.hits, cache.misses, cache.expired) == (1, 2, 0)
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = PersistentDARCache(tmp_path / "dar.db", ttl=DAY)
+    cache.put("a", {"betegnelse": "Vej a"})
+    assert cache.get("a") == {"betegnelse": "Vej a"}
+
+    cache = PersistentDARCache(tmp_path / "dar.db", ttl=datetime.timedelta(0))
+    assert cache.get("a") is None
+    assert cache.expired == 1
+
+
+class QueryLog(FakeMOSession):
+    def __init__(self, organisation):
+        super().__init__(organisation)
+        self.documents: list[str] = []
+
+    async def execute(self, document, variable_values=None, **kwargs):
+        self.documents.append(print_ast(document))
+        return await super().execute(document, variable_values, **kwargs)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("full_history", [False, True])
+@pytest.mark.parametrize("compact_records", [False, True])
+async def test_cache_names_dar_addresses_instead_of_mo(
+    tmp_path, monkeypatch, full_history, compact_records
+):
+    fetched: list[set[str]] = []
+
+    async def fetch(uuids):
+        fetched.append(uuids)
+        return {uuid: {"betegnelse": f"Vej {uuid}", "postnr": "8000"} for uuid in uuids}
+
+    monkeypatch.setattr(gql_lora_cache_async, "fetch_dar_addresses", fetch)
+    organisation = SyntheticOrganisation(units=3, employees=2)
+    settings = GqlLoraCacheSettings(
+        dar_cache_path=tmp_path / "dar.db", compact_records=compact_records
+    )
+
+    async def fetch_addresses():
+        lc = GQLLoraCache(
+            resolve_dar=True, full_history=full_history, settings=settings
+        )
+        lc._gql_client_session = QueryLog(organisation)
+        addresses = await lc._fetch_address()
+        return lc, addresses
+
+    lc, addresses = await fetch_addresses()
+
+    # MO is not asked to name the addresses, so it does not resolve them in DAR
+    assert all("name" not in query for query in lc._gql_client_session.documents)
+    dar_uuids = {
+        validity["dar_uuid"]
+        for validities in addresses.values()
+        for validity in validities
+        if validity["dar_uuid"]
+    }
+    assert fetched == [dar_uuids]
+    for validities in addresses.values():
+        for validity in validities:
+            if validity["scope"] == "DAR":
+                assert validity["value"] == f"Vej {validity['dar_uuid']}"
+                assert lc.dar_cache[validity["dar_uuid"]]["postnr"] == "8000"
+            else:
+                assert validity["value"] == validity["user_key"]
+
+    # Another run reads them all from the file
+    lc, again = await fetch_addresses()
+    assert len(fetched) == 1
+    assert [dict(v) for vs in again.values() for v in vs] == [
+        dict(v) for vs in addresses.values() for v in vs
+    ]
+
+
+@pytest.mark.asyncio
+async def test_malformed_dar_values_are_skipped(monkeypatch, caplog):
+    class Client:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *args):
+            pass
+
+        async def fetch(self, uuids):
+            return {uuid: {"betegnelse": "Vej 1"} for uuid in uuids}, set()
+
+    monkeypatch.setattr(dar_cache, "AsyncDARClient", Client)
+    uuid = str(uuid4())
+
+    assert await dar_cache.fetch_dar_addresses({uuid, "Vej 1", None}) == {
+        uuid: {"betegnelse": "Vej 1"}
+    }
+    assert "Not a DAR address: 'Vej 1'" in caplog.text
+
+
+def test_persistent_dar_cache_is_part_of_the_snapshot_fingerprint(tmp_path):
+    settings = GqlLoraCacheSettings(dar_cache_path=tmp_path / "dar.db")
+    assert "full_dar_addresses" not in GQLLoraCache().snapshot_fingerprint()
+    assert GQLLoraCache(settings=settings).snapshot_fingerprint()["full_dar_addresses"]
@@ -0,0 +1,90 @@
+import asyncio
+from uuid import uuid4
+
+import pytest
+
+from ..event_batcher import EventBatcher
+
+
+@pytest.mark.asyncio
+async def test_events_are_coalesced_per_type():
+    flushed = []
+
+    async def flush(key, uuids):
+        flushed.append((key, uuids))
+
+    batcher = EventBatcher(flush, max_delay=0.01, max_size=100)
+    a, b = uuid4(), uuid4()
+    await asyncio.gather(
+        batcher.submit("person", a),
+        batcher.submit("person", b),
+        batcher.submit("person", a),
+        batcher.submit("class", a),
+    )
+    assert sorted(flushed) == [("class", [a]), ("person", [a, b])]
+
+
+@pytest.mark.asyncio
+async def test_full_batch_is_flushed_without_waiting():
+    flushed = []
+
+    async def flush(key, uuids):
+        flushed.append(uuids)
+
+    batcher = EventBatcher(flush, max_delay=3600, max_size=2)
+    uuids = [uuid4(), uuid4()]
+    await asyncio.wait_for(
+        asyncio.gather(*(batcher.submit("person", uuid) for uuid in uuids)), 1
+    )
+    assert flushed == [uuids]
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_fails_every_event():
+    async def flush(key, uuids):
+        raise ValueError("boom")
+
+    batcher = EventBatcher(flush, max_delay=0.01, max_size=100)
+    results = await asyncio.gather(
+        batcher.submit("person", uuid4()),
+        batcher.submit("person", uuid4()),
+        return_exceptions=True,
+    )
+    assert [type(r) for r in results] == [ValueError, ValueError]
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_only_fails_the_failing_events():
+    flushed = []
+    uuids = [uuid4() for _ in range(8)]
+    poison = uuids[5]
+
+    async def flush(key, batch):
+        flushed.append(batch)
+        if poison in batch:
+            raise ValueError("boom")
+
+    batcher = EventBatcher(flush, max_delay=0.01, max_size=100)
+    results = await asyncio.gather(
+        *(batcher.submit("person", uuid) for uuid in uuids),
+        batcher.submit("person", poison),
+        return_exceptions=True,
+    )
+
+    failed = {
+        uuid
+        for uuid, result in zip([*uuids, poison], results)
+        if isinstance(result, ValueError)
+    }
+    assert failed == {poison}
+    assert results.count(None) == 7
+    # The halves without the failing event are handled once more, not one by one
+    assert flushed == [
+        uuids,
+        uuids[:4],
+        uuids[4:],
+        uuids[4:6],
+        uuids[4:5],
+        uuids[5:6],
+        uuids[6:],
+    ]
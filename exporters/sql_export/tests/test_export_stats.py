@@ -0,0 +1,47 @@
+import json
+
+from ..export_stats import ExportStats
+from ..export_stats import FetchStats
+from ..export_stats import WriteStats
+from ..export_stats import rows_written
+
+
+def test_fetch_stats_spans_overlapping_pages():
+    stats = FetchStats()
+    stats.observe(objects=10, started=1.0, finished=3.0)
+    stats.observe(objects=5, started=2.0, finished=5.0)
+
+    assert stats.pages == 2
+    assert stats.objects == 15
+    assert stats.query_seconds == 5.0
+    assert stats.seconds == 4.0
+
+
+def test_write_stats_rows_per_second():
+    stats = WriteStats()
+    assert stats.rows_per_second == 0.0
+
+    stats.observe(rows=100, seconds=0.5)
+    stats.observe(rows=50, seconds=1.0)
+
+    assert stats.rows_per_second == 100.0
+
+
+def test_export_stats():
+    stats = ExportStats()
+    with stats.phase("load"):
+        pass
+    stats.fetch["users"] = FetchStats(pages=2, objects=15, started=1.0, finished=5.0)
+    stats.tables["wbrugere"] = WriteStats(rows=15, seconds=0.5)
+
+    result = json.loads(stats.to_json())
+    assert set(result["phases"]) == {"load"}
+    assert result["fetch"]["users"]["seconds"] == 4.0
+    assert result["tables"]["wbrugere"] == {
+        "rows": 15,
+        "seconds": 0.5,
+        "rows_per_second": 30.0,
+    }
+
+    stats.update_metrics("test")
+    assert rows_written.labels(export="test", table="wbrugere")._value.get() == 15
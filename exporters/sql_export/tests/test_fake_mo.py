@@ -0,0 +1,77 @@
+import pytest
+from gql import gql
+
+from ..benchmark import run_benchmark
+from ..fake_mo import FakeMOSession
+from ..fake_mo import SyntheticOrganisation
+
+QUERY = gql(
+    """
+    query ($filter: EmployeeFilter, $limit: int, $cursor: Cursor) {
+        page: employees(filter: $filter, limit: $limit, cursor: $cursor) {
+            objects {
+                uuid
+                obj: current {
+                    name
+                }
+            }
+            page_info {
+                next_cursor
+            }
+        }
+    }
+    """
+)
+
+
+@pytest.mark.asyncio
+async def test_fake_mo_session_paginates():
+    organisation = SyntheticOrganisation(units=2, employees=5)
+    session = FakeMOSession(organisation)
+
+    uuids = []
+    cursor = None
+    while True:
+        result = await session.execute(
+            QUERY,
+            variable_values={"limit": 2, "cursor": cursor},
+            get_execution_result=True,
+        )
+        page = result.data["page"]
+        assert len(page["objects"]) <= 2
+        uuids.extend(obj["uuid"] for obj in page["objects"])
+        cursor = page["page_info"]["next_cursor"]
+        if cursor is None:
+            break
+
+    assert uuids == [obj["uuid"] for obj in organisation.collections["employees"]]
+    assert session.queries == 3
+
+
+@pytest.mark.asyncio
+async def test_fake_mo_session_filters_by_uuid():
+    organisation = SyntheticOrganisation(units=2, employees=5)
+    employee = organisation.collections["employees"][3]
+
+    result = await FakeMOSession(organisation).execute(
+        QUERY, variable_values={"filter": {"uuids": [employee["uuid"]]}}
+    )
+
+    assert result["page"] == {
+        "objects": [
+            {"uuid": employee["uuid"], "obj": {"name": employee["current"]["name"]}}
+        ],
+        "page_info": {"next_cursor": None},
+    }
+
+
+def test_run_benchmark(tmp_path):
+    organisation = SyntheticOrganisation(units=10, employees=40)
+
+    populate, export = run_benchmark(FakeMOSession(organisation), tmp_path, page_size=7)
+
+    # Every collection is fetched once
+    assert populate.rows == sum(map(len, organisation.collections.values()))
+    assert export.rows > populate.rows
+    assert export.seconds > 0
+    assert export.peak_rss_bytes > 0
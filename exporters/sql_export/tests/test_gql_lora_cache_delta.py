@@ -0,0 +1,84 @@
+import datetime
+from unittest.mock import AsyncMock
+
+import pytest
+
+from ..gql_lora_cache_async import GQLLoraCache
+from ..snapshot import Snapshot
+from ..snapshot import SnapshotMismatch
+from ..snapshot import snapshot_path
+from ..snapshot import write_snapshot
+
+
+def _unit(parent=None):
+    return {"parent": parent, "name": "unit"}
+
+
+@pytest.mark.asyncio
+async def test_apply_changes_replaces_and_deletes():
+    lc = GQLLoraCache()
+    lc.engagements = {"a": [{"user_key": "old"}], "b": [{}], "c": [{}]}
+    lc._fetch_engagements = AsyncMock(return_value={"a": [{"user_key": "new"}]})
+
+    await lc._apply_changes({"engagements": {"a", "b"}}, skip_associations=True)
+
+    lc._fetch_engagements.assert_awaited_once_with(["a", "b"])
+    assert lc.engagements == {"a": [{"user_key": "new"}], "c": [{}]}
+
+
+@pytest.mark.asyncio
+async def test_apply_changes_refetches_descendant_units():
+    lc = GQLLoraCache(full_history=False)
+    lc.units = {
+        "root": [_unit()],
+        "child": [_unit("root")],
+        "grandchild": [_unit("child")],
+        "other": [_unit()],
+    }
+    lc.managers = {"m": [{"unit": "child"}]}
+    lc._fetch_managers = AsyncMock(return_value={"m": [{"unit": "child"}]})
+    lc._fetch_units = AsyncMock(return_value={})
+
+    await lc._apply_changes({"managers": {"m"}}, skip_associations=True)
+
+    lc._fetch_units.assert_awaited_once_with(["child", "grandchild"])
+
+
+@pytest.mark.asyncio
+async def test_incremental_refresh(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "tmp").mkdir()
+    lc = GQLLoraCache()
+    path = snapshot_path(tmp_path / "tmp", lc.snapshot_fingerprint())
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    write_snapshot(
+        path,
+        lc.snapshot_fingerprint(),
+        [("users", {"a": [{"navn": "old"}], "b": [{"navn": "b"}]})],
+        {"fetched_at": now, "full_fetched_at": now},
+    )
+    lc._changed_since = AsyncMock(return_value={"users": {"a"}})
+    lc._fetch_users = AsyncMock(return_value={"a": [{"navn": "new"}]})
+
+    await lc.populate_cache_async(skip_associations=True, incremental=True)
+
+    assert lc.users == {"a": [{"navn": "new"}], "b": [{"navn": "b"}]}
+    snapshot = Snapshot(path, lc.snapshot_fingerprint())
+    assert snapshot.load("users") == lc.users
+    assert snapshot.metadata["full_fetched_at"] == now
+    snapshot.close()
+
+
+@pytest.mark.asyncio
+async def test_incremental_refresh_requires_recent_full_refresh(tmp_path):
+    lc = GQLLoraCache()
+    path = tmp_path / "loracache.snapshot"
+    long_ago = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+    write_snapshot(
+        path,
+        lc.snapshot_fingerprint(),
+        [("users", {})],
+        {"fetched_at": long_ago.isoformat(), "full_fetched_at": long_ago.isoformat()},
+    )
+    with pytest.raises(SnapshotMismatch):
+        await lc._refresh_from_snapshot(path, skip_associations=True)
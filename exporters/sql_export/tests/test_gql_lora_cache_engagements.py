@@ -1,3 +1,4 @@
+import asyncio
 from unittest.mock import AsyncMock
 from uuid import uuid4
 
@@ -87,3 +88,33 @@ async def test_cache_engagements():
     await lc._cache_lora_engagements()
     lc.gql_client_session.return_value.execute.assert_awaited_once()
     assert lc.engagements == expected
+
+
+@async_to_sync
+async def test_execute_query_prefetches_next_page():
+    lc = GQLLoraCache()
+    lc.gql_client_session = AsyncMock()
+    requested_cursors = []
+
+    async def execute(document, variable_values, get_execution_result):
+        cursor = variable_values["cursor"]
+        requested_cursors.append(cursor)
+        next_cursor = {None: "2", "2": None}[cursor]
+        return ExecutionResult(
+            data={
+                "page": {
+                    "objects": [{"cursor": cursor}],
+                    "page_info": {"next_cursor": next_cursor},
+                }
+            }
+        )
+
+    lc.gql_client_session.return_value.execute.side_effect = execute
+    results = lc._execute_query("query { org { uuid } }", collection="engagements")
+
+    first = await results.__anext__()
+    # Let the background fetcher run while the first page is being processed
+    await asyncio.sleep(0)
+    assert first == {"cursor": None}
+    assert requested_cursors == [None, "2"]
+    assert [obj async for obj in results] == [{"cursor": "2"}]
@@ -0,0 +1,45 @@
+import pytest
+
+from ..config import GqlLoraCacheSettings
+from ..gql_lora_cache_async import GQLLoraCache
+
+
+def _engagement(user, unit):
+    return {"user": user, "unit": unit, "from_date": "2020-01-01", "to_date": None}
+
+
+def test_lookup_by_user_and_unit():
+    lc = GQLLoraCache(settings=GqlLoraCacheSettings())
+    lc.engagements = {
+        "e1": [_engagement("u1", "a")],
+        # Moved from unit a to unit b
+        "e2": [_engagement("u2", "a"), _engagement("u2", "b")],
+        "e3": [_engagement("u1", "b")],
+    }
+
+    assert lc.lookup("engagements", "user", "u1") == {
+        "e1": lc.engagements["e1"],
+        "e3": lc.engagements["e3"],
+    }
+    assert set(lc.lookup("engagements", "unit", "a")) == {"e1", "e2"}
+    assert set(lc.lookup("engagements", "unit", "b")) == {"e2", "e3"}
+    assert lc.lookup("engagements", "user", "nobody") == {}
+    with pytest.raises(ValueError):
+        lc.lookup("engagements", "job_function", "x")
+
+
+def test_lookup_follows_refreshes():
+    lc = GQLLoraCache(settings=GqlLoraCacheSettings())
+    lc.addresses = {"a1": [{"user": "u1", "unit": None, "scope": "E-mail"}]}
+    assert set(lc.lookup("addresses", "scope", "E-mail")) == {"a1"}
+
+    # Refreshed in place, as by an incremental refresh
+    lc.addresses["a2"] = [{"user": "u2", "unit": None, "scope": "E-mail"}]
+    assert set(lc.lookup("addresses", "scope", "E-mail")) == {"a1"}
+    lc.invalidate_indexes("addresses")
+    assert set(lc.lookup("addresses", "scope", "E-mail")) == {"a1", "a2"}
+
+    # Replaced
+    lc.addresses = {"a3": [{"user": "u1", "unit": None, "scope": "PHONE"}]}
+    assert lc.lookup("addresses", "scope", "E-mail") == {}
+    assert set(lc.lookup("addresses", "user", "u1")) == {"a3"}
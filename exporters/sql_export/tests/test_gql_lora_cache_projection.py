@@ -0,0 +1,122 @@
+import pickle
+
+import pytest
+from graphql import print_ast
+
+from .. import gql_lora_cache_async
+from ..config import GqlLoraCacheSettings
+from ..fake_mo import FakeMOSession
+from ..fake_mo import SyntheticOrganisation
+from ..gql_lora_cache_async import GQLLoraCache
+from ..projection import PROJECTABLE_FIELDS
+from ..projection import FieldNotProjected
+
+PROFILE = {
+    "engagements": {"user", "unit", "user_key"},
+    "associations": {"user", "unit"},
+    "it_connections": {"user", "itsystem", "username"},
+    "users": {"navn"},
+}
+
+
+@pytest.fixture(autouse=True)
+def no_retries(monkeypatch):
+    # Fail at once rather than retrying a broken query for minutes
+    monkeypatch.setattr(gql_lora_cache_async, "RETRY_MAX_TIME", 0)
+
+
+class QueryLog(FakeMOSession):
+    def __init__(self, organisation):
+        super().__init__(organisation)
+        self.documents: list[str] = []
+
+    async def execute(self, document, variable_values=None, **kwargs):
+        self.documents.append(print_ast(document))
+        return await super().execute(document, variable_values, **kwargs)
+
+
+def _cache(organisation, full_history, compact_records, projection=None):
+    lc = GQLLoraCache(
+        full_history=full_history,
+        settings=GqlLoraCacheSettings(compact_records=compact_records),
+        projection=projection,
+    )
+    lc._gql_client_session = QueryLog(organisation)
+    return lc
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("full_history", [False, True])
+@pytest.mark.parametrize("compact_records", [False, True])
+async def test_projection_fetches_and_stores_only_projected_keys(
+    full_history, compact_records
+):
+    organisation = SyntheticOrganisation(units=5, employees=20, history=2)
+    full = _cache(organisation, full_history, compact_records)
+    projected = _cache(organisation, full_history, compact_records, PROFILE)
+
+    for name, fetch in [
+        ("engagements", "_fetch_engagements"),
+        ("associations", "_fetch_associations"),
+        ("it_connections", "_fetch_it_connections"),
+        ("users", "_fetch_users"),
+    ]:
+        expected = await getattr(full, fetch)()
+        objects = await getattr(projected, fetch)()
+        omitted = set(PROJECTABLE_FIELDS[name]) - PROFILE[name]
+
+        assert objects.keys() == expected.keys()
+        for uuid, validities in objects.items():
+            assert [dict(v) for v in validities] == [
+                {key: value for key, value in v.items() if key not in omitted}
+                for v in expected[uuid]
+            ]
+            for key in omitted:
+                with pytest.raises(FieldNotProjected):
+                    validities[0][key]
+                with pytest.raises(FieldNotProjected):
+                    validities[0].get(key)
+
+    # The left out fields are not queried
+    queries = "\n".join(projected._gql_client_session.documents)
+    assert "extension_1" not in queries
+    assert "dynamic_class" not in queries
+    assert "cpr_no" not in queries
+    assert "employee_uuid" in queries
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("compact_records", [False, True])
+async def test_projected_objects_survive_pickling(compact_records):
+    organisation = SyntheticOrganisation(units=2, employees=3)
+    lc = _cache(organisation, False, compact_records, {"engagements": {"user"}})
+    engagements = pickle.loads(pickle.dumps(await lc._fetch_engagements()))
+
+    engagement = next(iter(engagements.values()))[0]
+    assert engagement["user"]
+    with pytest.raises(FieldNotProjected, match="fraction"):
+        engagement["fraction"]
+    # Keys which were never there are just missing
+    with pytest.raises(KeyError):
+        engagement["nonsense"]
+    assert engagement.get("nonsense") is None
+
+
+def test_projection_of_unknown_collection():
+    with pytest.raises(ValueError):
+        GQLLoraCache(settings=GqlLoraCacheSettings(), projection={"nonsense": {"a"}})
+
+
+def test_projection_is_part_of_the_snapshot_fingerprint():
+    unprojected = GQLLoraCache(settings=GqlLoraCacheSettings())
+    projected = GQLLoraCache(settings=GqlLoraCacheSettings(), projection=PROFILE)
+    assert "projection" not in unprojected.snapshot_fingerprint()
+    assert projected.snapshot_fingerprint()["projection"]["users"] == [
+        "cpr",
+        "efternavn",
+        "fornavn",
+        "kaldenavn",
+        "kaldenavn_efternavn",
+        "kaldenavn_fornavn",
+        "user_key",
+    ]
@@ -0,0 +1,66 @@
+import pytest
+
+from .. import gql_lora_cache_async
+from ..config import GqlLoraCacheSettings
+from ..fake_mo import FakeMOSession
+from ..fake_mo import SyntheticOrganisation
+from ..gql_lora_cache_async import GQLLoraCache
+from ..gql_lora_cache_async import parse_query
+
+
+class OrgCounter(FakeMOSession):
+    def __init__(self, organisation):
+        super().__init__(organisation)
+        self.org_lookups = 0
+
+    async def execute(self, document, variable_values=None, **kwargs):
+        if document is parse_query(gql_lora_cache_async.ROOT_ORG_QUERY):
+            self.org_lookups += 1
+        return await super().execute(document, variable_values, **kwargs)
+
+
+def _cache(organisation):
+    lc = GQLLoraCache(settings=GqlLoraCacheSettings(std_page_size=3))
+    lc._gql_client_session = OrgCounter(organisation)
+    return lc
+
+
+@pytest.mark.asyncio
+async def test_queries_are_parsed_once(monkeypatch):
+    parses: list[str] = []
+    gql = gql_lora_cache_async.gql
+
+    def counting_gql(query):
+        parses.append(query)
+        return gql(query)
+
+    monkeypatch.setattr(gql_lora_cache_async, "gql", counting_gql)
+    parse_query.cache_clear()
+    organisation = SyntheticOrganisation(units=3, employees=10)
+    lc = _cache(organisation)
+    lc._gql_client_session = FakeMOSession(organisation)
+
+    engagements = await lc._fetch_engagements()
+    for uuid in list(engagements)[:3]:
+        await lc._fetch_engagements(uuid)
+
+    # Many pages and single objects, but a single query
+    assert lc.fetch_stats["engagements"].pages > 3
+    assert len(parses) == len(set(parses)) == 1
+    parse_query.cache_clear()
+
+
+@pytest.mark.asyncio
+async def test_org_uuid_is_fetched_once():
+    organisation = SyntheticOrganisation(units=3, employees=2)
+    lc = _cache(organisation)
+    session = lc._gql_client_session
+
+    units = await lc._fetch_units()
+    for uuid in units:
+        await lc._fetch_units(uuid)
+    assert session.org_lookups == 1
+
+    lc.reset_org_uuid()
+    await lc._fetch_units(next(iter(units)))
+    assert session.org_lookups == 2
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from .. import gql_lora_cache_async
+from ..config import GqlLoraCacheSettings
+from ..fake_mo import FakeMOSession
+from ..fake_mo import SyntheticOrganisation
+from ..gql_lora_cache_async import CACHE_COLLECTIONS
+from ..gql_lora_cache_async import GQLLoraCache
+
+
+class FailingSession(FakeMOSession):
+    """Fails the queries of the objects in `failing`, once the others are done."""
+
+    def __init__(self, organisation, failing):
+        super().__init__(organisation)
+        self.failing = set(failing)
+        self.fetched: list[str] = []
+
+    async def execute(self, document, variable_values=None, **kwargs):
+        uuids = ((variable_values or {}).get("filter") or {}).get("uuids") or []
+        if self.failing & set(uuids):
+            await asyncio.sleep(0.1)
+            raise RuntimeError("MO is down")
+        self.fetched.extend(uuids)
+        return await super().execute(document, variable_values, **kwargs)
+
+
+def _cache(organisation, **settings):
+    lc = GQLLoraCache(
+        full_history=True,
+        settings=GqlLoraCacheSettings(
+            compact_records=False, std_page_size=7, **settings
+        ),
+    )
+    lc._gql_client_session = FakeMOSession(organisation)
+    return lc
+
+
+@pytest.mark.asyncio
+async def test_sharded_history_equals_unsharded(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    organisation = SyntheticOrganisation(units=10, employees=40, history=3)
+
+    unsharded = _cache(organisation)
+    await unsharded.populate_cache_async()
+    sharded = _cache(organisation, history_shard_size=9)
+    await sharded.populate_cache_async()
+
+    for name in CACHE_COLLECTIONS:
+        assert getattr(sharded, name) == getattr(unsharded, name), name
+    assert sharded.users
+    # The checkpoints are removed once every shard is fetched
+    assert not any((tmp_path / "tmp").glob("*.shards/*/*"))
+
+
+@pytest.mark.asyncio
+async def test_sharded_history_resumes_from_checkpoints(tmp_path, monkeypatch):
+    monkeypatch.setattr(gql_lora_cache_async, "RETRY_MAX_TIME", 0)
+    organisation = SyntheticOrganisation(units=5, employees=30, history=2)
+    uuids = sorted(
+        employee["uuid"] for employee in organisation.collections["employees"]
+    )
+    lc = _cache(organisation, history_shard_size=10, history_shard_attempts=1)
+    session = lc._gql_client_session = FailingSession(organisation, uuids[:1])
+
+    with pytest.raises(ExceptionGroup):
+        await lc._fetch_history_sharded("users", tmp_path)
+    assert len(list((tmp_path / "users").glob("*.checkpoint"))) == 2
+
+    session.failing.clear()
+    session.fetched.clear()
+    users = await lc._fetch_history_sharded("users", tmp_path)
+
+    # Only the failed shard is fetched again
+    assert session.fetched == uuids[:10]
+    assert users == await _cache(organisation)._fetch_users()
+    assert not (tmp_path / "users").exists()
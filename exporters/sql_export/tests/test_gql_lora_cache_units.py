@@ -0,0 +1,58 @@
+import pytest
+
+from ..config import GqlLoraCacheSettings
+from ..fake_mo import FakeMOSession
+from ..fake_mo import SyntheticOrganisation
+from ..gql_lora_cache_async import GQLLoraCache
+from ..gql_lora_cache_async import resolve_unit_tree
+
+
+def _manager(uuid):
+    return {"uuid": uuid, "org_unit_uuid": None, "responsibility_uuids": []}
+
+
+def test_resolve_unit_tree():
+    units = [
+        {"uuid": "c", "parent_uuid": "b", "name": "C", "manager_uuid": []},
+        {"uuid": "b", "parent_uuid": "a", "name": "B", "manager_uuid": []},
+        {
+            "uuid": "a",
+            "parent_uuid": "org",
+            "name": "A",
+            "manager_uuid": [_manager("m")],
+        },
+        {"uuid": "d", "parent_uuid": "a", "name": "D", "manager_uuid": [_manager("n")]},
+    ]
+
+    resolve_unit_tree(units)
+
+    assert {unit["uuid"]: unit["location"] for unit in units} == {
+        "a": "A",
+        "b": "A\\B",
+        "c": "A\\B\\C",
+        "d": "A\\D",
+    }
+    assert {
+        unit["uuid"]: [manager["uuid"] for manager in unit["acting_manager_uuid"]]
+        for unit in units
+    } == {"a": ["m"], "b": ["m"], "c": ["m"], "d": ["n"]}
+
+
+@pytest.mark.asyncio
+async def test_local_unit_tree_matches_mo():
+    organisation = SyntheticOrganisation(units=40, employees=40, depth=5)
+    # Units without managers of their own inherit them
+    for unit in organisation.units[::3]:
+        organisation._managers.pop(unit["uuid"], None)
+
+    async def fetch_units(local_unit_tree: bool) -> dict:
+        settings = GqlLoraCacheSettings(
+            local_unit_tree=local_unit_tree, compact_records=False, std_page_size=7
+        )
+        lc = GQLLoraCache(settings=settings)
+        lc._gql_client_session = FakeMOSession(organisation)
+        return await lc._fetch_units()
+
+    assert await fetch_units(local_unit_tree=True) == await fetch_units(
+        local_unit_tree=False
+    )
@@ -0,0 +1,97 @@
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+from ..lc_for_jobs_db import JobsDatabase
+from ..lc_for_jobs_db import get_engine
+from ..lc_for_jobs_db import optimise_database
+from ..sql_table_defs import Base
+from ..sql_table_defs import WAdresse
+from ..sql_table_defs import WEngagement
+from ..sql_table_defs import WEnhed
+from ..sql_table_defs import WLeder
+
+
+def _address(uuid, scope, bruger_uuid=None, enhed_uuid=None):
+    return WAdresse(
+        uuid=uuid,
+        bruger_uuid=bruger_uuid,
+        enhed_uuid=enhed_uuid,
+        værdi=uuid,
+        adressetype_bvn=scope,
+        adressetype_scope=scope,
+        adressetype_titel=scope,
+    )
+
+
+def _engagement(uuid, bruger_uuid, enhed_uuid):
+    return WEngagement(
+        uuid=uuid,
+        bruger_uuid=bruger_uuid,
+        enhed_uuid=enhed_uuid,
+        bvn=uuid,
+        engagementstype_titel="Ansat",
+        stillingsbetegnelse_titel="Udvikler",
+    )
+
+
+def _unit(uuid, parent_uuid):
+    return WEnhed(
+        uuid=uuid,
+        navn=uuid.upper(),
+        bvn=uuid,
+        forældreenhed_uuid=parent_uuid,
+        enhedstype_titel="Afdeling",
+    )
+
+
+def test_optimised_database_is_queried(tmp_path):
+    engine = get_engine(tmp_path / "ActualState")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all(
+            [
+                _unit("root", None),
+                _unit("b", "root"),
+                _unit("a", "root"),
+                _engagement("e1", "user", "a"),
+                _engagement("e2", "user", "b"),
+                _engagement("e3", "other", "a"),
+                _address("mail", "EMAIL", bruger_uuid="user"),
+                _address("phone", "PHONE", bruger_uuid="user"),
+                _address("unit-mail", "EMAIL", enhed_uuid="a"),
+                WLeder(
+                    uuid="m",
+                    bruger_uuid="user",
+                    enhed_uuid="a",
+                    ledertype_titel="Chef",
+                    niveautype_titel="Niveau 1",
+                ),
+            ]
+        )
+        session.commit()
+
+    optimise_database(engine)
+
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert connection.exec_driver_sql("PRAGMA page_size").scalar() == 8192
+        # ANALYZE stores the statistics of the query planner
+        assert connection.exec_driver_sql("SELECT count(*) FROM sqlite_stat1").scalar()
+    indexes = {index["name"] for index in inspect(engine).get_indexes("wadresser")}
+    assert "ix_wadresser_bruger_uuid_adressetype_scope" in indexes
+
+    db = JobsDatabase(engine)
+    assert db.unit("a").navn == "A"
+    assert db.user("nobody") is None
+    assert [unit.uuid for unit in db.child_units("root")] == ["a", "b"]
+    assert {e.uuid for e in db.engagements_by_user("user")} == {"e1", "e2"}
+    assert {e.uuid for e in db.engagements_by_unit("a")} == {"e1", "e3"}
+    assert {a.uuid for a in db.addresses_by_scope("EMAIL")} == {"mail", "unit-mail"}
+    assert [a.uuid for a in db.addresses_by_scope("EMAIL", bruger_uuid="user")] == [
+        "mail"
+    ]
+    assert [a.uuid for a in db.addresses_by_scope("EMAIL", enhed_uuid="a")] == [
+        "unit-mail"
+    ]
+    assert [m.uuid for m in db.managers_of_unit("a")] == ["m"]
+    db.close()
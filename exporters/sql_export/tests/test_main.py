@@ -1,11 +1,21 @@
 from uuid import uuid4
 
 import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects import mssql
 
+from ..main import handle_batch
 from ..main import handle_class
 from ..main import handle_person
+from ..sql_export import MAX_UNIT_DEPTH
+from ..sql_export import SqlExport
+from ..sql_table_defs import Adresse
+from ..sql_table_defs import Base
 from ..sql_table_defs import Bruger
+from ..sql_table_defs import Engagement
+from ..sql_table_defs import Enhed
 from ..sql_table_defs import Klasse
+from ..tests.test_sql_export import FakeLC
 from ..tests.test_sql_export import _TestableSqlExport
 
 
@@ -34,7 +44,7 @@ async def test_handle_person():
     )
 
     # Act
-    await handle_person(uuid=uuid, sql_exporter=sql_export)
+    await handle_person(uuids=[uuid], sql_exporter=sql_export)
 
     # Assert
     sql_export.session.add.assert_called_once()
@@ -50,6 +60,7 @@ async def test_handle_class():
     klasse_dict = {
         "user_key": "klasse",
         "title": "test klasse",
+        "scope": None,
         "uuid": str(uuid),
         "facet": str(facet_uuid),
     }
@@ -64,9 +75,216 @@ async def test_handle_class():
     )
 
     # Act
-    await handle_class(uuid=uuid, sql_exporter=sql_export)
+    await handle_class(uuids=[uuid], sql_exporter=sql_export)
 
     # Assert
     sql_export.session.add.assert_called_once()
     sql_export.session.delete.assert_not_called()
     assert sql_export.session.add.call_args[0][0] == class_model
+
+
+@pytest.mark.asyncio
+async def test_handle_person_batch_is_looked_up_once():
+    # Arrange
+    uuids = [uuid4(), uuid4()]
+    lc_data = {
+        "users": {
+            str(uuid): {
+                str(uuid): [
+                    {
+                        "cpr": None,
+                        "efternavn": "Lauritzen",
+                        "fornavn": "Grejs",
+                        "from_date": "1942-09-27",
+                        "kaldenavn": "",
+                        "kaldenavn_efternavn": "",
+                        "kaldenavn_fornavn": "",
+                        "navn": "Grejs Lauritzen",
+                        "to_date": "9999-12-31",
+                        "user_key": str(uuid),
+                        "uuid": str(uuid),
+                    }
+                ]
+            }
+            for uuid in uuids
+        }
+    }
+    sql_export = _TestableSqlExport(inject_lc=lc_data)
+
+    # Act
+    await handle_batch("person", uuids, sql_exporter=sql_export)
+
+    # Assert
+    sql_export.session.execute.assert_called_once()
+    assert sql_export.session.add.call_count == 2
+    sql_export.session.commit.assert_called_once()
+
+
+def _memory_sql_export() -> SqlExport:
+    sql_export = SqlExport(
+        settings={
+            "exporters.actual_state.type": "Memory",
+            "exporters.actual_state.db_name": "Whatever",
+        }
+    )
+    Base.metadata.create_all(sql_export.engine)
+    sql_export.session = sql_export._get_db_session()
+    sql_export.lc = FakeLC()
+    return sql_export
+
+
+def _unit(name, parent, location):
+    return {
+        "name": name,
+        "user_key": name,
+        "parent": parent,
+        "unit_type": "type",
+        "level": None,
+        "time_planning": None,
+        "org_unit_hierarchy": None,
+        "location": location,
+        "from_date": "2020-01-01",
+        "to_date": None,
+    }
+
+
+@pytest.mark.asyncio
+async def test_handle_org_unit_updates_locations_below():
+    # Arrange
+    sql_export = _memory_sql_export()
+    sql_export.lc.classes = {"type": {"title": "Afdeling"}}
+    tree = {
+        "root": _unit("Root", None, "Root"),
+        "a": _unit("A", "root", "Root\\A"),
+        "b": _unit("B", "a", "Root\\A\\B"),
+        "c": _unit("C", "b", "Root\\A\\B\\C"),
+        "other": _unit("Other", "root", "Root\\Other"),
+    }
+    for uuid, unit in tree.items():
+        sql_export.session.add(sql_export._generate_sql_units(uuid, unit, Enhed))
+    sql_export.session.commit()
+
+    async def fetch_units(uuids):
+        return {"a": [_unit("A2", "other", "Root\\Other\\A2")]}
+
+    sql_export.lc._fetch_units = fetch_units
+
+    # Act
+    await handle_batch("org_unit", ["a"], sql_exporter=sql_export)
+
+    # Assert
+    locations = dict(
+        sql_export.session.execute(select(Enhed.uuid, Enhed.organisatorisk_sti)).all()
+    )
+    assert locations == {
+        "root": "Root",
+        "a": "Root\\Other\\A2",
+        "b": "Root\\Other\\A2\\B",
+        "c": "Root\\Other\\A2\\B\\C",
+        "other": "Root\\Other",
+    }
+
+
+def test_descendants_query_is_valid_on_sql_server():
+    sql = str(SqlExport.descendants_query({"a"}).compile(dialect=mssql.dialect()))
+    # SQL Server requires a recursive query to be a top level UNION ALL
+    assert "UNION ALL" in sql
+    assert "UNION SELECT" not in sql
+    assert "RECURSIVE" not in sql
+    # Nor does it allow more than 100 levels of recursion
+    assert MAX_UNIT_DEPTH < 100
+
+
+def test_update_descendant_locations_ends_at_a_cycle():
+    # Arrange
+    sql_export = _memory_sql_export()
+    sql_export.lc.classes = {"type": {"title": "Afdeling"}}
+    tree = {
+        "a": _unit("A", "b", "Root\\A"),
+        "b": _unit("B", "a", "Old\\B"),
+    }
+    for uuid, unit in tree.items():
+        sql_export.session.add(sql_export._generate_sql_units(uuid, unit, Enhed))
+    sql_export.session.commit()
+
+    # Act
+    updated = sql_export.update_descendant_locations(["a"])
+
+    # Assert
+    assert updated == 1
+    locations = dict(
+        sql_export.session.execute(select(Enhed.uuid, Enhed.organisatorisk_sti)).all()
+    )
+    assert locations["b"] == "Root\\A\\B"
+
+
+@pytest.mark.asyncio
+async def test_handle_class_refreshes_copied_titles():
+    # Arrange
+    sql_export = _memory_sql_export()
+    sql_export.lc.facets = {"facet": {"user_key": "engagement_type"}}
+    sql_export.lc.classes = {
+        "ansat": {
+            "user_key": "ansat",
+            "title": "Ansat",
+            "facet": "facet",
+            "scope": None,
+        },
+        "email": {
+            "user_key": "email",
+            "title": "Email",
+            "facet": "facet",
+            "scope": "EMAIL",
+        },
+    }
+    sql_export.session.add_all(
+        [
+            Engagement(
+                uuid="e1",
+                bvn="e1",
+                engagementstype_uuid="ansat",
+                engagementstype_titel="Ansat",
+                stillingsbetegnelse_uuid="other",
+                stillingsbetegnelse_titel="Ansat",
+            ),
+            Adresse(
+                uuid="a1",
+                adressetype_uuid="email",
+                adressetype_bvn="email",
+                adressetype_scope="E-mail",
+                adressetype_titel="Email",
+            ),
+        ]
+    )
+    sql_export.session.commit()
+    renamed = {
+        "ansat": {
+            "user_key": "ansat",
+            "title": "Medarbejder",
+            "facet": "facet",
+            "scope": None,
+        },
+        "email": {
+            "user_key": "mail",
+            "title": "E-mail",
+            "facet": "facet",
+            "scope": "EMAIL",
+        },
+    }
+
+    async def fetch_classes(uuids):
+        return {str(uuid): renamed[str(uuid)] for uuid in uuids}
+
+    sql_export.lc._fetch_classes = fetch_classes
+
+    # Act
+    await handle_batch("class", ["ansat", "email"], sql_exporter=sql_export)
+
+    # Assert
+    assert sql_export.session.execute(
+        select(Engagement.engagementstype_titel, Engagement.stillingsbetegnelse_titel)
+    ).all() == [("Medarbejder", "Ansat")]
+    assert sql_export.session.execute(
+        select(Adresse.adressetype_bvn, Adresse.adressetype_titel)
+    ).all() == [("mail", "E-mail")]
+    assert sql_export.lc.classes["ansat"]["title"] == "Medarbejder"
@@ -0,0 +1,79 @@
+import pytest
+
+from .. import gql_lora_cache_async
+from ..config import GqlLoraCacheSettings
+from ..fake_mo import FakeMOSession
+from ..fake_mo import SyntheticOrganisation
+from ..gql_lora_cache_async import GQLLoraCache
+from ..page_size import AdaptivePageSize
+
+
+def make(adaptive: bool = True, max_bytes: int | None = 1000) -> AdaptivePageSize:
+    return AdaptivePageSize(
+        initial=100,
+        minimum=10,
+        maximum=1000,
+        target_seconds=10,
+        max_bytes=max_bytes,
+        adaptive=adaptive,
+    )
+
+
+def test_page_size_grows_for_fast_small_pages():
+    sizes = make()
+    sizes.observe("classes", limit=100, count=100, seconds=1, size_bytes=100)
+    assert sizes.get("classes") == 200
+    assert sizes.get("units") == 100
+
+
+def test_page_size_shrinks_for_slow_or_large_pages():
+    sizes = make()
+    sizes.observe("engagements", limit=100, count=100, seconds=40, size_bytes=100)
+    assert sizes.get("engagements") == 50
+    sizes.observe("addresses", limit=100, count=100, seconds=1, size_bytes=1250)
+    assert sizes.get("addresses") == 80
+
+
+def test_page_size_is_clamped():
+    sizes = make()
+    for _ in range(10):
+        sizes.observe(
+            "classes", limit=sizes.get("classes"), count=1000, seconds=0, size_bytes=1
+        )
+    assert sizes.get("classes") == 1000
+    for _ in range(10):
+        sizes.timed_out("units", sizes.get("units"))
+    assert sizes.get("units") == 10
+
+
+def test_partial_pages_are_ignored():
+    sizes = make()
+    sizes.observe("classes", limit=100, count=3, seconds=1, size_bytes=10)
+    assert sizes.get("classes") == 100
+    assert sizes.sizes() == {}
+
+
+def test_non_adaptive_page_size_is_fixed():
+    sizes = make(adaptive=False)
+    sizes.observe("classes", limit=100, count=100, seconds=1, size_bytes=100)
+    sizes.timed_out("classes", 100)
+    assert sizes.get("classes") == 100
+
+
+def test_page_size_without_max_bytes_follows_latency():
+    sizes = make(max_bytes=None)
+    sizes.observe("addresses", limit=100, count=100, seconds=1)
+    assert sizes.get("addresses") == 200
+
+
+@pytest.mark.asyncio
+async def test_pages_are_only_measured_with_max_bytes(monkeypatch):
+    def dumps(*args, **kwargs):
+        raise AssertionError("Page measured")
+
+    monkeypatch.setattr(gql_lora_cache_async.json, "dumps", dumps)
+    lc = GQLLoraCache(settings=GqlLoraCacheSettings(std_page_size=3))
+    lc._gql_client_session = FakeMOSession(SyntheticOrganisation(employees=10))
+
+    assert await lc._fetch_engagements()
+    assert lc.page_sizes.get("engagements") > 3
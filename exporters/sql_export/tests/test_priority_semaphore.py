@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from ..priority_semaphore import PrioritySemaphore
+
+
+@pytest.mark.asyncio
+async def test_waiters_are_served_by_priority():
+    semaphore = PrioritySemaphore(1)
+    order = []
+
+    async def worker(name: str, priority: int) -> None:
+        async with semaphore.slot(priority):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    await semaphore.acquire()
+    tasks = [
+        asyncio.create_task(worker("low", 2)),
+        asyncio.create_task(worker("high", 0)),
+        asyncio.create_task(worker("also low", 2)),
+    ]
+    await asyncio.sleep(0)
+    assert semaphore.locked()
+    semaphore.release()
+    await asyncio.gather(*tasks)
+
+    assert order == ["high", "low", "also low"]
+    assert not semaphore.locked()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_leak_slot():
+    semaphore = PrioritySemaphore(1)
+    await semaphore.acquire()
+    waiter = asyncio.create_task(semaphore.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    semaphore.release()
+    assert not semaphore.locked()
@@ -0,0 +1,73 @@
+import pickle
+
+import pytest
+
+from ..gql_lora_cache_async import insert_obj
+from ..records import Record
+from ..records import deep_sizeof
+from ..records import to_record
+
+
+def test_to_record_is_read_compatible_with_dict():
+    engagement = {
+        "uuid": "00e96933-91e4-42ac-9881-0fe1738b2e59",
+        "user_key": "-",
+        "fraction": None,
+        "extensions": {"udvidelse_1": "a", "udvidelse_2": None},
+        "from_date": "2000-06-29",
+        "to_date": "9999-12-31",
+    }
+    record = to_record(dict(engagement))
+
+    assert isinstance(record, Record)
+    assert record == engagement
+    assert record["user_key"] == "-"
+    assert record.get("missing") is None
+    assert "fraction" in record
+    assert "missing" not in record
+    assert list(record.keys()) == list(engagement.keys())
+    assert dict(**record["extensions"]) == engagement["extensions"]
+    with pytest.raises(KeyError):
+        record["missing"]
+    # Mapping methods must not be reachable as keys
+    with pytest.raises(KeyError):
+        record["keys"]
+
+
+def test_to_record_interns_reference_fields():
+    unit_uuid = "1c690f27-35c5-5c02-975a-930e6b524805"
+    first = to_record({"unit": "".join(unit_uuid), "name": "a"})
+    second = to_record({"unit": "".join(unit_uuid), "name": "b"})
+    assert first["unit"] is second["unit"]
+    assert type(first) is type(second)
+
+
+def test_to_record_keeps_dicts_with_unusable_keys():
+    obj = {"not an identifier": 1}
+    assert to_record(obj) is obj
+    obj = {"items": 1}
+    assert to_record(obj) is obj
+
+
+def test_record_pickles():
+    record = to_record({"uuid": "x", "title": "y"})
+    assert pickle.loads(pickle.dumps(record)) == record
+
+
+def test_insert_obj_compact():
+    cache: dict = {}
+    insert_obj({"uuid": "a", "obj": [{"user": "b", "to_date": None}]}, cache, True)
+    insert_obj({"uuid": "a", "obj": [{"user": "c", "to_date": None}]}, cache, True)
+    assert cache == {
+        "a": [{"user": "b", "to_date": None}, {"user": "c", "to_date": None}]
+    }
+    assert all(isinstance(o, Record) for o in cache["a"])
+
+
+def test_records_use_less_memory_than_dicts():
+    dicts = {
+        str(i): [{"uuid": str(i), "user": "u", "unit": "e", "from_date": "2000-01-01"}]
+        for i in range(100)
+    }
+    records = {k: [to_record(dict(o)) for o in v] for k, v in dicts.items()}
+    assert deep_sizeof(records, set()) < deep_sizeof(dicts, set())
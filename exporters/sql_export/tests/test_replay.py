@@ -0,0 +1,46 @@
+import pytest
+
+from ..config import GqlLoraCacheSettings
+from ..fake_mo import FakeMOSession
+from ..fake_mo import SyntheticOrganisation
+from ..gql_lora_cache_async import GQLLoraCache
+from ..replay import RecordingSession
+from ..replay import ReplayMismatch
+from ..replay import ReplaySession
+
+
+def _lc(page_size: int) -> GQLLoraCache:
+    settings = GqlLoraCacheSettings(std_page_size=page_size, compact_records=False)
+    return GQLLoraCache(resolve_dar=False, settings=settings)
+
+
+@pytest.mark.asyncio
+async def test_replay_reproduces_recorded_fetch(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "recording.jsonl.gz"
+    organisation = SyntheticOrganisation(units=5, employees=20)
+
+    recorded = _lc(page_size=7)
+    session = RecordingSession(FakeMOSession(organisation), path)
+    recorded._gql_client_session = session
+    await recorded.populate_cache_async()
+    session.close()
+
+    # Served by the recorded cursors, whatever the page size
+    replayed = _lc(page_size=3)
+    replayed._gql_client_session = ReplaySession(path)
+    await replayed.populate_cache_async()
+
+    for name in ("units", "users", "engagements", "addresses", "classes", "managers"):
+        assert getattr(replayed, name) == getattr(recorded, name)
+
+
+@pytest.mark.asyncio
+async def test_replay_rejects_unrecorded_query(tmp_path):
+    path = tmp_path / "recording.jsonl.gz"
+    RecordingSession(None, path).close()
+
+    lc = _lc(page_size=7)
+    lc._gql_client_session = ReplaySession(path)
+    with pytest.raises(ReplayMismatch):
+        await lc._fetch_facets()
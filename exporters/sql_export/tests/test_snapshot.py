@@ -0,0 +1,83 @@
+import datetime
+from pathlib import Path
+
+import pytest
+
+from ..config import GqlLoraCacheSettings
+from ..gql_lora_cache_async import GQLLoraCache
+from ..snapshot import Snapshot
+from ..snapshot import SnapshotMismatch
+from ..snapshot import snapshot_path
+from ..snapshot import write_snapshot
+
+fingerprint = {"full_history": False, "skip_past": False, "resolve_dar": True}
+
+
+def test_snapshot_roundtrip(tmp_path):
+    path = tmp_path / "loracache.snapshot"
+    write_snapshot(
+        path, fingerprint, [("classes", {"a": {"title": "A"}}), ("units", {})]
+    )
+
+    snapshot = Snapshot(path, fingerprint)
+    assert "classes" in snapshot
+    assert "users" not in snapshot
+    assert snapshot.load("classes") == {"a": {"title": "A"}}
+    assert snapshot.load("units") == {}
+    snapshot.close()
+
+
+def test_snapshot_rejects_mismatch(tmp_path):
+    path = tmp_path / "loracache.snapshot"
+    write_snapshot(path, fingerprint, [("classes", {})])
+
+    with pytest.raises(SnapshotMismatch):
+        Snapshot(path, {**fingerprint, "resolve_dar": False})
+    with pytest.raises(SnapshotMismatch):
+        Snapshot(path, fingerprint, max_age=datetime.timedelta(0))
+    with pytest.raises(SnapshotMismatch):
+        Snapshot(tmp_path / "missing.snapshot", fingerprint)
+
+    path.write_bytes(b"garbage")
+    with pytest.raises(SnapshotMismatch):
+        Snapshot(path, fingerprint)
+
+
+def test_snapshot_path():
+    assert snapshot_path(
+        Path("tmp"), {"full_history": True, "skip_past": True, "resolve_dar": False}
+    ) == Path("tmp/loracache_historic_skip_past_no_dar.snapshot")
+
+
+@pytest.mark.asyncio
+async def test_populate_cache_loads_snapshot_lazily(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    lc = GQLLoraCache(resolve_dar=True)
+    (tmp_path / "tmp").mkdir()
+    write_snapshot(
+        snapshot_path(tmp_path / "tmp", lc.snapshot_fingerprint()),
+        lc.snapshot_fingerprint(),
+        [("classes", {"a": {"title": "A"}}), ("units", {"b": []})],
+    )
+
+    await lc.populate_cache_async(dry_run=True, skip_associations=True)
+
+    assert "classes" not in lc.__dict__
+    assert lc.classes == {"a": {"title": "A"}}
+    assert "classes" in lc.__dict__
+    assert lc.units == {"b": []}
+    # Collections missing from the snapshot keep their empty default
+    assert lc.associations == {}
+
+
+def test_snapshot_of_other_record_layout_is_not_used(tmp_path):
+    compact = GQLLoraCache(settings=GqlLoraCacheSettings(compact_records=True))
+    plain = GQLLoraCache(settings=GqlLoraCacheSettings(compact_records=False))
+    path = snapshot_path(tmp_path, compact.snapshot_fingerprint())
+    write_snapshot(path, compact.snapshot_fingerprint(), [("classes", {})])
+
+    # Both write the same file, but only the cache which wrote it can read it
+    assert snapshot_path(tmp_path, plain.snapshot_fingerprint()) == path
+    Snapshot(path, compact.snapshot_fingerprint()).close()
+    with pytest.raises(SnapshotMismatch):
+        Snapshot(path, plain.snapshot_fingerprint())
@@ -1,3 +1,4 @@
+import json
 import os
 import unittest.mock
 from collections import ChainMap
@@ -14,12 +15,16 @@ from hypothesis.strategies import booleans
 from more_itertools import one
 from parameterized import parameterized
 from sqlalchemy import inspect
+from sqlalchemy import select
 from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session
 
 from ..sql_export import SqlExport
+from ..sql_export import diff_rows
 from ..sql_export import wrap_export
 from ..sql_table_defs import Base
+from ..sql_table_defs import Bruger
+from ..sql_table_defs import Kvittering
 from ..sql_table_defs import WAdresse
 from ..sql_table_defs import WBruger
 from ..sql_table_defs import WEnhed
@@ -57,11 +62,18 @@ class FakeLC:
     def populate_cache(self, dry_run=False, skip_associations=False):
         raise NotImplementedError()
 
-    async def _fetch_users(self, uuid):
-        return self.users[str(uuid)]
+    @staticmethod
+    def _fetch(collection, uuids):
+        result = {}
+        for uuid in uuids:
+            result.update(collection.get(str(uuid), {}))
+        return result
 
-    async def _fetch_classes(self, uuid):
-        return self.classes[str(uuid)]
+    async def _fetch_users(self, uuids):
+        return self._fetch(self.users, uuids)
+
+    async def _fetch_classes(self, uuids):
+        return self._fetch(self.classes, uuids)
 
 
 class FakeLCSqlExport(SqlExport):
@@ -85,6 +97,9 @@ class _TestableSqlExport(SqlExport):
     def _get_export_cpr_setting(self) -> bool:
         return True
 
+    def _ensure_receipt_columns(self) -> None:
+        pass
+
     def _get_lora_cache(self, resolve_dar, use_pickle):  # type: ignore
         lc = FakeLC()
         if self.inject_lc:
@@ -167,6 +182,103 @@ def test_sql_export_tables():
     )
 
 
+def test_sql_export_indexes_survive_swap():
+    settings = {
+        "exporters.actual_state.type": "Memory",
+        "exporters.actual_state.db_name": "Whatever",
+    }
+    sql_export = FakeLCSqlExport(
+        force_sqlite=False,
+        historic=False,
+        settings=settings,
+    )
+    # Export twice, so the second swap also replaces existing tables
+    for _ in range(2):
+        sql_export.perform_export(resolve_dar=False, use_pickle=False)
+        assert {
+            index["name"]
+            for index in inspect(sql_export.engine).get_indexes("wbrugere")
+        } == {"ix_wbrugere_uuid"}
+        sql_export.swap_tables()
+
+    inspector = inspect(sql_export.engine)
+    assert {index["name"] for index in inspector.get_indexes("adresser")} == {
+        "ix_adresser_uuid",
+        "ix_adresser_bruger_uuid",
+        "ix_adresser_enhed_uuid",
+        "ix_adresser_adressetype_scope",
+    }
+    assert {index["name"] for index in inspector.get_indexes("leder_ansvar")} == {
+        "ix_leder_ansvar_leder_uuid"
+    }
+    assert inspector.get_indexes("klasser") == []
+
+
+def _mock_user(name: str) -> dict[str, Any]:
+    return {
+        "user_key": name,
+        "fornavn": name,
+        "efternavn": "Testesen",
+        "kaldenavn_fornavn": "",
+        "kaldenavn_efternavn": "",
+        "cpr": "0101701234",
+        "from_date": "2020-01-01",
+        "to_date": None,
+    }
+
+
+def test_sql_export_differential():
+    settings = {
+        "exporters.actual_state.type": "Memory",
+        "exporters.actual_state.db_name": "Whatever",
+        "exporters.actual_state.differential": True,
+    }
+    sql_export = FakeLCSqlExport(
+        force_sqlite=False,
+        historic=False,
+        settings=settings,
+    )
+    sql_export.lc = FakeLC()
+    sql_export.lc.users = {
+        "a": [_mock_user("Anna")],
+        "b": [_mock_user("Bent")],
+        "c": [_mock_user("Carl")],
+    }
+    sql_export.export(resolve_dar=False, use_pickle=False)
+
+    session = sql_export._get_db_session()
+    ids = dict(session.execute(select(Bruger.uuid, Bruger.id)).all())
+    sql_export.lc.users = {
+        "a": [_mock_user("Anna")],
+        "b": [_mock_user("Berit")],
+        "d": [_mock_user("Dorte")],
+    }
+    sql_export.export(resolve_dar=False, use_pickle=False)
+
+    # Written to the current tables, leaving the unchanged rows alone
+    assert not any(name[0] == "w" for name in sql_export.get_actual_tables())
+    users = session.execute(select(Bruger.uuid, Bruger.id, Bruger.fornavn)).all()
+    assert sorted(users) == [
+        ("a", ids["a"], "Anna"),
+        ("b", ids["b"], "Berit"),
+        ("d", unittest.mock.ANY, "Dorte"),
+    ]
+    receipts = session.execute(
+        select(
+            Kvittering.antal_indsat,
+            Kvittering.antal_opdateret,
+            Kvittering.antal_slettet,
+        ).order_by(Kvittering.id)
+    ).all()
+    assert receipts == [(3, 0, 0), (1, 1, 1)]
+    statistik = json.loads(
+        session.execute(
+            select(Kvittering.statistik).order_by(Kvittering.id.desc())
+        ).scalar()
+    )
+    assert statistik["tables"]["brugere"]["rows"] == 3
+
+
 def _mk_uuid() -> str:
     return str(uuid4())
 
@@ -217,6 +329,24 @@ def test_get_lora_class_returns_uuid_as_title_if_none():
     assert class_dict == {"title": uuid}
 
 
+def test_perform_export_runs_tasks_in_worker_sessions():
+    sql_export = _TestableSqlExport()
+    sql_export.export_workers = 4
+    sessions: list[MagicMock] = []
+
+    def get_db_session() -> MagicMock:
+        sessions.append(MagicMock())
+        return sessions[-1]
+
+    sql_export._get_db_session = get_db_session  # type: ignore
+    sql_export.perform_export()
+
+    # The main session, and one session per task
+    assert len(sessions) == 1 + 14
+    for session in sessions[1:]:
+        session.close.assert_called_once()
+
+
 @parameterized.expand(
     [
         (None,),
@@ -465,6 +595,29 @@ def test_sql_export_writes_it_users(primary_boolean: Optional[bool]):
     )
 
 
+def test_fingerprint_disregards_id():
+    user = Bruger(id=1, uuid="a", bvn="bvn", fornavn="Fornavn")
+    same_user = Bruger(id=2, uuid="a", bvn="bvn", fornavn="Fornavn", cpr=None)
+    other_user = Bruger(id=1, uuid="a", bvn="bvn", fornavn="Andet")
+
+    assert user.fingerprint() == same_user.fingerprint()
+    assert user == same_user
+    assert user != other_user
+
+
+def test_diff_rows():
+    def user(name: str) -> Bruger:
+        return Bruger(uuid="a", bvn="bvn", fornavn=name)
+
+    current = [user("kept"), user("removed"), user("duplicate"), user("duplicate")]
+    wanted = [user("kept"), user("duplicate"), user("new")]
+
+    removed, new = diff_rows(current, wanted)
+
+    assert [row.fornavn for row in removed] == ["removed", "duplicate"]
+    assert [row.fornavn for row in new] == ["new"]
+
+
 class TestEnsureSingleRun(unittest.TestCase):
     @patch("fastramqpi.ra_utils.load_settings.load_settings")
     @patch.object(SqlExport, "_get_engine")
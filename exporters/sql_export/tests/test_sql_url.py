@@ -75,6 +75,13 @@ def test_generate_db_type_and_name(settings, expected):
             },
             {"pool_pre_ping": True, "pool_recycle": 3600},
         ),
+        (
+            {
+                "exporters.actual_state.type": "MS-SQL-ODBC",
+                "exporters.actual_state.db_name": "db0",
+            },
+            {"pool_pre_ping": True, "fast_executemany": True},
+        ),
     ],
 )
 def test_generate_engine_settings(settings, expected):
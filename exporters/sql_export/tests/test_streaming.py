@@ -0,0 +1,75 @@
+import pytest
+
+from ..gql_lora_cache_async import GQLLoraCache
+from ..streaming import stream_collections
+
+
+class FakeStreamingLC:
+    def __init__(self, collections, fail=None):
+        self.collections = collections
+        self.fail = fail
+        self.classes = {}
+        self.facets = {}
+
+    async def _cache_lora_facets(self):
+        self.facets = {"f": {"user_key": "facet"}}
+
+    async def _cache_lora_classes(self):
+        self.classes = {"c": {"title": "class"}}
+
+    async def stream_collection(self, name, batch_size):
+        if name == self.fail:
+            raise ValueError(name)
+        for batch in self.collections[name]:
+            yield batch
+
+
+def test_stream_collections_yields_every_batch():
+    lc = FakeStreamingLC({"users": [{"a": [1]}, {"b": [2]}], "units": [{"c": [3]}]})
+
+    result = []
+    for name, batch in stream_collections(
+        lc, ["users", "units"], batch_size=1, max_pending=1
+    ):
+        # The lookup collections are available before the first batch
+        assert lc.classes
+        result.append((name, batch))
+
+    assert sorted(result, key=str) == sorted(
+        [("users", {"a": [1]}), ("users", {"b": [2]}), ("units", {"c": [3]})],
+        key=str,
+    )
+
+
+def test_stream_collections_raises_fetch_errors():
+    lc = FakeStreamingLC({"users": [{"a": [1]}]}, fail="units")
+
+    with pytest.raises(ExceptionGroup):
+        list(stream_collections(lc, ["users", "units"], batch_size=1, max_pending=1))
+
+
+def test_stream_collections_stops_fetching_when_consumer_stops():
+    lc = FakeStreamingLC({"users": [{str(i): [i]} for i in range(100)]})
+
+    batches = stream_collections(lc, ["users"], batch_size=1, max_pending=1)
+    assert next(batches) == ("users", {"0": [0]})
+    # Joins the fetching thread, which must not stay blocked on the full queue
+    batches.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_collection_batches_objects():
+    lc = GQLLoraCache()
+
+    async def iter_users(uuid=None):
+        for uuid in "abc":
+            yield {"uuid": uuid, "obj": [{"navn": uuid}]}
+
+    lc._iter_users = iter_users
+
+    batches = [batch async for batch in lc.stream_collection("users", batch_size=2)]
+
+    assert batches == [
+        {"a": [{"navn": "a"}], "b": [{"navn": "b"}]},
+        {"c": [{"navn": "c"}]},
+    ]
@@ -0,0 +1,100 @@
+import copy
+
+import pytest
+
+from .. import gql_lora_cache_async
+from ..config import GqlLoraCacheSettings
+from ..fake_mo import FakeMOSession
+from ..fake_mo import SyntheticOrganisation
+from ..gql_lora_cache_async import CACHE_COLLECTIONS
+from ..gql_lora_cache_async import TRANSFORMERS
+from ..gql_lora_cache_async import GQLLoraCache
+from ..gql_lora_cache_async import convert_dict
+from ..projection import ProjectedDict
+from ..transform import Transformer
+
+
+def _reference(transformer):
+    def convert(obj):
+        return convert_dict(
+            obj,
+            resolve_object=transformer.resolve_object,
+            resolve_validity=transformer.resolve_validity,
+            replace_dict=transformer.renames,
+        )
+
+    return convert
+
+
+def _layout(collection):
+    """Return the collection with the keys of every object, in order."""
+    if not isinstance(collection, dict):
+        return collection
+    return [(key, _layout(value)) for key, value in collection.items()]
+
+
+async def _populate(organisation, full_history):
+    lc = GQLLoraCache(
+        full_history=full_history,
+        settings=GqlLoraCacheSettings(compact_records=False),
+    )
+    lc._gql_client_session = FakeMOSession(organisation)
+    await lc.populate_cache_async()
+    return lc
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("full_history", [False, True])
+async def test_transformers_equal_convert_dict(tmp_path, monkeypatch, full_history):
+    monkeypatch.chdir(tmp_path)
+    organisation = SyntheticOrganisation(units=8, employees=30, history=2)
+    compiled = await _populate(organisation, full_history)
+    monkeypatch.setattr(
+        gql_lora_cache_async,
+        "TRANSFORMERS",
+        {name: _reference(t) for name, t in TRANSFORMERS.items()},
+    )
+    reference = await _populate(organisation, full_history)
+
+    for name in CACHE_COLLECTIONS:
+        assert _layout(getattr(compiled, name)) == _layout(getattr(reference, name))
+    assert compiled.engagements
+
+
+@pytest.mark.parametrize(
+    "obj",
+    [
+        {"uuid": "a", "name": "A", "validity": {"from": None, "to": None}},
+        {
+            "uuid": "a",
+            "name": "A",
+            "parent_uuid": "p",
+            "validity": {"from": "2020-02-03T00:00:00+01:00", "to": "2021-01-01"},
+        },
+        # A renamed field replacing a kept one keeps its place
+        {"navn": "old", "uuid": "a", "name": "A", "validity": {"from": "2020-02-03"}},
+    ],
+)
+def test_transformer_equals_convert_dict(obj):
+    transformer = Transformer({"name": "navn", "parent_uuid": "parent"})
+    expected = convert_dict(
+        {"uuid": "a", "obj": [copy.deepcopy(obj)]},
+        replace_dict={"name": "navn", "parent_uuid": "parent"},
+    )
+    result = transformer({"uuid": "a", "obj": [copy.deepcopy(obj)]})
+    assert _layout(result) == _layout(expected)
+    # The function compiled for the layout is used again
+    assert transformer({"uuid": "a", "obj": [copy.deepcopy(obj)]}) == expected
+    assert len(transformer._compiled) == 1
+
+
+def test_transformer_of_missing_and_projected_objects():
+    transformer = Transformer({"name": "navn"})
+    assert transformer({"uuid": "a", "obj": [None]}) == {}
+
+    obj = ProjectedDict(
+        {"uuid": "a", "validity": {"from": None, "to": None}}, frozenset({"navn"})
+    )
+    result = transformer({"uuid": "a", "obj": [obj]})["obj"][0]
+    assert isinstance(result, ProjectedDict)
+    assert result.omitted == frozenset({"navn"})
@@ -0,0 +1,97 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+"""Compiled transformers from query results to cache objects.
+
+`convert_dict` renames the fields of every object and resolves its validity by
+walking the mapping of renames and checking every field, for each object. A
+`Transformer` does the same from a declarative mapping of renames, but generates
+a function per layout of keys it is given, with the renames of that layout
+unrolled. The function is compiled on first use, and the objects of a collection
+nearly always share one or two layouts, so the work per object is a lookup and
+a call.
+"""
+
+import datetime
+from functools import lru_cache
+from typing import Callable
+
+
+@lru_cache(maxsize=4096)
+def _from_date(value: str | None) -> str:
+    if not value:
+        return str(datetime.datetime(1, 1, 1).date())
+    return str(datetime.datetime.fromisoformat(value).date())
+
+
+@lru_cache(maxsize=4096)
+def _to_date(value: str | None) -> str:
+    if not value:
+        return "9999-12-31"
+    return str(datetime.datetime.fromisoformat(value).date())
+
+
+class Transformer:
+    """Turns the objects of a query into cache objects, like `convert_dict`.
+
+    `renames` maps the fields of the query to the keys of the cache objects. With
+    `resolve_validity`, the validity of each object becomes `from_date` and
+    `to_date`. With `resolve_object`, the query result is one uuid and a list of
+    validities, otherwise a single current object.
+    """
+
+    def __init__(
+        self,
+        renames: dict[str, str] | None = None,
+        resolve_object: bool = True,
+        resolve_validity: bool = True,
+    ) -> None:
+        self.renames = renames or {}
+        self.resolve_object = resolve_object
+        self.resolve_validity = resolve_validity
+        self._compiled: dict[tuple, Callable[[dict], dict]] = {}
+
+    def __call__(self, query_res: dict) -> dict:
+        uuid = query_res["uuid"]
+        if not self.resolve_object:
+            return {uuid: self.transform(query_res["obj"])}
+        obj_list = []
+        for obj in query_res["obj"]:
+            if obj is None:
+                return {}
+            obj_list.append(self.transform(obj))
+        return {"uuid": uuid, "obj": obj_list}
+
+    def transform(self, obj: dict) -> dict:
+        """Turn a single object of the query into a cache object, in place."""
+        validity = tuple(obj["validity"]) if self.resolve_validity else ()
+        layout = (tuple(obj), validity)
+        function = self._compiled.get(layout)
+        if function is None:
+            function = self._compiled[layout] = self._compile(*layout)
+        return function(obj)
+
+    def _compile(
+        self, keys: tuple[str, ...], validity: tuple[str, ...]
+    ) -> Callable[[dict], dict]:
+        # The same steps as `convert_dict`, in the same order so the keys come out
+        # in the same order, but unrolled for the keys of the layout. The object
+        # is changed in place, as creating a new dict for every object of a large
+        # collection costs more in garbage collection than it saves.
+        lines = ["def transform(d):"]
+        if self.resolve_validity:
+            lines.append("    v = d.pop('validity')")
+            if "from" in validity:
+                lines.append("    d['from_date'] = _from_date(v['from'])")
+            if "to" in validity:
+                lines.append("    d['to_date'] = _to_date(v['to'])")
+        lines.extend(
+            f"    d[{new!r}] = d.pop({old!r})"
+            for old, new in self.renames.items()
+            if old in keys
+        )
+        lines.append("    return d")
+        namespace = {"_from_date": _from_date, "_to_date": _to_date}
+        source = "\n".join(lines) + "\n"
+        exec(compile(source, f"<transform {', '.join(keys)}>", "exec"), namespace)
+        return namespace["transform"]  # type: ignore
@@ -34,12 +34,10 @@ def refresh_db(
             historic=historic,
             settings=database_settings.to_old_settings(),
         )
-        sql_export.perform_export(
+        sql_export.export(
             resolve_dar=resolve_dar,
             use_pickle=read_from_cache,
         )
-
-        sql_export.swap_tables()
         logger.info("*SQL export ended*")
         dipex_last_success_timestamp.set_to_current_time()
     finally:
@@ -207,9 +207,8 @@ class AdMoSync:
         if lora_speedup:
             print("Retrieve LoRa dump")
             lc = LoraCache(resolve_dar=False, full_history=False)
-            lc.populate_cache(skip_associations=True, dry_run=False)
-            # skip reading lora - not for prod
-            # lc.populate_cache(dry_run=True, skip_associations=True)
+            # Reuses the cache snapshot if USE_CACHED_LORACACHE is set
+            lc.populate_cache(skip_associations=True)
             lc.calculate_primary_engagements()
             print("Done")
             return lc
@@ -3,6 +3,20 @@ from typing import Optional
 
 from fastramqpi.os2mo_dar_client import DARClient
 
+from exporters.sql_export.config import get_gql_cache_settings
+from exporters.sql_export.dar_cache import PersistentDARCache
+
+
+@lru_cache(maxsize=None)
+def _persistent_cache() -> Optional[PersistentDARCache]:
+    """The persistent DAR cache of the LoRa cache, if it is configured."""
+    settings = get_gql_cache_settings()
+    if settings.dar_cache_path is None:
+        return None
+    return PersistentDARCache(
+        settings.dar_cache_path, settings.dar_cache_ttl, table="vask"
+    )
+
 
 @lru_cache(maxsize=None)
 def dawa_lookup(street_name: str, postal_code: str) -> Optional[str]:
@@ -20,6 +34,12 @@ def dawa_lookup(street_name: str, postal_code: str) -> Optional[str]:
     """
     combined_address_string = f"{street_name}, {postal_code}"
 
+    cache = _persistent_cache()
+    if cache is not None:
+        cached = cache.get(combined_address_string)
+        if cached is not None:
+            return cached["id"]
+
     dar_uuid = None
     try:
         darclient = DARClient()
@@ -28,4 +48,6 @@ def dawa_lookup(street_name: str, postal_code: str) -> Optional[str]:
             dar_uuid = dar_reply["id"]  # type: ignore
     except Exception as exp:
         print(exp, " during dawa_lookup")
+    if cache is not None and dar_uuid is not None:
+        cache.put(combined_address_string, {"id": dar_uuid})
     return dar_uuid